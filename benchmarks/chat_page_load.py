@@ -0,0 +1,63 @@
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import argparse
+import requests
+import json
+import time
+
+# Prueba de carga de la página HTML /chat: envía el formulario con varios
+# clientes concurrentes y reporta códigos de estado y latencias.
+#
+# Para comprobar que la página no se bloquea con un solo worker (antes hacía
+# una petición HTTP a sí misma y podía quedarse esperando a otro worker):
+#   OPENAI_API_BASE=http://127.0.0.1:8001/v1 gunicorn -c gunicorn.conf.py -w 1 main:app
+#   python benchmarks/chat_page_load.py --url http://127.0.0.1:5000/chat --concurrency 16
+
+
+def send_question(url, question, timeout):
+    start = time.perf_counter()
+    try:
+        response = requests.post(url, data={"question": question}, timeout=timeout)
+        status = response.status_code
+    except requests.RequestException as e:
+        status = type(e).__name__
+    return status, (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:5000/chat")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--question", default="¿Hacen envíos a provincia?")
+    args = parser.parse_args()
+
+    # Preguntas distintas para no medir solo la caché de respuestas
+    questions = [f"{args.question} {i}" for i in range(args.requests)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(lambda question: send_question(args.url, question, args.timeout), questions))
+    elapsed = time.perf_counter() - start
+
+    statuses = {}
+    for status, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    latencies = [latency for _, latency in results]
+
+    print(json.dumps({
+        "url": args.url,
+        "concurrency": args.concurrency,
+        "requests": args.requests,
+        "statuses": statuses,
+        "throughput_rps": args.requests / elapsed,
+        "latency_ms": {
+            "p50": float(np.percentile(latencies, 50)),
+            "p95": float(np.percentile(latencies, 95)),
+            "max": float(np.max(latencies)),
+        },
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import numpy as np
+import tracemalloc
+import argparse
+import json
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.covisitation import (
+    build_from_arrays, apply_new_visits, split_watermark, window_bounds, CovisitationIndex,
+)
+
+# Construcción de la matriz de co-visitas a partir de arrays sintéticos (sin
+# base de datos): tiempo y memoria de la construcción completa, tiempo de la
+# actualización incremental con las últimas visitas y de /also_viewed. La
+# actualización incluye visitas con fecha atrasada y se comprueba que su
+# resultado es igual al de la construcción completa.
+#
+# Uso: python benchmarks/covisitation_benchmark.py --visits 1000000 5000000 10000000
+
+
+def synthetic_visits(rng, visits, users, products, days=60):
+    # Popularidad de productos y actividad de usuarios con ley de potencias,
+    # como en benchmarks/synthetic_data.py; las visitas de cada usuario se
+    # concentran en sesiones de pocos minutos.
+    product_weights = 1.0 / np.arange(1, products + 1) ** 1.1
+    user_weights = 1.0 / np.arange(1, users + 1) ** 0.8
+    user_ids = rng.choice(users, size=visits, p=user_weights / user_weights.sum()) + 1
+    product_ids = rng.choice(products, size=visits, p=product_weights / product_weights.sum()) + 1
+    sessions = rng.integers(0, days * 24, size=visits) * 3600
+    # Los ids crecen con la fecha, como al registrarse las visitas
+    times = np.sort(sessions + rng.integers(0, 600, size=visits))
+    return np.arange(1, visits + 1, dtype=np.int64), user_ids.astype(np.int64), product_ids.astype(np.int64), times.astype(np.int64)
+
+
+def update(index, visit_ids, users, products, times):
+    # Mismo cálculo que update_covisitation_index, con los arrays en memoria.
+    new = (visit_ids > index.watermark) & ~np.isin(visit_ids, index.recent_ids)
+    since, until = window_bounds(times[new])
+    context = np.isin(users, np.unique(users[new])) & (times >= since) & (times < until)
+    return apply_new_visits(index, visit_ids[new], (visit_ids[context], users[context], products[context], times[context]))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--visits", type=int, nargs="+", default=[1_000_000, 5_000_000])
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--products", type=int, default=50_000)
+    parser.add_argument("--new-visits", type=int, default=10_000, help="Visitas de la actualización incremental")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    report = []
+    for visits in args.visits:
+        visit_ids, users, products, times = synthetic_visits(rng, visits, args.users, args.products)
+        old = visit_ids <= visits - args.new_visits
+        # Un 1% de las visitas nuevas llega con fecha de hasta 10 días antes
+        late = ~old & (rng.random(visits) < 0.01)
+        times[late] -= rng.integers(0, 10 * 86400, size=int(late.sum()))
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        matrix = build_from_arrays(visit_ids[old], users[old], products[old], times[old])
+        build_s = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        watermark, recent_ids = split_watermark(visit_ids[old])
+        start = time.perf_counter()
+        index = update(CovisitationIndex(matrix, watermark, recent_ids), visit_ids, users, products, times)
+        update_s = time.perf_counter() - start
+        updated = index.matrix
+
+        full = build_from_arrays(visit_ids, users, products, times, updated.shape[0])
+        differing_cells = int((abs(updated - full) > 0).sum())
+        queries = rng.choice(np.unique(products), size=1000)
+        start = time.perf_counter()
+        for product_id in queries:
+            index.also_viewed(int(product_id), limit=10)
+        also_viewed_us = (time.perf_counter() - start) * 1e6 / len(queries)
+
+        report.append({
+            "visits": visits,
+            "pairs": int(updated.nnz),
+            "build_s": build_s,
+            "build_peak_mb": peak / 2**20,
+            "matrix_mb": (updated.data.nbytes + updated.indices.nbytes + updated.indptr.nbytes) / 2**20,
+            "incremental_update_s": update_s,
+            "incremental_visits": args.new_visits,
+            "incremental_differing_cells": differing_cells,
+            "also_viewed_us": also_viewed_us,
+        })
+        print(json.dumps(report[-1]), file=sys.stderr)
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
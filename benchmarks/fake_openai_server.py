@@ -0,0 +1,68 @@
+from flask import Flask, Response, request, jsonify
+import argparse
+import json
+import time
+
+# Servidor local que imita /v1/chat/completions de OpenAI (con y sin stream)
+# para probar el chatbot y medir sin llamar a la API real.
+#
+#   python benchmarks/fake_openai_server.py --port 8001 --token-delay 0.02
+#   OPENAI_API_BASE=http://127.0.0.1:8001/v1 OPENAI_API_KEY=fake python main.py
+
+app = Flask(__name__)
+app.config["TOKEN_DELAY"] = 0.0
+app.config["LATENCY"] = 0.0
+
+RESPUESTA = "Gracias por tu consulta. Te recomiendo revisar las opciones disponibles en MarkeTech."
+
+
+def completion_text(messages):
+    prompt = messages[-1]["content"] if messages else ""
+    # Las consultas de clasificación de intención esperan solo la etiqueta
+    if "Responde únicamente con una de las categorías" in prompt:
+        if "envío" in prompt or "devoluc" in prompt or "horario" in prompt:
+            return "consulta_tienda"
+        return "busqueda_producto"
+    return RESPUESTA
+
+
+@app.route("/v1/chat/completions", methods=["POST"])
+def chat_completions():
+    body = request.get_json()
+    text = completion_text(body.get("messages", []))
+    time.sleep(app.config["LATENCY"])
+
+    if not body.get("stream"):
+        return jsonify({
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "model": body.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+        })
+
+    def generate():
+        for position, token in enumerate(text.split(" ")):
+            time.sleep(app.config["TOKEN_DELAY"])
+            content = token if position == 0 else " " + token
+            chunk = {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "model": body.get("model"),
+                "choices": [{"index": 0, "delta": {"content": content}, "finish_reason": None}],
+            }
+            yield f"data: {json.dumps(chunk)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return Response(generate(), mimetype="text/event-stream")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.0, help="Segundos antes de responder")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="Segundos entre fragmentos en modo stream")
+    args = parser.parse_args()
+
+    app.config["LATENCY"] = args.latency
+    app.config["TOKEN_DELAY"] = args.token_delay
+    app.run(host="127.0.0.1", port=args.port, threaded=True)
@@ -0,0 +1,70 @@
+import numpy as np
+import argparse
+import json
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Solo se necesita el modelo; no cargar vectores ni metadatos del chatbot
+os.environ.setdefault("CHAT_PRELOAD", "manual")
+
+from services.intent_classifier import (
+    EXAMPLES_PATH, INTENT_TARGET_ACCURACY, load_examples, build_prototypes, classify_vectors,
+    cross_validate, calibrate_threshold,
+)
+from services import chat_resources
+
+# Evaluación offline del clasificador local de intención: exactitud con
+# validación cruzada estratificada, cobertura y exactitud por umbral de
+# confianza (lo que no supera el umbral iría a GPT) y latencia por consulta.
+# `calibrated_threshold` es el umbral que usa el servicio si no se fija
+# INTENT_CONFIDENCE_THRESHOLD (ver services/intent_classifier.py).
+#
+# Uso: python benchmarks/intent_classifier_eval.py --folds 5 --target-accuracy 0.95
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--examples", default=EXAMPLES_PATH)
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.0, 0.02, 0.05, 0.1, 0.15])
+    parser.add_argument("--target-accuracy", type=float, default=INTENT_TARGET_ACCURACY)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(chat_resources.MODEL_NAME)
+    chat_resources.set_model(model)
+    questions, labels = load_examples(args.examples)
+    # Igual que el servicio: los ejemplos pasan por encode_queries como las consultas
+    vectors = chat_resources.encode_queries(questions)
+
+    correct, confidences = cross_validate(vectors, labels, args.folds, args.seed)
+    calibrated = calibrate_threshold(correct, confidences, args.target_accuracy)
+    report = {
+        "examples": len(labels), "folds": args.folds, "accuracy": float(correct.mean()),
+        "target_accuracy": args.target_accuracy, "calibrated_threshold": calibrated, "thresholds": [],
+    }
+    for threshold in sorted(set(args.thresholds) | {calibrated} - {float("inf")}):
+        local = confidences >= threshold
+        report["thresholds"].append({
+            "threshold": threshold,
+            "local_coverage": float(local.mean()),
+            "local_accuracy": float(correct[local].mean()) if local.any() else None,
+        })
+
+    # Latencia de extremo a extremo de una consulta (encode + prototipos)
+    all_labels, prototypes = build_prototypes(vectors, labels)
+    latencies = []
+    for question in questions:
+        start = time.perf_counter()
+        classify_vectors(model.encode([question]), all_labels, prototypes)
+        latencies.append((time.perf_counter() - start) * 1000)
+    report["latency_ms"] = {"p50": float(np.percentile(latencies, 50)), "p95": float(np.percentile(latencies, 95))}
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+from scipy.spatial.distance import cdist
+import numpy as np
+import argparse
+import json
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.vector_index import VectorIndex
+
+# Compara la búsqueda exacta del índice (y la anterior con cdist + argsort)
+# contra el modo aproximado IVF: recall@k y latencia por consulta.
+#
+# Uso: python benchmarks/vector_search_benchmark.py --products 50000 --queries 200
+
+
+def load_vectors(args):
+    if args.products is None:
+        return np.load(args.vectors)
+
+    # Catálogo sintético agrupado, parecido a embeddings reales
+    rng = np.random.default_rng(args.seed)
+    centers = rng.standard_normal((max(1, args.products // 100), args.dim)).astype(np.float32)
+    labels = rng.integers(len(centers), size=args.products)
+    return centers[labels] + 0.5 * rng.standard_normal((args.products, args.dim)).astype(np.float32)
+
+
+def time_queries(search, queries):
+    results = []
+    start = time.perf_counter()
+    for query in queries:
+        results.append(search(query))
+    elapsed = time.perf_counter() - start
+    return results, elapsed * 1000 / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vectors", default="utils/product_vectors.npy")
+    parser.add_argument("--products", type=int, default=None, help="Generar un catálogo sintético de este tamaño")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--n-lists", type=int, default=None)
+    parser.add_argument("--n-probe", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    vectors = load_vectors(args)
+    rng = np.random.default_rng(args.seed + 1)
+    queries = vectors[rng.integers(len(vectors), size=args.queries)]
+    queries = queries + 0.1 * rng.standard_normal(queries.shape).astype(np.float32)
+
+    index = VectorIndex(vectors)
+    report = {"products": len(vectors), "dim": vectors.shape[1], "k": args.k, "queries": args.queries}
+
+    _, report["cdist_ms"] = time_queries(
+        lambda query: np.argsort(cdist([query], vectors, metric="cosine")[0])[:args.k], queries
+    )
+    exact, report["exact_ms"] = time_queries(lambda query: index.search(query, k=args.k)[0], queries)
+
+    start = time.perf_counter()
+    index.build_ivf(n_lists=args.n_lists)
+    report["ivf_build_s"] = time.perf_counter() - start
+    report["ivf_lists"] = len(index.lists)
+
+    report["ivf"] = []
+    for n_probe in args.n_probe:
+        approx, latency = time_queries(
+            lambda query: index.search(query, k=args.k, approximate=True, n_probe=n_probe)[0], queries
+        )
+        recall = np.mean([len(set(a) & set(e)) / len(e) for a, e in zip(approx, exact)])
+        report["ivf"].append({"n_probe": n_probe, "recall": float(recall), "ms": latency})
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import pandas as pd
+import numpy as np
+import argparse
+import tempfile
+import json
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.vector_index import VectorIndex
+from services.vector_store import VECTOR_DTYPES, write_store, read_store
+
+# Compara el formato anterior (product_vectors.npy + CSV) con el almacén por
+# versiones en cada tipo de vector: tamaño en disco, tiempo de apertura,
+# latencia de búsqueda y pérdida de recall@k frente a la búsqueda float32.
+#
+# Uso: python benchmarks/vector_store_benchmark.py
+#      python benchmarks/vector_store_benchmark.py --products 100000
+
+
+def load_catalog(args):
+    if args.products is None:
+        return np.load(args.vectors), pd.read_csv(args.metadata)
+
+    rng = np.random.default_rng(args.seed)
+    centers = rng.standard_normal((max(1, args.products // 100), args.dim)).astype(np.float32)
+    labels = rng.integers(len(centers), size=args.products)
+    vectors = centers[labels] + 0.5 * rng.standard_normal((args.products, args.dim)).astype(np.float32)
+    metadata = pd.DataFrame({
+        "id": np.arange(1, args.products + 1),
+        "product_name": [f"Producto {i}" for i in range(args.products)],
+        "product_description": [f"Descripción del producto {i} " * 5 for i in range(args.products)],
+        "category": [f"Categoría {label % 20}" for label in labels],
+        "product_price": rng.uniform(10, 2000, args.products).round(2),
+    })
+    return vectors, metadata
+
+
+def directory_size(directory):
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(directory) for name in names
+    )
+
+
+def run_queries(index, queries, k):
+    start = time.perf_counter()
+    results = [index.search(query, k=k) for query in queries]
+    return results, (time.perf_counter() - start) * 1000 / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vectors", default="utils/product_vectors.npy")
+    parser.add_argument("--metadata", default="utils/product_metadata.csv")
+    parser.add_argument("--products", type=int, default=None, help="Generar un catálogo sintético de este tamaño")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    vectors, metadata = load_catalog(args)
+    rng = np.random.default_rng(args.seed + 1)
+    queries = vectors[rng.integers(len(vectors), size=args.queries)]
+    queries = queries + 0.1 * rng.standard_normal(queries.shape).astype(np.float32)
+    report = {"products": len(vectors), "dim": vectors.shape[1], "k": args.k, "queries": args.queries}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Formato anterior: .npy + CSV leídos por completo y normalizados al cargar
+        np.save(os.path.join(tmp, "legacy.npy"), vectors)
+        metadata.to_csv(os.path.join(tmp, "legacy.csv"), index=False)
+        start = time.perf_counter()
+        legacy_index = VectorIndex(np.load(os.path.join(tmp, "legacy.npy")), pd.read_csv(os.path.join(tmp, "legacy.csv")))
+        legacy_open_ms = (time.perf_counter() - start) * 1000
+        exact, legacy_ms = run_queries(legacy_index, queries, args.k)
+        report["legacy"] = {
+            "bytes": os.path.getsize(os.path.join(tmp, "legacy.npy")) + os.path.getsize(os.path.join(tmp, "legacy.csv")),
+            "open_ms": legacy_open_ms,
+            "query_ms": legacy_ms,
+        }
+
+        report["store"] = []
+        for dtype in VECTOR_DTYPES:
+            directory = os.path.join(tmp, dtype)
+            write_store(directory, vectors, metadata, {"version": dtype}, dtype=dtype)
+
+            start = time.perf_counter()
+            store = read_store(directory)
+            index = VectorIndex(store.vectors, store.metadata, normalized=True, scales=store.scales)
+            open_ms = (time.perf_counter() - start) * 1000
+            results, query_ms = run_queries(index, queries, args.k)
+
+            recall = np.mean([len(set(rows) & set(e_rows)) / len(e_rows) for (rows, _), (e_rows, _) in zip(results, exact)])
+            score_error = np.max([np.abs(scores - e_scores).max() for (_, scores), (_, e_scores) in zip(results, exact)])
+            report["store"].append({
+                "dtype": dtype,
+                "bytes": directory_size(directory),
+                "vector_bytes": os.path.getsize(os.path.join(directory, "vectors.npy")),
+                "open_ms": open_ms,
+                "query_ms": query_ms,
+                "recall": float(recall),
+                "max_top_k_score_error": float(score_error),
+            })
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
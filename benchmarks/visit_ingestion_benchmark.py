@@ -0,0 +1,87 @@
+from flask import Flask
+import numpy as np
+import tempfile
+import argparse
+import json
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Registro de visitas: eventos por segundo insertando fila por fila con el ORM
+# (un commit por visita, como antes de POST /product_visited), fila por fila
+# sin ORM y con el buffer de services/visit_ingestion.py (INSERT de varias
+# filas por bloque). Usa DATABASE_URL o un SQLite temporal.
+#
+# Uso: python benchmarks/visit_ingestion_benchmark.py --events 20000 --flush-size 100 500 2000
+
+
+def visit_rows(rng, events, users, products):
+    user_ids = rng.integers(1, users + 1, size=events)
+    product_ids = rng.integers(1, products + 1, size=events)
+    return [{"user_id": int(user_id), "product_id": int(product_id)} for user_id, product_id in zip(user_ids, product_ids)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=20_000)
+    parser.add_argument("--orm-events", type=int, default=2_000, help="Eventos de los métodos fila por fila")
+    parser.add_argument("--flush-size", type=int, nargs="+", default=[100, 500, 2000])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="marketech-ingestion-")
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+
+    from database.database import db, init_app
+    from models.models import MarketechProductVisited
+    from services.visit_ingestion import VisitBuffer, parse_visits
+    from benchmarks import synthetic_data
+
+    app = Flask(__name__)
+    init_app(app)
+    rng = np.random.default_rng(args.seed)
+    report = {"database": os.environ["DATABASE_URL"].split(":", 1)[0], "events_per_s": {}}
+
+    with app.app_context():
+        sizes = synthetic_data.generate("small", args.seed, visits=1)
+        table = MarketechProductVisited.__table__
+
+        def measure(name, events, insert):
+            rows = parse_visits(visit_rows(rng, events, sizes["users"], sizes["products"]))
+            start = time.perf_counter()
+            insert(rows)
+            report["events_per_s"][name] = events / (time.perf_counter() - start)
+            print(name, f"{report['events_per_s'][name]:.0f} eventos/s", file=sys.stderr)
+
+        def orm_per_row(rows):
+            for row in rows:
+                db.session.add(MarketechProductVisited(**row))
+                db.session.commit()
+
+        def core_per_row(rows):
+            for row in rows:
+                db.session.execute(table.insert(), [row])
+                db.session.commit()
+
+        measure("orm_per_row", args.orm_events, orm_per_row)
+        measure("core_per_row", args.orm_events, core_per_row)
+
+        for flush_size in args.flush_size:
+            def buffered(rows):
+                # Mismo camino que la ruta: add() por petición de una visita y flush por bloques
+                buffer = VisitBuffer(flush_size=flush_size, max_size=len(rows))
+                for row in rows:
+                    buffer.add([row])
+                    if len(buffer) >= flush_size:
+                        buffer.flush()
+                buffer.stop()
+
+            measure(f"buffer_flush_{flush_size}", args.events, buffered)
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
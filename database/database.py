@@ -1,12 +1,130 @@
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy.pool import QueuePool
+from sqlalchemy import exc
 from dotenv import load_dotenv
+import contextvars
+import functools
+import threading
+import time
 import os
 
 load_dotenv()
 
-db = SQLAlchemy()
+# Conexiones: tamaño del pool, desborde, reciclado (por debajo del wait_timeout
+# de MySQL para no reutilizar conexiones cerradas por el servidor), pre-ping y
+# espera máxima para obtener una conexión. Con DB_REPLICA_HOST (o
+# DATABASE_REPLICA_URL) se crea el bind "replica" y las funciones marcadas con
+# @read_replica leen de él; las escrituras siempre van al primario.
+REPLICA_BIND = "replica"
+
+_use_replica = contextvars.ContextVar("use_replica", default=False)
+
+
+class RoutingSession(Session):
+    # Dentro de @read_replica las lecturas usan el bind de réplica si está configurado.
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and _use_replica.get() and not self._flushing:
+            engines = self._db.engines
+            if REPLICA_BIND in engines:
+                return engines[REPLICA_BIND]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+
+
+def read_replica(func):
+    # Marca una función de solo lectura: sus consultas van a la réplica.
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token = _use_replica.set(True)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _use_replica.reset(token)
+    return wrapper
+
+
+class TimedQueuePool(QueuePool):
+    # QueuePool que mide cuánto se espera para obtener una conexión.
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self._stats_lock = threading.Lock()
+
+    def connect(self):
+        # Incluye la espera en la cola, la creación de conexiones nuevas y el pre-ping
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            with self._stats_lock:
+                self.checkouts += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+
+
+def database_url():
+    return os.getenv("DATABASE_URL") or f"mysql+pymysql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}/{os.getenv('DB_NAME')}"
+
+
+def replica_url():
+    if os.getenv("DATABASE_REPLICA_URL"):
+        return os.getenv("DATABASE_REPLICA_URL")
+    if os.getenv("DB_REPLICA_HOST"):
+        return f"mysql+pymysql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_REPLICA_HOST')}/{os.getenv('DB_NAME')}"
+    return None
+
+
+def engine_options(url):
+    # SQLite (pruebas y benchmarks) usa su propio pool y no admite estas opciones
+    if url.startswith("sqlite"):
+        return {}
+    return {
+        "poolclass": TimedQueuePool,
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "10")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "20")),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "280")),
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "1") == "1",
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+    }
+
 
 def init_app(app):
-    app.config['SQLALCHEMY_DATABASE_URI'] = f"mysql+pymysql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}/{os.getenv('DB_NAME')}"
+    url = database_url()
+    app.config['SQLALCHEMY_DATABASE_URI'] = url
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(url)
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-    db.init_app(app)
\ No newline at end of file
+
+    replica = replica_url()
+    if replica:
+        app.config['SQLALCHEMY_BINDS'] = {REPLICA_BIND: {"url": replica, **engine_options(replica)}}
+    db.init_app(app)
+
+
+def get_pool_stats():
+    # Estado de cada pool (primario y réplica) y tiempos de espera al obtener conexión.
+    stats = {}
+    for bind, engine in db.engines.items():
+        pool = engine.pool
+        entry = {"class": type(pool).__name__}
+        if isinstance(pool, QueuePool):
+            entry.update(size=pool.size(), checked_out=pool.checkedout(), overflow=pool.overflow())
+        if isinstance(pool, TimedQueuePool):
+            entry.update(
+                checkouts=pool.checkouts,
+                timeouts=pool.timeouts,
+                wait_ms_avg=pool.wait_total * 1000 / pool.checkouts if pool.checkouts else 0.0,
+                wait_ms_max=pool.wait_max * 1000,
+            )
+        stats[bind or "primary"] = entry
+    return stats
@@ -0,0 +1,47 @@
+import gc
+import os
+
+# Configuración de gunicorn: `gunicorn -c gunicorn.conf.py main:app`
+#
+# Con preload_app el proceso maestro importa la aplicación (y con ella el modelo
+# de embeddings, los vectores y los metadatos del chatbot) una sola vez; los
+# workers se crean con fork y comparten esa memoria copy-on-write.
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.getenv("GUNICORN_WORKERS", "2"))
+threads = int(os.getenv("GUNICORN_THREADS", "1"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+
+if preload_app:
+    os.environ.setdefault("CHAT_PRELOAD", "import")
+    # El calentamiento se hace en cada worker para no crear hilos de torch antes del fork
+    os.environ.setdefault("CHAT_DEFER_WARMUP", "1")
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+
+
+def pre_fork(server, worker):
+    # Congela los objetos ya cargados para que el recolector de basura no toque
+    # sus cabeceras en los workers (lo que copiaría las páginas compartidas).
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    from services import chat_resources
+
+    torch_threads = os.getenv("TORCH_NUM_THREADS")
+    if torch_threads:
+        import torch
+
+        torch.set_num_threads(int(torch_threads))
+
+    # El worker solo queda listo (/ready) después de la primera inferencia
+    if not chat_resources.is_ready() and chat_resources.CHAT_PRELOAD == "import":
+        chat_resources.warm_up()
+
+
+def worker_exit(server, worker):
+    # Inserta las visitas que queden en el buffer antes de que el worker termine
+    from services.visit_ingestion import visit_buffer
+
+    visit_buffer.stop()
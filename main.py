@@ -1,65 +1,186 @@
-from models.models import MarketechUser, MarketechProduct, MarketechProductVisited, MarketechSearchHistory, MarketechWishList, MarketechShoppingCart
-from services.recommendation_by_popularity import get_recommendations_html_popularity, get_recommended_product_ids_popularity
-from services.recommendation_model import get_recommendations_html, get_recommended_product_ids
-from flask import Flask, Blueprint, jsonify, request, render_template
+from services.pagination import get_page_args, wants_stream, ndjson_response
+from services.response_cache import cached_json_response, response_cache_stats
+from models.serializers import get_user_items_page, iter_user_items, get_products_by_ids
+from models.products import products_route
+from models.models import MarketechUser, MarketechProduct
+from services.recommendation_by_popularity import get_recommendations_html_popularity, get_recommended_product_ids_popularity, POPULARITY_WINDOWS
+from services.recommendation_model import get_recommendations_html
+from services.recommendation_store import get_recommended_product_ids, get_batch_recommended_product_ids, get_store_stats
+from services import recommendation_store
+from flask import Flask, Blueprint, Response, jsonify, request, render_template
 from services.product_popularity import render_popularity_page
-from database.database import db, init_app
+from database.database import db, init_app, get_pool_stats
 from flask_cors import CORS, cross_origin
-from services.chat import chatbot_route
-import requests
+from services.chat import chatbot_route, responder_pregunta, MENSAJE_NO_DISPONIBLE, intent_cache, answer_cache
+from services.response_cache import response_cache
+from services import metrics
+from services import chat_resources
+from services.covisitation import get_covisitation_index
+from services.visit_ingestion import parse_id, parse_visits, record_visits, get_ingestion_stats, BufferFull
+from services.search_intent import search_cache
 
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "http://localhost"}})
 init_app(app)
+metrics.init_app(app)
+chat_resources.preload()
+
+# Crea la tabla de recomendaciones materializadas si falta (con gunicorn y
+# preload_app lo hace una vez el proceso maestro)
+if recommendation_store.RECOMMENDATION_STORE_ENABLED and recommendation_store.RECOMMENDATION_STORE_CREATE_TABLE:
+    with app.app_context():
+        recommendation_store.ensure_table()
 
 app.register_blueprint(chatbot_route, url_prefix="/chat")
+app.register_blueprint(products_route, url_prefix="/products")
 popularity_bp = Blueprint('popularity', __name__)
 
+MAX_BATCH_USERS = 1000
+MAX_POPULARITY_LIMIT = 100
+MAX_ALSO_VIEWED_LIMIT = 50
+MAX_VISITS_PER_REQUEST = 1000
+
+def wants_expanded_products():
+    # `?expand=products` devuelve los productos completos en lugar de solo los ids
+    return request.args.get('expand') == 'products'
+
+def get_limit_arg(default, maximum):
+    # `?limit=` entre 1 y `maximum`; lanza ValueError si no es un entero válido
+    limit = request.args.get('limit')
+    if limit is None:
+        return default
+    limit = int(limit)
+    if not 1 <= limit <= maximum:
+        raise ValueError(limit)
+    return limit
+
+def load_user(user_id):
+    user = MarketechUser.query.get(user_id)
+    return user.to_dict() if user else None
+
+def load_product(product_id):
+    product = MarketechProduct.query.get(product_id)
+    return product.to_dict() if product else None
+
 @app.route('/user/<int:user_id>', methods=['GET'])
 def get_user(user_id):
-    user = MarketechUser.query.get(user_id)
-    if user:
-        return jsonify(user.to_dict())
+    response = cached_json_response('user', user_id, lambda: load_user(user_id))
+    if response is not None:
+        return response
     return jsonify({'error': 'User not found'}), 404
 
 @app.route('/product/<int:product_id>', methods=['GET'])
 def get_product(product_id):
-    product = MarketechProduct.query.get(product_id)
-    if product:
-        return jsonify(product.to_dict())
+    response = cached_json_response('product', product_id, lambda: load_product(product_id))
+    if response is not None:
+        return response
     return jsonify({'error': 'Product not found'}), 404
 
+@app.route('/cache_stats', methods=['GET'])
+def get_cache_stats():
+    return jsonify(response_cache_stats())
+
+@app.route('/db_stats', methods=['GET'])
+def get_db_stats():
+    return jsonify(get_pool_stats())
+
+def collect_runtime_metrics():
+    # Cachés y pool de conexiones para /metrics
+    caches = {
+        'response': response_cache,
+        'chat_embeddings': chat_resources.embedding_cache,
+        'chat_intents': intent_cache,
+        'chat_answers': answer_cache,
+        'recommendation_searches': search_cache,
+    }
+    for name, cache in caches.items():
+        stats = cache.stats()
+        yield 'marketech_cache_hits_total', {'cache': name}, stats['hits']
+        yield 'marketech_cache_misses_total', {'cache': name}, stats['misses']
+        if 'size' in stats:
+            yield 'marketech_cache_entries', {'cache': name}, stats['size']
+
+    store_stats = get_store_stats()
+    for source in ('stored', 'live'):
+        yield 'marketech_recommendation_store_users_total', {'source': source}, store_stats[source]
+    yield 'marketech_recommendation_store_write_errors_total', {}, store_stats['write_errors']
+    yield 'marketech_recommendation_store_read_errors_total', {}, store_stats['read_errors']
+
+    ingestion_stats = get_ingestion_stats()
+    yield 'marketech_visit_buffer_events', {}, ingestion_stats['buffered']
+    for key in ('accepted', 'inserted', 'flushes', 'rejected', 'invalid', 'errors'):
+        yield f'marketech_visit_{key}_total', {}, ingestion_stats[key]
+
+    for bind, stats in get_pool_stats().items():
+        labels = {'bind': bind}
+        for key, metric in (('size', 'marketech_db_pool_size'), ('checked_out', 'marketech_db_pool_checked_out'),
+                            ('overflow', 'marketech_db_pool_overflow'), ('checkouts', 'marketech_db_pool_checkouts_total'),
+                            ('timeouts', 'marketech_db_pool_timeouts_total'), ('wait_ms_max', 'marketech_db_pool_wait_max_ms')):
+            if key in stats:
+                yield metric, labels, stats[key]
+
+metrics.register_collector(collect_runtime_metrics)
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render_metrics(), mimetype='text/plain; version=0.0.4')
+
+def user_list_response(list_name, user_id, not_found_message):
+    # Respuesta paginada (limit/after) o en streaming NDJSON de una lista por usuario.
+    try:
+        limit, after = get_page_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if wants_stream():
+        return ndjson_response(iter_user_items(list_name, user_id, limit=limit, after=after))
+
+    page = get_user_items_page(list_name, user_id, limit=limit, after=after)
+    if page:
+        return jsonify(page)
+    return jsonify({'error': not_found_message}), 404
+
 @app.route('/product_visited/<int:user_id>', methods=['GET'])
 def get_visited_product(user_id):
-    visited_items= MarketechProductVisited.query.filter_by(user_id=user_id).all()
-    if visited_items:
-        return jsonify([item.to_dict() for item in visited_items])
-    return jsonify({'error': 'Product visit not found'}), 404
+    return user_list_response('visited', user_id, 'Product visit not found')
+
+@app.route('/product_visited', methods=['POST'])
+@cross_origin()
+def post_product_visited():
+    # Registra una visita o un lote; se insertan en segundo plano (ver services/visit_ingestion.py)
+    try:
+        rows = parse_visits(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if len(rows) > MAX_VISITS_PER_REQUEST:
+        return jsonify({'error': f'Se permiten como máximo {MAX_VISITS_PER_REQUEST} visitas por petición.'}), 400
+
+    try:
+        record_visits(rows)
+    except BufferFull as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '1'}
+    return jsonify({'accepted': len(rows)}), 202
+
+@app.route('/ingestion_stats', methods=['GET'])
+def get_visit_ingestion_stats():
+    return jsonify(get_ingestion_stats())
 
 @app.route('/search_history/<int:user_id>', methods=['GET'])
 def get_search_history(user_id):
-    search_history = MarketechSearchHistory.query.filter_by(user_id=user_id).all()
-    if search_history:
-        return jsonify([item.to_dict() for item in search_history])
-    return jsonify({'error': 'Search history not found'}), 404
+    return user_list_response('search_history', user_id, 'Search history not found')
 
 @app.route('/wishlist/<int:user_id>', methods=['GET'])
 def get_wish_list(user_id):
-    wish_list_items = MarketechWishList.query.filter_by(user_id=user_id).all()
-    if wish_list_items:
-        return jsonify([item.to_dict() for item in wish_list_items])
-    return jsonify({'error': 'No wish list found for this user'}), 404
+    return user_list_response('wish_list', user_id, 'No wish list found for this user')
 
 @app.route('/shoppingcart/<int:user_id>', methods=['GET'])
 def get_shopping_cart(user_id):
-    cart_items = MarketechShoppingCart.query.filter_by(user_id=user_id).all()
-    if cart_items:
-        return jsonify([item.to_dict() for item in cart_items])
-    return jsonify({'error': 'No shopping cart found for this user'}), 404
+    return user_list_response('shopping_cart', user_id, 'No shopping cart found for this user')
 
 @app.route('/recommendations/<int:user_id>', methods=['GET'])
 def get_recommendations(user_id):
-    recommendations_html = get_recommendations_html(user_id)
+    recommendations = get_products_by_ids(get_recommended_product_ids(user_id))
+    recommendations_html = get_recommendations_html(user_id, recommendations)
     return recommendations_html
 
 @app.route('/recommendations_ids/<int:user_id>', methods=['GET'])
@@ -69,8 +190,27 @@ def get_recommended_product_ids_route(user_id):
     if not recommended_product_ids:
         return jsonify({'message': 'No se encontraron recomendaciones.'}), 404
     recommended_product_ids = [int(product_id) for product_id in recommended_product_ids]
+    if wants_expanded_products():
+        return jsonify(get_products_by_ids(recommended_product_ids))
     return jsonify(recommended_product_ids)
 
+@app.route('/recommendations_ids/batch', methods=['POST'])
+@cross_origin()
+def get_batch_recommended_product_ids_route():
+    data = request.get_json(silent=True) or {}
+    user_ids = data.get('user_ids')
+    if not isinstance(user_ids, list) or not user_ids:
+        return jsonify({'error': 'Se requiere una lista "user_ids".'}), 400
+    if len(user_ids) > MAX_BATCH_USERS:
+        return jsonify({'error': f'Se permiten como máximo {MAX_BATCH_USERS} usuarios por lote.'}), 400
+    try:
+        user_ids = list(dict.fromkeys(parse_id(user_id) for user_id in user_ids))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Los valores de "user_ids" deben ser enteros positivos.'}), 400
+
+    recommendations = get_batch_recommended_product_ids(user_ids)
+    return jsonify({str(user_id): product_ids for user_id, product_ids in recommendations.items()})
+
 @app.route('/recommendations_popularity_html', methods=['GET'])
 def get_popularity_recommendations_html():
     recommendations_html = get_recommendations_html_popularity()
@@ -83,11 +223,42 @@ def popularity():
 @app.route('/recommendations_popularity_ids', methods=['GET'])
 @cross_origin()
 def get_popularity_recommended_product_ids_route():
-    recommended_product_ids = get_recommended_product_ids_popularity()
+    window = request.args.get('window')
+    if window is not None and window not in POPULARITY_WINDOWS:
+        return jsonify({'error': f'Ventana no válida. Usa una de: {", ".join(POPULARITY_WINDOWS)}.'}), 400
+    try:
+        limit = get_limit_arg(8, MAX_POPULARITY_LIMIT)
+    except ValueError:
+        return jsonify({'error': f'"limit" debe estar entre 1 y {MAX_POPULARITY_LIMIT}.'}), 400
+
+    recommended_product_ids = get_recommended_product_ids_popularity(
+        limit=limit,
+        window=window,
+        category=request.args.get('category'),
+        subcategory=request.args.get('subcategory'),
+    )
     if not recommended_product_ids:
         return jsonify({'message': 'No se encontraron recomendaciones populares.'}), 404
+    if wants_expanded_products():
+        return jsonify(get_products_by_ids(recommended_product_ids))
     return jsonify(recommended_product_ids)
 
+@app.route('/also_viewed/<int:product_id>', methods=['GET'])
+@cross_origin()
+def get_also_viewed_route(product_id):
+    # "Quienes vieron este producto también vieron": los más co-visitados
+    try:
+        limit = get_limit_arg(10, MAX_ALSO_VIEWED_LIMIT)
+    except ValueError:
+        return jsonify({'error': f'"limit" debe estar entre 1 y {MAX_ALSO_VIEWED_LIMIT}.'}), 400
+
+    product_ids = get_covisitation_index().also_viewed(product_id, limit=limit)
+    if not product_ids:
+        return jsonify({'message': 'No se encontraron productos vistos en conjunto.'}), 404
+    if wants_expanded_products():
+        return jsonify(get_products_by_ids(product_ids))
+    return jsonify(product_ids)
+
 @app.route('/chat', methods=['GET', 'POST'])
 def chat_page():
     chatbot_response = None
@@ -96,21 +267,25 @@ def chat_page():
         user_question = request.form.get('question', '').strip()
 
         if user_question:
-            try:
-                url = "http://127.0.0.1:5000/chat/"
-                headers = {"Content-Type": "application/json"}
-                response = requests.post(url, json={"question": user_question}, headers=headers)
-                response_data = response.json()
-
-                if response_data.get("success"):
-                    chatbot_response = response_data.get("response")
-                else:
-                    chatbot_response = "Lo siento, no pude encontrar una respuesta adecuada."
-            except Exception as e:
-                chatbot_response = f"Error al conectarse con el chatbot: {str(e)}"
+            # Se llama al servicio del chatbot en el mismo proceso (sin petición HTTP a sí mismo)
+            if not chat_resources.is_ready():
+                chatbot_response = MENSAJE_NO_DISPONIBLE
+            else:
+                try:
+                    chatbot_response = responder_pregunta(user_question)
+                except Exception as e:
+                    chatbot_response = f"Error al procesar la pregunta: {str(e)}"
 
     return render_template('chat.html', chatbot_response=chatbot_response)
 
+@app.route('/ready', methods=['GET'])
+def ready():
+    # Señal de disponibilidad: 200 solo cuando el modelo del chatbot está cargado y caliente.
+    if chat_resources.is_ready():
+        return jsonify({'ready': True})
+    load_error = chat_resources.get_load_error()
+    return jsonify({'ready': False, 'error': str(load_error) if load_error else None}), 503
+
 @app.route("/")
 def index():
     return render_template("welcome.html")
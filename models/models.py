@@ -199,4 +199,16 @@ class MarketechShoppingCart(db.Model):
                 "seller_id": self.product.seller_id,
                 'created_at': self.product.created_at,
             }
-        }
\ No newline at end of file
+        }
+
+
+class MarketechUserRecommendation(db.Model):
+    # Recomendaciones precalculadas por usuario (services/recommendation_store.py)
+    __tablename__ = 'marketech_user_recommendations'
+    # Sin clave foránea: un id desconocido no debe hacer fallar el lote entero
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    product_ids = db.Column(db.Text, nullable=False)
+    version = db.Column(db.String(64), nullable=False)
+    # Visitas y búsquedas del usuario con que se calculó (ver recommendation_store.activity_version)
+    activity = db.Column(db.String(64), nullable=False)
+    computed_at = db.Column(db.DateTime, nullable=False)
@@ -1,14 +1,89 @@
-from flask import Blueprint, jsonify
+from services.pagination import get_page_args, wants_stream, keyset, split_page, stream_rows, ndjson_response
+from models.serializers import get_products_by_ids
+from flask import Blueprint, jsonify, request
+from models.models import MarketechProduct
 from database.database import db
 
 products_route = Blueprint("products", __name__)
 
-@products_route.route("/", methods=["GET"])
+products_table = MarketechProduct.__table__
+
+# Máximo de ids por petición en la consulta por lote
+MAX_BULK_IDS = 100
+
+
+def _split_values(values):
+    # Acepta listas JSON, `a,b,c` o parámetros repetidos (`ids=1&ids=2`).
+    if values is None:
+        return []
+    if not isinstance(values, (list, tuple)):
+        values = [values]
+    items = []
+    for value in values:
+        if isinstance(value, str):
+            items.extend(part.strip() for part in value.split(",") if part.strip())
+        else:
+            items.append(value)
+    return items
+
+
+def get_bulk_args():
+    # Lee `ids` y `fields` de la query string (GET) o del cuerpo JSON (POST).
+    # Lanza ValueError si los ids no son enteros o superan el máximo.
+    if request.method == "POST":
+        data = request.get_json(silent=True) or {}
+        ids, fields = _split_values(data.get("ids")), _split_values(data.get("fields"))
+    else:
+        ids, fields = _split_values(request.args.getlist("ids")), _split_values(request.args.getlist("fields"))
+
+    if not ids:
+        raise ValueError('Se requiere una lista "ids".')
+    if len(ids) > MAX_BULK_IDS:
+        raise ValueError(f"Se permiten como máximo {MAX_BULK_IDS} ids por petición.")
+    try:
+        ids = [int(product_id) for product_id in ids]
+    except (TypeError, ValueError):
+        raise ValueError('Los valores de "ids" deben ser enteros.')
+    return ids, fields or None
+
+
+def bulk_products_response():
+    # Productos de los ids pedidos en ese orden, más los ids que no existen.
+    try:
+        ids, fields = get_bulk_args()
+        products = get_products_by_ids(ids, fields)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    found = {product["id"] for product in products}
+    missing = [product_id for product_id in dict.fromkeys(ids) if product_id not in found]
+    return jsonify({"items": products, "missing": missing}), 200
+
+
+@products_route.route("/", methods=["GET", "POST"], strict_slashes=False)
 def get_products():
+    # GET /products?ids=1,2,3 (o POST con {"ids": [...]}) obtiene productos por id;
+    # sin `ids`, GET lista el catálogo paginado.
+    if request.method == "POST" or "ids" in request.args:
+        return bulk_products_response()
+
+    try:
+        limit, after = get_page_args()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
     try:
-        result = db.session.execute("SELECT * FROM marketech_products")
-        products = [dict(row) for row in result.fetchall()]
-        return jsonify(products), 200
+        query = db.session.query(products_table)
+        if wants_stream():
+            query = keyset(query, products_table.c.id, after=after)
+            if limit is not None:
+                query = query.limit(limit)
+            return ndjson_response(dict(row._mapping) for row in stream_rows(query))
+
+        rows = keyset(query, products_table.c.id, limit=limit, after=after).all()
+        rows, next_after = split_page(rows, limit)
+        products = [dict(row._mapping) for row in rows]
+        return jsonify({"items": products, "next_after": next_after}), 200
 
     except Exception as e:
         return jsonify({"error": f"Error al obtener los productos: {str(e)}"}), 500
@@ -0,0 +1,178 @@
+from models.models import MarketechUser, MarketechProduct, MarketechProductVisited, MarketechSearchHistory, MarketechWishList, MarketechShoppingCart
+from services.pagination import keyset, split_page, stream_rows
+from database.database import db
+
+# Serialización de las listas por usuario (visitas, búsquedas, deseos y carrito).
+# Cada lista se obtiene con una sola consulta que une usuario y producto y solo
+# trae las columnas necesarias; el bloque del usuario se emite una vez por respuesta.
+
+USER_COLUMNS = (
+    MarketechUser.id.label('user_id'),
+    MarketechUser.name.label('user_name'),
+    MarketechUser.last_name.label('user_last_name'),
+    MarketechUser.email.label('user_email'),
+    MarketechUser.created_at.label('user_created_at'),
+)
+
+PRODUCT_COLUMNS = (
+    MarketechProduct.id.label('product_id'),
+    MarketechProduct.product_name,
+    MarketechProduct.product_description,
+    MarketechProduct.product_price,
+    MarketechProduct.product_discount,
+    MarketechProduct.product_quantity,
+    MarketechProduct.category,
+    MarketechProduct.subcategory,
+    MarketechProduct.product_mark,
+    MarketechProduct.product_model,
+    MarketechProduct.seller_id,
+    MarketechProduct.created_at.label('product_created_at'),
+)
+
+
+def user_block(row, created_at_format=None):
+    created_at = row.user_created_at
+    if created_at_format and created_at:
+        created_at = created_at.strftime(created_at_format)
+    return {
+        'id': row.user_id,
+        'name': row.user_name,
+        'last_name': row.user_last_name,
+        'email': row.user_email,
+        'created_at': created_at
+    }
+
+
+def product_block(row):
+    return {
+        'id': row.product_id,
+        'name': row.product_name,
+        'description': row.product_description,
+        'price': float(row.product_price),
+        "discount": float(row.product_discount),
+        "quantity": row.product_quantity,
+        'category': row.category,
+        "subcategory": row.subcategory,
+        "mark": row.product_mark,
+        "model": row.product_model,
+        "seller_id": row.seller_id,
+        'created_at': row.product_created_at,
+    }
+
+
+# Columnas que se pueden pedir con `fields` al obtener productos por id
+PRODUCT_FIELDS = tuple(MarketechProduct.__table__.columns.keys())
+
+
+def product_payload(row):
+    # Producto con el mismo formato que MarketechProduct.to_dict (solo las columnas presentes).
+    product = dict(row._mapping)
+    for column in ('product_price', 'product_discount'):
+        if product.get(column) is not None:
+            product[column] = float(product[column])
+    if product.get('created_at') is not None:
+        product['created_at'] = product['created_at'].isoformat()
+    return product
+
+
+def get_products_by_ids(product_ids, fields=None):
+    # Productos de varios ids con una sola consulta IN, en el orden pedido; los
+    # ids inexistentes se omiten. `fields` limita las columnas (el id va siempre).
+    table = MarketechProduct.__table__
+    fields = PRODUCT_FIELDS if not fields else ['id', *(field for field in fields if field != 'id')]
+    unknown = [field for field in fields if field not in table.c]
+    if unknown:
+        raise ValueError(f'Campos no válidos: {", ".join(unknown)}.')
+
+    product_ids = list(dict.fromkeys(product_ids))
+    if not product_ids:
+        return []
+    rows = db.session.query(*(table.c[field] for field in fields)).filter(table.c.id.in_(product_ids)).all()
+    by_id = {row.id: product_payload(row) for row in rows}
+    return [by_id[product_id] for product_id in product_ids if product_id in by_id]
+
+
+def query_user_items(model, item_columns, user_id, with_product=True, limit=None, after=None):
+    # Consulta única: columnas del elemento + usuario (+ producto) filtradas por
+    # usuario y paginadas por id.
+    columns = [model.id, *item_columns, *USER_COLUMNS]
+    if with_product:
+        columns.extend(PRODUCT_COLUMNS)
+
+    query = db.session.query(*columns).join(MarketechUser, MarketechUser.id == model.user_id)
+    if with_product:
+        query = query.join(MarketechProduct, MarketechProduct.id == model.product_id)
+    return keyset(query.filter(model.user_id == user_id), model.id, limit=limit, after=after)
+
+
+def visited_item(row):
+    return {'id': row.id, 'visited_at': row.visited_at, 'product': product_block(row)}
+
+
+def search_history_item(row):
+    return {
+        'id': row.id,
+        'search_term': row.search_term,
+        'created_at': row.created_at.isoformat() if row.created_at else None
+    }
+
+
+def wish_list_item(row):
+    return {'id': row.id, 'created_at': row.created_at, 'product': product_block(row)}
+
+
+def shopping_cart_item(row):
+    return {'id': row.id, 'created_at': row.created_at, 'cantidad': row.cantidad, 'product': product_block(row)}
+
+
+# Listas por usuario: modelo, columnas propias, si incluye producto,
+# constructor de cada elemento y formato de la fecha del usuario.
+USER_LISTS = {
+    'visited': (MarketechProductVisited, (MarketechProductVisited.visited_at,), True, visited_item, None),
+    'search_history': (
+        MarketechSearchHistory,
+        (MarketechSearchHistory.search_term, MarketechSearchHistory.created_at),
+        False,
+        search_history_item,
+        '%a, %d %b %Y %H:%M:%S GMT',
+    ),
+    'wish_list': (MarketechWishList, (MarketechWishList.created_at,), True, wish_list_item, None),
+    'shopping_cart': (
+        MarketechShoppingCart,
+        (MarketechShoppingCart.created_at, MarketechShoppingCart.cantidad),
+        True,
+        shopping_cart_item,
+        None,
+    ),
+}
+
+
+def get_user_items_page(list_name, user_id, limit=None, after=None):
+    # Una página de la lista: bloque de usuario, elementos y cursor `next_after`.
+    # Devuelve None si la primera página está vacía.
+    model, item_columns, with_product, item_builder, user_created_at_format = USER_LISTS[list_name]
+    rows = query_user_items(model, item_columns, user_id, with_product, limit=limit, after=after).all()
+    rows, next_after = split_page(rows, limit)
+    if not rows and after is None:
+        return None
+    return {
+        'user': user_block(rows[0], user_created_at_format) if rows else None,
+        'items': [item_builder(row) for row in rows],
+        'next_after': next_after
+    }
+
+
+def iter_user_items(list_name, user_id, limit=None, after=None):
+    # Versión en streaming: primero el bloque del usuario y luego un objeto por
+    # elemento, a medida que llegan del cursor.
+    model, item_columns, with_product, item_builder, user_created_at_format = USER_LISTS[list_name]
+    query = query_user_items(model, item_columns, user_id, with_product, after=after)
+    if limit is not None:
+        query = query.limit(limit)
+
+    first = True
+    for row in stream_rows(query):
+        if first:
+            yield {'user': user_block(row, user_created_at_format)}
+            first = False
+        yield item_builder(row)
@@ -0,0 +1,226 @@
+from services.product_neighbors import load_or_build_neighbor_table
+from services.metrics import span
+from models.models import MarketechProduct
+from sklearn.feature_extraction.text import TfidfVectorizer
+from flask import current_app
+from database.database import db, read_replica
+from sqlalchemy import event
+import pandas as pd
+import numpy as np
+import threading
+import hashlib
+import logging
+import time
+import os
+
+# Segundos entre comprobaciones de la firma del catálogo en la base de datos
+CATALOG_CHECK_INTERVAL = float(os.getenv("CATALOG_CHECK_INTERVAL", "30"))
+
+_index = None
+# Firma del catálogo del índice actual; con el catálogo vacío no hay índice
+# (_index es None) pero la firma evita reconstruirlo en cada petición.
+_signature = None
+_built = False
+_index_lock = threading.Lock()
+_rebuild_thread = None
+# Cambios marcados por el ORM y cuántos incluye el índice actual; solo se dan
+# por incluidos cuando la reconstrucción termina bien.
+_changes = 0
+_built_changes = 0
+_last_check = 0.0
+_retry_at = 0.0
+
+# Columnas cuyo contenido forma parte de la firma del catálogo
+CHECKSUM_COLUMNS = (
+    MarketechProduct.product_name, MarketechProduct.product_mark, MarketechProduct.product_model,
+    MarketechProduct.product_description, MarketechProduct.product_price, MarketechProduct.product_discount,
+    MarketechProduct.product_quantity, MarketechProduct.category, MarketechProduct.subcategory,
+    MarketechProduct.created_at,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogIndex:
+    # Índice TF-IDF del catálogo: vectorizador ajustado, matriz dispersa
+    # normalizada (una fila por producto), mapa id -> fila y tabla de vecinos.
+    def __init__(self, products_df, vectorizer, matrix, signature):
+        self.products = products_df
+        self.vectorizer = vectorizer
+        self.matrix = matrix
+        self.signature = signature
+        self.ids = products_df['id'].to_numpy()
+        self.row_of = {int(product_id): row for row, product_id in enumerate(self.ids)}
+        # Fila por id de producto como array (-1 si el id no está en el índice)
+        self.row_by_id = np.full(int(self.ids.max()) + 1 if len(self.ids) else 0, -1, dtype=np.int64)
+        self.row_by_id[self.ids.astype(np.int64)] = np.arange(len(self.ids))
+        self.categories = products_df['category'].to_numpy()
+        # Categoría como entero (0..category_count-1) para contar con np.bincount
+        self.category_codes, category_labels = pd.factorize(products_df['category'])
+        self.category_count = max(len(category_labels), 1)
+        self.category_codes = np.where(self.category_codes < 0, 0, self.category_codes)
+        # Fecha de alta en segundos; las fechas nulas quedan como -inf (al final)
+        created_at = pd.to_datetime(products_df['created_at'], errors='coerce')
+        self.created_at = (created_at - pd.Timestamp(0)).dt.total_seconds().fillna(-np.inf).to_numpy()
+        self.version = f"{signature[0]}-{signature[1]}-{signature[2]}-{time.time():.0f}"
+        self.neighbor_rows = None
+        self.neighbor_scores = None
+        self.content_version = None
+
+    def similarities(self, rows):
+        # Similitud coseno de las filas indicadas contra todo el catálogo (k x N).
+        # Las filas de TF-IDF ya están normalizadas (L2), así que basta el producto escalar.
+        return (self.matrix[rows] @ self.matrix.T).toarray()
+
+
+@read_replica
+def get_all_products():
+    # Obtiene todos los productos en la base de datos.
+    all_products = MarketechProduct.query.all()
+    if not all_products:
+        return pd.DataFrame()
+
+    product_list = [product.to_dict() for product in all_products if product]
+    return pd.DataFrame(product_list)
+
+
+def combine_features(products_df):
+    # Combinar características relevantes
+    return (
+        products_df['product_mark'].fillna('') + " " +
+        products_df['category'].fillna('') + " " +
+        products_df['subcategory'].fillna('') + " " +
+        products_df['product_model'].fillna('') + " " +
+        products_df['product_description'].fillna('')
+    )
+
+
+def catalog_checksum():
+    # Suma de comprobación del contenido de los productos, para detectar
+    # también las ediciones que hace el backend de la tienda. En MySQL se
+    # calcula en el servidor (suma de CRC32 por fila); en otros motores se leen
+    # las columnas por bloques y se calcula un hash.
+    if db.session.get_bind(mapper=MarketechProduct.__mapper__).dialect.name == "mysql":
+        row_checksum = db.func.crc32(db.func.concat_ws("\x1f", MarketechProduct.id, *CHECKSUM_COLUMNS))
+        return str(db.session.query(db.func.coalesce(db.func.sum(row_checksum), 0)).scalar())
+
+    digest = hashlib.sha1()
+    rows = db.session.query(MarketechProduct.id, *CHECKSUM_COLUMNS).order_by(MarketechProduct.id).yield_per(10000)
+    for row in rows:
+        digest.update(repr(tuple(row)).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+@read_replica
+def get_catalog_signature():
+    # Firma del catálogo: cantidad, id máximo y suma de comprobación del contenido.
+    count, max_id = db.session.query(db.func.count(MarketechProduct.id), db.func.max(MarketechProduct.id)).one()
+    return (count, max_id, catalog_checksum())
+
+
+def build_catalog_index(reuse_saved_neighbors=True):
+    # Construye el índice completo a partir de la base de datos, junto con
+    # la tabla de vecinos (reutiliza la guardada si la firma coincide).
+    signature = get_catalog_signature()
+    products_df = get_all_products()
+    if products_df.empty:
+        return None
+
+    with span("tfidf_fit"):
+        tfidf = TfidfVectorizer(stop_words='english')
+        tfidf_matrix = tfidf.fit_transform(combine_features(products_df)).tocsr()
+    index = CatalogIndex(products_df, tfidf, tfidf_matrix, signature)
+    with span("neighbor_table"):
+        index.neighbor_rows, index.neighbor_scores = load_or_build_neighbor_table(index, reuse_saved=reuse_saved_neighbors)
+    index.content_version = content_version(index)
+    return index
+
+
+def content_version(index):
+    # Huella de lo que determina las recomendaciones (ids, categorías y tabla de
+    # vecinos). A diferencia de `version`, es la misma en todos los procesos.
+    digest = hashlib.sha1(np.ascontiguousarray(index.ids, dtype=np.int64).tobytes())
+    digest.update(np.ascontiguousarray(index.neighbor_rows).tobytes())
+    digest.update("\x1f".join(map(str, index.categories)).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def _build():
+    # (índice, firma); con el catálogo vacío el índice es None y la firma se lee aparte.
+    index = build_catalog_index()
+    return index, index.signature if index is not None else get_catalog_signature()
+
+
+def _rebuild_in_background(app, changes, check_signature):
+    # Con `check_signature` solo se reconstruye si la firma cambió. La tabla de
+    # vecinos guardada se reutiliza si otro proceso ya la calculó para esta firma.
+    global _index, _signature, _rebuild_thread, _built_changes, _retry_at
+
+    try:
+        with app.app_context():
+            if check_signature and get_catalog_signature() == _signature:
+                return
+            new_index, new_signature = _build()
+        with _index_lock:
+            _index, _signature = new_index, new_signature
+            _built_changes = changes
+    except Exception:
+        # Los cambios siguen pendientes y se reintenta tras CATALOG_CHECK_INTERVAL
+        logger.exception("No se pudo reconstruir el índice del catálogo")
+        _retry_at = time.monotonic() + CATALOG_CHECK_INTERVAL
+    finally:
+        _rebuild_thread = None
+
+
+def _start_background_rebuild(check_signature=False):
+    global _rebuild_thread
+
+    with _index_lock:
+        if _rebuild_thread is not None:
+            return
+        app = current_app._get_current_object()
+        _rebuild_thread = threading.Thread(
+            target=_rebuild_in_background, args=(app, _changes, check_signature), daemon=True
+        )
+        _rebuild_thread.start()
+
+
+def mark_catalog_dirty():
+    # Marca el índice como desactualizado; se reconstruye en segundo plano
+    # en la siguiente petición sin bloquearla.
+    global _changes
+    _changes += 1
+
+
+def get_catalog_index():
+    # Devuelve el índice compartido. La primera vez se construye de forma
+    # síncrona; después, si el catálogo cambió, se sigue sirviendo el índice
+    # anterior mientras se reconstruye en segundo plano.
+    global _index, _signature, _built, _last_check, _built_changes
+
+    if not _built:
+        with _index_lock:
+            if not _built:
+                changes = _changes
+                _index, _signature = _build()
+                _built_changes = changes
+                _last_check = time.monotonic()
+                _built = True
+        return _index
+
+    # La firma se compara en el hilo de fondo (lee todo el catálogo fuera de MySQL)
+    now = time.monotonic()
+    if _changes != _built_changes and now >= _retry_at:
+        _start_background_rebuild()
+    elif now - _last_check >= CATALOG_CHECK_INTERVAL:
+        _last_check = now
+        _start_background_rebuild(check_signature=True)
+
+    return _index
+
+
+@event.listens_for(MarketechProduct, "after_insert")
+@event.listens_for(MarketechProduct, "after_update")
+@event.listens_for(MarketechProduct, "after_delete")
+def _on_product_change(mapper, connection, target):
+    mark_catalog_dirty()
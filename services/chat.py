@@ -1,24 +1,34 @@
-from sentence_transformers import SentenceTransformer
-from flask import Blueprint, request, jsonify
-from scipy.spatial.distance import cdist
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+from services.cache import TTLCache
+from services import chat_resources, intent_classifier
+from services.metrics import span
 from flask_cors import cross_origin
 from dotenv import load_dotenv
-import pandas as pd
-import numpy as np
 import openai
+import json
 import os
 
 # Cargar variables de entorno
 load_dotenv()
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
-# Cargar modelo y datos preprocesados
-model = SentenceTransformer('all-MiniLM-L6-v2')
-product_vectors = np.load("utils/product_vectors.npy")
-product_metadata = pd.read_csv("utils/product_metadata.csv")
+CHAT_SEARCH_N_PROBE = int(os.getenv("CHAT_SEARCH_N_PROBE", "8"))
 
-if "product_name" not in product_metadata.columns or "product_description" not in product_metadata.columns:
-    raise ValueError("El archivo 'product_metadata.csv' no tiene las columnas necesarias.")
+INTENCIONES = ("busqueda_producto", "consulta_tienda", "pregunta_general")
+RESPUESTA_ERROR_GPT = "Lo siento, hubo un problema al generar la respuesta"
+MENSAJE_NO_DISPONIBLE = "El chatbot se está iniciando, inténtalo de nuevo en unos segundos."
+
+# Cachés por pregunta normalizada: intención clasificada y respuesta final.
+# Las respuestas se indexan además por la versión de los vectores de productos,
+# así que al regenerarlos las entradas anteriores dejan de usarse.
+intent_cache = TTLCache(
+    maxsize=int(os.getenv("CHAT_INTENT_CACHE_SIZE", "4096")),
+    ttl=int(os.getenv("CHAT_INTENT_CACHE_TTL", "86400")),
+)
+answer_cache = TTLCache(
+    maxsize=int(os.getenv("CHAT_ANSWER_CACHE_SIZE", "1024")),
+    ttl=int(os.getenv("CHAT_ANSWER_CACHE_TTL", "3600")),
+)
 
 # Crear el Blueprint para las rutas del chatbot
 chatbot_route = Blueprint("chatbot", __name__)
@@ -32,28 +42,144 @@ def chatbot_response():
     if not user_input:
         return jsonify({"error": "La pregunta no puede estar vacía."}), 400
 
-    try:
-        # Paso 1: Clasificar intención con GPT
-        intencion = clasificar_intencion_gpt(user_input)
-
-        # Paso 2: Manejar según la intención
-        if intencion == "pregunta_general":
-            respuesta = manejar_pregunta_general(user_input)
-        elif intencion == "busqueda_producto":
-            respuesta = manejar_busqueda_producto(user_input)
-        elif intencion == "consulta_tienda":
-            respuesta = manejar_consulta_tienda(user_input)
-        else:
-            respuesta = "Lo siento, no entendí tu consulta. ¿Podrías reformularla?"
+    if not chat_resources.is_ready():
+        return jsonify({"error": MENSAJE_NO_DISPONIBLE}), 503
 
+    try:
+        respuesta = responder_pregunta(user_input)
         return jsonify({"success": True, "response": respuesta})
 
     except Exception as e:
         return jsonify({"error": f"Error inesperado: {str(e)}"}), 500
 
 
+def responder_pregunta(user_input):
+    # Servicio del chatbot usado tanto por la API JSON como por la página /chat:
+    # clasifica la intención, genera la respuesta y la guarda en caché.
+    chat_resources.check_for_update()
+    answer_key = (chat_resources.data_version, chat_resources.normalize_text(user_input))
+    respuesta = answer_cache.get(answer_key)
+    if respuesta is not None:
+        return respuesta
+
+    # Paso 1: Clasificar intención (local y, si hay dudas, con GPT)
+    intencion = clasificar_intencion(user_input)
+
+    # Paso 2: Manejar según la intención
+    if intencion == "pregunta_general":
+        respuesta = manejar_pregunta_general(user_input)
+    elif intencion == "busqueda_producto":
+        respuesta = manejar_busqueda_producto(user_input)
+    elif intencion == "consulta_tienda":
+        respuesta = manejar_consulta_tienda(user_input)
+    else:
+        respuesta = "Lo siento, no entendí tu consulta. ¿Podrías reformularla?"
+
+    if intencion in INTENCIONES and not respuesta.startswith(RESPUESTA_ERROR_GPT):
+        answer_cache.set(answer_key, respuesta)
+    return respuesta
+
+
+def responder_pregunta_stream(user_input):
+    # Variante en streaming de responder_pregunta: misma caché, clasificación y
+    # contexto de productos, pero produce la respuesta por fragmentos.
+    chat_resources.check_for_update()
+    answer_key = (chat_resources.data_version, chat_resources.normalize_text(user_input))
+    respuesta = answer_cache.get(answer_key)
+    if respuesta is not None:
+        yield respuesta
+        return
+
+    intencion = clasificar_intencion(user_input)
+    construir_prompt = PROMPTS_POR_INTENCION.get(intencion)
+    if construir_prompt is None:
+        yield "Lo siento, no entendí tu consulta. ¿Podrías reformularla?"
+        return
+
+    fragmentos = []
+    for fragmento in generar_respuesta_gpt_stream(construir_prompt(user_input)):
+        fragmentos.append(fragmento)
+        yield fragmento
+    answer_cache.set(answer_key, "".join(fragmentos))
+
+
+def evento_sse(data, event=None):
+    # Formatea un evento Server-Sent Events con datos JSON (admite saltos de línea).
+    mensaje = f"event: {event}\n" if event else ""
+    return mensaje + f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@chatbot_route.route("/stream", methods=["POST"])
+@cross_origin()
+def chatbot_response_stream():
+    # Igual que POST /chat/ pero la respuesta llega como eventos SSE:
+    # `data: {"token": ...}` por fragmento y `event: done` con la respuesta completa.
+    data = request.get_json(silent=True) or {}
+    user_input = data.get("question", "").strip()
+
+    if not user_input:
+        return jsonify({"error": "La pregunta no puede estar vacía."}), 400
+
+    if not chat_resources.is_ready():
+        return jsonify({"error": MENSAJE_NO_DISPONIBLE}), 503
+
+    def generar_eventos():
+        fragmentos = []
+        try:
+            for fragmento in responder_pregunta_stream(user_input):
+                fragmentos.append(fragmento)
+                yield evento_sse({"token": fragmento})
+            yield evento_sse({"success": True, "response": "".join(fragmentos)}, event="done")
+        except Exception as e:
+            yield evento_sse({"error": f"{RESPUESTA_ERROR_GPT}: {str(e)}"}, event="error")
+
+    return Response(
+        stream_with_context(generar_eventos()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@chatbot_route.route("/cache_stats", methods=["GET"])
+def chatbot_cache_stats():
+    return jsonify({
+        "embeddings": chat_resources.embedding_cache.stats(),
+        "intents": intent_cache.stats(),
+        "answers": answer_cache.stats(),
+    })
+
+
+def clear_chat_caches():
+    # Invalida las cachés del chatbot (p. ej. al regenerar los vectores de productos).
+    chat_resources.embedding_cache.clear()
+    intent_cache.clear()
+    answer_cache.clear()
+
+
+# Las respuestas dependen de los productos: al cargar una versión nueva de los
+# vectores se descartan (los embeddings y las intenciones siguen siendo válidos).
+chat_resources.reload_listeners.append(answer_cache.clear)
+
+
+def clasificar_intencion(user_input):
+    # Clasifica primero con el modelo local; solo si la confianza queda por
+    # debajo del umbral se consulta a GPT.
+    try:
+        with span("intent_local"):
+            intencion, confianza = intent_classifier.classify(user_input)
+        if confianza >= intent_classifier.confidence_threshold():
+            return intencion
+    except Exception:
+        pass
+    return clasificar_intencion_gpt(user_input)
+
 def clasificar_intencion_gpt(user_input):
     # Usa GPT-4 para clasificar la intención del usuario.
+    cache_key = chat_resources.normalize_text(user_input)
+    intencion = intent_cache.get(cache_key)
+    if intencion is not None:
+        return intencion
+
     gpt_prompt = f"""
     Eres un asistente inteligente de MarkeTech. Tu tarea es analizar las consultas de los clientes y clasificarlas en una de las siguientes categorías:
     - "busqueda_producto": si el cliente busca un producto específico o desea información sobre productos disponibles.
@@ -64,67 +190,106 @@ def clasificar_intencion_gpt(user_input):
     Responde únicamente con una de las categorías mencionadas: "busqueda_producto", "consulta_tienda" o "pregunta_general".
     """
     try:
-        gpt_response = openai.ChatCompletion.create(
-            model="gpt-4",
-            messages=[{"role": "system", "content": gpt_prompt}],
-        )
-        return gpt_response["choices"][0]["message"]["content"].strip()
+        with span("gpt_classify"):
+            gpt_response = openai.ChatCompletion.create(
+                model="gpt-4",
+                messages=[{"role": "system", "content": gpt_prompt}],
+            )
+        intencion = gpt_response["choices"][0]["message"]["content"].strip()
     except Exception as e:
         return "pregunta_general"  # Predeterminado en caso de error
 
-def manejar_pregunta_general(user_input):
-    # Genera una respuesta para preguntas generales usando GPT-4.
-    gpt_prompt = f"""
+    if intencion in INTENCIONES:
+        intent_cache.set(cache_key, intencion)
+    return intencion
+
+def prompt_pregunta_general(user_input):
+    return f"""
     Eres un asistente experto en tecnología. Responde de forma clara y profesional.
     Pregunta del cliente: "{user_input}"
     """
-    return generar_respuesta_gpt(gpt_prompt)
 
-def manejar_busqueda_producto(user_input):
-    # Genera una respuesta para búsquedas de productos.
+def prompt_busqueda_producto(user_input):
     # Vectorizar la consulta del usuario
-    user_vector = model.encode([user_input])[0]
+    user_vector = chat_resources.encode_queries([user_input])[0]
     
-    # Calcular similitud de coseno con los vectores de productos
-    distances = cdist([user_vector], product_vectors, metric="cosine")[0]
-    closest_indices = np.argsort(distances)[:5]  # Top 5 productos más similares
-
-    # Obtener productos más relevantes
-    relevant_products = product_metadata.iloc[closest_indices]
-    if relevant_products.empty:
-        return generar_respuesta_gpt(f"No encontré coincidencias para: {user_input}. ¿Puedo ayudarte con otra cosa?")
+    # Top 5 productos más similares (similitud coseno sobre el índice normalizado)
+    # (se toma una sola referencia al índice por si se recarga a mitad de la consulta)
+    product_index = chat_resources.product_index
+    with span("vector_search"):
+        closest_indices, _ = product_index.search(
+            user_vector, k=5, approximate=chat_resources.CHAT_SEARCH_APPROXIMATE, n_probe=CHAT_SEARCH_N_PROBE
+        )
+
+    # Obtener productos más relevantes (solo se leen esas filas de los metadatos)
+    columns = [column for column in ("product_name", "product_description", "product_price") if column in product_index.metadata]
+    relevant_products = product_index.metadata.records(closest_indices, columns)
+    if not relevant_products:
+        return f"No encontré coincidencias para: {user_input}. ¿Puedo ayudarte con otra cosa?"
     
     # Crear lista de productos relevantes
     product_summary = "\n".join([
         f"- {row['product_name']} ({row['product_description']}), Precio: {row.get('product_price', 'No disponible')}"
-        for _, row in relevant_products.iterrows()
+        for row in relevant_products
     ])
     
-    gpt_prompt = f"""
+    return f"""
     Un cliente busca: "{user_input}".
     Los productos más relevantes son:
     {product_summary}.
     Por favor, ayuda al cliente a elegir el mejor producto para sus necesidades.
     """
-    return generar_respuesta_gpt(gpt_prompt)
 
-def manejar_consulta_tienda(user_input):
-    # Responde consultas relacionadas con la tienda.
+def prompt_consulta_tienda(user_input):
     # Puedes agregar reglas específicas o usar GPT
-    gpt_prompt = f"""
+    return f"""
     Eres un asistente de MarkeTech especializado en políticas de la tienda.
     Pregunta del cliente: "{user_input}"
     Responde de forma clara y profesional.
     """
-    return generar_respuesta_gpt(gpt_prompt)
+
+# Prompt de GPT para cada intención
+PROMPTS_POR_INTENCION = {
+    "pregunta_general": prompt_pregunta_general,
+    "busqueda_producto": prompt_busqueda_producto,
+    "consulta_tienda": prompt_consulta_tienda,
+}
+
+def manejar_pregunta_general(user_input):
+    # Genera una respuesta para preguntas generales usando GPT-4.
+    return generar_respuesta_gpt(prompt_pregunta_general(user_input))
+
+def manejar_busqueda_producto(user_input):
+    # Genera una respuesta para búsquedas de productos.
+    return generar_respuesta_gpt(prompt_busqueda_producto(user_input))
+
+def manejar_consulta_tienda(user_input):
+    # Responde consultas relacionadas con la tienda.
+    return generar_respuesta_gpt(prompt_consulta_tienda(user_input))
 
 def generar_respuesta_gpt(gpt_prompt):
     # Llama a la API de GPT-4 para generar una respuesta.
     try:
+        with span("gpt_answer"):
+            gpt_response = openai.ChatCompletion.create(
+                model="gpt-4",
+                messages=[{"role": "system", "content": gpt_prompt}],
+            )
+        return gpt_response["choices"][0]["message"]["content"]
+    except Exception as e:
+        return f"{RESPUESTA_ERROR_GPT}: {str(e)}"
+
+def generar_respuesta_gpt_stream(gpt_prompt):
+    # Igual que generar_respuesta_gpt, pero devuelve los fragmentos de texto a
+    # medida que llegan de la API (stream=True).
+    # La etapa mide hasta recibir la primera respuesta de la API (no el stream completo)
+    with span("gpt_stream_connect"):
         gpt_response = openai.ChatCompletion.create(
             model="gpt-4",
             messages=[{"role": "system", "content": gpt_prompt}],
+            stream=True,
         )
-        return gpt_response["choices"][0]["message"]["content"]
-    except Exception as e:
-        return f"Lo siento, hubo un problema al generar la respuesta: {str(e)}"
\ No newline at end of file
+    for chunk in gpt_response:
+        content = chunk["choices"][0].get("delta", {}).get("content")
+        if content:
+            yield content
@@ -0,0 +1,226 @@
+from services.vector_index import VectorIndex
+from services.metrics import span
+from services.cache import TTLCache
+from services import vector_store
+import numpy as np
+import threading
+import unicodedata
+import logging
+import time
+import re
+import os
+
+# Recursos del chatbot: modelo de embeddings, vectores y metadatos de productos.
+#
+# Importar el módulo no carga nada; la aplicación web llama a preload() al
+# importarse (main.py) y otros procesos pueden llamar a load_resources() si
+# necesitan el modelo (p. ej. la señal de búsquedas del CLI de recommendation_store).
+#
+# Modos de carga de preload() (CHAT_PRELOAD):
+# - "import" (por defecto): se cargan al importar la aplicación. Con gunicorn y
+#   `preload_app = True` (ver gunicorn.conf.py) los carga una sola vez el proceso
+#   maestro y los workers los comparten copy-on-write tras el fork.
+# - "background": cada proceso los carga en un hilo; hasta terminar, /ready y
+#   /chat responden 503.
+# - cualquier otro valor (p. ej. "manual"): no se carga nada hasta llamar a
+#   load_resources(); útil para scripts que solo necesitan parte de los recursos.
+#
+# Con CHAT_DEFER_WARMUP=1 la inferencia de calentamiento no se ejecuta al cargar
+# sino en cada worker (post_fork), para no inicializar hilos de torch antes del fork.
+#
+# Cuando services/vectorize_products.py publica una versión nueva de los vectores,
+# cada proceso la detecta (como mucho cada CHAT_RELOAD_INTERVAL segundos) y la
+# carga en segundo plano mientras sigue respondiendo con la anterior.
+
+MODEL_NAME = vector_store.MODEL_NAME
+
+CHAT_PRELOAD = os.getenv("CHAT_PRELOAD", "import")
+CHAT_DEFER_WARMUP = os.getenv("CHAT_DEFER_WARMUP", "0") == "1"
+CHAT_SEARCH_APPROXIMATE = os.getenv("CHAT_SEARCH_APPROXIMATE", "0") == "1"
+CHAT_RELOAD_INTERVAL = float(os.getenv("CHAT_RELOAD_INTERVAL", "30"))
+
+model = None
+product_store = None
+product_metadata = None
+product_index = None
+# Versión de los vectores cargados; cambia cuando se regeneran los archivos
+data_version = None
+
+# Caché de embeddings de consultas normalizadas (solo depende del modelo)
+embedding_cache = TTLCache(
+    maxsize=int(os.getenv("CHAT_EMBEDDING_CACHE_SIZE", "4096")),
+    ttl=int(os.getenv("CHAT_EMBEDDING_CACHE_TTL", "86400")),
+)
+
+_load_lock = threading.Lock()
+_loaded = threading.Event()
+_ready = threading.Event()
+_load_error = None
+_reload_lock = threading.Lock()
+_reload_thread = None
+_last_check = 0.0
+
+# Funciones llamadas tras cargar una versión nueva de los vectores
+reload_listeners = []
+
+logger = logging.getLogger(__name__)
+
+
+def load_model():
+    from sentence_transformers import SentenceTransformer
+
+    return SentenceTransformer(MODEL_NAME)
+
+
+def set_model(instance):
+    # Sustituye el modelo de embeddings (p. ej. uno pequeño en los benchmarks);
+    # debe llamarse antes de load_resources().
+    global model
+    model = instance
+
+
+def get_data_version():
+    return vector_store.get_data_version()
+
+
+def load_product_data(version=None):
+    # Las versiones publicadas se abren con memoria mapeada y ya vienen
+    # normalizadas; los archivos antiguos se normalizan al cargarlos.
+    store = vector_store.open_store(version)
+    metadata = store.metadata
+
+    if "product_name" not in metadata or "product_description" not in metadata:
+        raise ValueError("Los metadatos de productos no tienen las columnas necesarias.")
+
+    # Índice vectorial con los vectores ya normalizados; en catálogos grandes se
+    # puede activar la búsqueda aproximada (IVF) con CHAT_SEARCH_APPROXIMATE=1
+    index = VectorIndex(store.vectors, metadata, normalized=store.version is not None, scales=store.scales)
+    if CHAT_SEARCH_APPROXIMATE:
+        index.build_ivf()
+    return store, index
+
+
+def warm_up():
+    # Primera inferencia (inicializa tokenizer y pesos) y prototipos del
+    # clasificador de intención antes de recibir tráfico.
+    from services import intent_classifier
+
+    model.encode(["calentamiento"])
+    try:
+        intent_classifier.ensure_prototypes()
+    except Exception:
+        # Sin prototipos /chat sigue funcionando: se reintenta en la primera consulta
+        logger.exception("No se pudieron construir los prototipos de intención")
+    _ready.set()
+
+
+def load_resources(warm=True):
+    global model, product_store, product_metadata, product_index, data_version, _load_error
+
+    with _load_lock:
+        if _loaded.is_set():
+            return
+        try:
+            model = model or load_model()
+            data_version = vector_store.get_current_version()
+            product_store, product_index = load_product_data(data_version)
+            product_metadata = product_store.metadata
+            data_version = data_version or get_data_version()
+            _loaded.set()
+        except Exception as e:
+            _load_error = e
+            raise
+
+    if warm:
+        warm_up()
+
+
+def _reload_in_background(version):
+    global product_store, product_metadata, product_index, data_version, _reload_thread
+
+    try:
+        store, index = load_product_data(version)
+        # El índice guarda sus propios metadatos, así que quien lo lea ve
+        # siempre vectores y metadatos de la misma versión.
+        product_store, product_metadata, product_index, data_version = store, store.metadata, index, version
+        for listener in reload_listeners:
+            listener()
+    except Exception:
+        logger.exception("No se pudo cargar la versión %s de los vectores", version)
+    finally:
+        _reload_thread = None
+
+
+def check_for_update():
+    # Se llama en cada consulta; comprueba CURRENT como mucho una vez por
+    # intervalo y, si hay una versión nueva, la carga sin bloquear la petición.
+    global _last_check, _reload_thread
+
+    now = time.monotonic()
+    if not _loaded.is_set() or now - _last_check < CHAT_RELOAD_INTERVAL:
+        return
+
+    with _reload_lock:
+        if _reload_thread is not None or now - _last_check < CHAT_RELOAD_INTERVAL:
+            return
+        _last_check = now
+        version = vector_store.get_current_version()
+        if version is None or version == data_version:
+            return
+        _reload_thread = threading.Thread(target=_reload_in_background, args=(version,), daemon=True)
+        _reload_thread.start()
+
+
+def normalize_text(text):
+    # Normaliza una consulta para usarla como clave de caché: minúsculas, sin
+    # tildes, sin signos de puntuación y con los espacios colapsados.
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+
+def encode_queries(texts):
+    # Embeddings de varias consultas; las que no están en caché se codifican
+    # juntas en una sola llamada a `model.encode`. El texto normalizado es solo
+    # la clave de caché: al modelo se le pasa el texto original (el de la
+    # primera aparición de cada clave), igual que al generar los vectores.
+    keys = [normalize_text(text) for text in texts]
+    vectors = [embedding_cache.get(key) for key in keys]
+
+    missing = [position for position, vector in enumerate(vectors) if vector is None]
+    if missing:
+        pending = {}
+        for position in missing:
+            pending.setdefault(keys[position], texts[position])
+        with span("encode"):
+            encoded = dict(zip(pending, model.encode(list(pending.values()))))
+        for key, vector in encoded.items():
+            embedding_cache.set(key, vector)
+        for position in missing:
+            vectors[position] = encoded[keys[position]]
+
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def is_ready():
+    return _ready.is_set()
+
+
+def get_load_error():
+    return _load_error
+
+
+def _load_in_background():
+    try:
+        load_resources()
+    except Exception:
+        pass
+
+
+def preload():
+    # Carga los recursos según CHAT_PRELOAD (ver arriba).
+    if CHAT_PRELOAD == "import":
+        load_resources(warm=not CHAT_DEFER_WARMUP)
+    elif CHAT_PRELOAD == "background":
+        threading.Thread(target=_load_in_background, daemon=True).start()
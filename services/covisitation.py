@@ -0,0 +1,335 @@
+from models.models import MarketechProductVisited
+from database.database import db, read_replica
+from flask import current_app
+from scipy import sparse
+import pandas as pd
+import numpy as np
+import threading
+import time
+import os
+
+# Matriz de co-visitas (filtrado colaborativo ítem a ítem): la celda [a, b]
+# cuenta cuántas veces un usuario vio los productos a y b con menos de
+# COVISIT_WINDOW_HOURS entre ambas visitas y como mucho COVISIT_MAX_LAG
+# visitas de distancia. Es simétrica, dispersa (scipy CSR) e indexada por id
+# de producto.
+#
+# Se guarda en COVISITATION_PATH junto con la marca de agua (todas las visitas
+# con id <= marca están incluidas) y los ids ya incluidos por encima de ella.
+# La marca va COVISIT_WATERMARK_MARGIN ids por detrás del mayor id visto, porque
+# varios workers confirman sus lotes de visitas fuera de orden y un id menor
+# puede aparecer después que uno mayor.
+#
+# Una actualización lee las visitas posteriores a la marca que aún no estén
+# incluidas y, de sus usuarios, las visitas en el intervalo que pueden formar
+# pares con ellas (COVISIT_WINDOW_HOURS antes de la más antigua y después de
+# la más reciente). Una visita con fecha atrasada cambia la distancia entre
+# visitas ya contadas, así que en ese intervalo se recalculan los pares de esos
+# usuarios con y sin las visitas nuevas y se suma la diferencia; el resultado
+# es igual al de una reconstrucción completa.
+#
+#   python -m services.covisitation          # actualiza (o construye) y guarda
+#   python -m services.covisitation --full   # reconstruye desde cero
+
+COVISITATION_PATH = os.getenv("COVISITATION_PATH", "utils/product_covisitation.npz")
+COVISIT_WINDOW_HOURS = float(os.getenv("COVISIT_WINDOW_HOURS", "24"))
+COVISIT_MAX_LAG = int(os.getenv("COVISIT_MAX_LAG", "10"))
+COVISITATION_REFRESH_INTERVAL = float(os.getenv("COVISITATION_REFRESH_INTERVAL", "60"))
+COVISIT_WATERMARK_MARGIN = int(os.getenv("COVISIT_WATERMARK_MARGIN", "10000"))
+VISITS_CHUNK_SIZE = 500_000
+USERS_CHUNK_SIZE = 1000
+
+
+class CovisitationIndex:
+    def __init__(self, matrix, watermark, recent_ids=None):
+        self.matrix = matrix
+        self.watermark = watermark
+        # Ids de visita > watermark ya incluidos en la matriz (ordenados)
+        self.recent_ids = np.empty(0, dtype=np.int64) if recent_ids is None else np.asarray(recent_ids, dtype=np.int64)
+
+    def scores_for(self, product_ids, weights=None):
+        # Suma (ponderada) de las filas de varios productos: co-visitas por id de producto.
+        product_ids = np.asarray(product_ids, dtype=np.int64)
+        known = product_ids < self.matrix.shape[0]
+        rows = self.matrix[product_ids[known]]
+        weights = np.ones(len(rows.indptr) - 1) if weights is None else np.asarray(weights, dtype=np.float64)[known]
+        return np.asarray(rows.T @ weights).ravel()
+
+    def also_viewed(self, product_id, limit=10):
+        # Ids más co-visitados con `product_id`, de mayor a menor.
+        if product_id >= self.matrix.shape[0]:
+            return []
+        start, end = self.matrix.indptr[product_id], self.matrix.indptr[product_id + 1]
+        ids, counts = self.matrix.indices[start:end], self.matrix.data[start:end]
+        if ids.size > limit:
+            best = np.argpartition(-counts, limit - 1)[:limit]
+            ids, counts = ids[best], counts[best]
+        order = np.lexsort((ids, -counts))
+        return [int(product_id) for product_id in ids[order]]
+
+
+def covisitation_pairs(users, products, times, window_seconds=None, max_lag=COVISIT_MAX_LAG):
+    # Pares (a, b) de visitas del mismo usuario dentro de la ventana, con los
+    # arrays ordenados por usuario y fecha; se generan por distancia (lag) para
+    # no tener todos los pares en memoria a la vez.
+    window_seconds = COVISIT_WINDOW_HOURS * 3600 if window_seconds is None else window_seconds
+    for lag in range(1, max_lag + 1):
+        if lag >= len(users):
+            break
+        mask = (
+            (users[lag:] == users[:-lag])
+            & (times[lag:] - times[:-lag] <= window_seconds)
+            & (products[lag:] != products[:-lag])
+        )
+        yield products[:-lag][mask], products[lag:][mask]
+
+
+def pairs_to_matrix(pairs, size):
+    # Matriz simétrica de conteos a partir de los pares (los duplicados se
+    # suman); se acumula un bloque de pares cada vez.
+    matrix = sparse.csr_matrix((size, size), dtype=np.float32)
+    for firsts, seconds in pairs:
+        rows = np.concatenate((firsts, seconds)).astype(np.int32)
+        columns = np.concatenate((seconds, firsts)).astype(np.int32)
+        data = np.ones(rows.size, dtype=np.float32)
+        matrix = matrix + sparse.coo_matrix((data, (rows, columns)), shape=(size, size)).tocsr()
+    return matrix
+
+
+def add_matrices(matrix, delta):
+    # Suma dos matrices cuadradas de distinto tamaño (ids de producto nuevos).
+    size = max(matrix.shape[0], delta.shape[0])
+    if matrix.shape[0] < size:
+        matrix = matrix.copy()
+        matrix.resize((size, size))
+    if delta.shape[0] < size:
+        delta.resize((size, size))
+    return (matrix + delta).tocsr()
+
+
+def build_from_arrays(visit_ids, users, products, times, size=None):
+    # Matriz completa a partir de arrays de visitas en cualquier orden.
+    order = np.lexsort((visit_ids, times, users))
+    if size is None:
+        size = int(products.max()) + 1 if products.size else 0
+    return pairs_to_matrix(covisitation_pairs(users[order], products[order], times[order]), size)
+
+
+def split_watermark(visit_ids, watermark=0):
+    # Nueva marca de agua (COVISIT_WATERMARK_MARGIN por detrás del mayor id) y
+    # los ids incluidos que quedan por encima de ella.
+    if visit_ids.size == 0:
+        return watermark, np.empty(0, dtype=np.int64)
+    watermark = max(watermark, int(visit_ids.max()) - COVISIT_WATERMARK_MARGIN)
+    return watermark, np.unique(visit_ids[visit_ids > watermark])
+
+
+def window_bounds(new_times):
+    # Intervalo [desde, hasta) de fechas en segundos cuyas visitas pueden formar
+    # pares con las nuevas (las fechas se truncan al segundo).
+    window_seconds = int(COVISIT_WINDOW_HOURS * 3600)
+    return int(new_times.min()) - window_seconds, int(new_times.max()) + window_seconds + 1
+
+
+def apply_new_visits(index, new_ids, context):
+    # Nuevo índice con las visitas `new_ids` añadidas. `context` son los arrays
+    # (ids, usuarios, productos, fechas) de las visitas de sus usuarios dentro
+    # de window_bounds, incluidas o no; las que no son ni nuevas ni estaban
+    # incluidas (confirmadas después de leer las nuevas) se ignoran.
+    visit_ids, users, products, times = context
+    included = (visit_ids <= index.watermark) | np.isin(visit_ids, index.recent_ids)
+    is_new = np.isin(visit_ids, new_ids)
+
+    # De cada usuario basta el intervalo alrededor de sus propias visitas nuevas
+    window_seconds = int(COVISIT_WINDOW_HOURS * 3600)
+    _, user_codes = np.unique(users, return_inverse=True)
+    first = np.full(user_codes.max() + 1 if user_codes.size else 0, np.iinfo(np.int64).max)
+    last = np.full(first.size, np.iinfo(np.int64).min)
+    np.minimum.at(first, user_codes[is_new], times[is_new])
+    np.maximum.at(last, user_codes[is_new], times[is_new])
+    in_window = (times >= first[user_codes] - window_seconds) & (times <= last[user_codes] + window_seconds)
+    keep = (included | is_new) & in_window
+    visit_ids, users, products, times, included = visit_ids[keep], users[keep], products[keep], times[keep], included[keep]
+
+    size = max(index.matrix.shape[0], int(products.max()) + 1 if products.size else 0)
+    after = build_from_arrays(visit_ids, users, products, times, size)
+    before = build_from_arrays(visit_ids[included], users[included], products[included], times[included], size)
+    matrix = add_matrices(index.matrix, (after - before).tocsr())
+    matrix.eliminate_zeros()
+
+    watermark, recent_ids = split_watermark(np.concatenate((index.recent_ids, new_ids)), index.watermark)
+    return CovisitationIndex(matrix, watermark, recent_ids)
+
+
+def _visits_to_arrays(rows):
+    frame = pd.DataFrame(rows, columns=["id", "user_id", "product_id", "visited_at"]).dropna(subset=["visited_at"])
+    times = pd.to_datetime(frame["visited_at"]).to_numpy().astype("datetime64[s]").astype(np.int64)
+    return (
+        frame["id"].to_numpy(dtype=np.int64),
+        frame["user_id"].to_numpy(dtype=np.int64),
+        frame["product_id"].to_numpy(dtype=np.int64),
+        times,
+    )
+
+
+def _concat_arrays(chunks):
+    if not chunks:
+        return tuple(np.empty(0, dtype=np.int64) for _ in range(4))
+    return tuple(np.concatenate(parts) for parts in zip(*chunks))
+
+
+VISIT_COLUMNS = (
+    MarketechProductVisited.id,
+    MarketechProductVisited.user_id,
+    MarketechProductVisited.product_id,
+    MarketechProductVisited.visited_at,
+)
+
+
+@read_replica
+def load_visits_after(watermark):
+    # Visitas con id > watermark, leídas por bloques de ids.
+    chunks = []
+    while True:
+        rows = (
+            db.session.query(*VISIT_COLUMNS)
+            .filter(MarketechProductVisited.id > watermark)
+            .order_by(MarketechProductVisited.id)
+            .limit(VISITS_CHUNK_SIZE)
+            .all()
+        )
+        if not rows:
+            break
+        watermark = rows[-1].id
+        chunks.append(_visits_to_arrays(rows))
+    return _concat_arrays(chunks)
+
+
+@read_replica
+def load_user_visits_between(user_ids, since, until):
+    chunks = []
+    for start in range(0, len(user_ids), USERS_CHUNK_SIZE):
+        rows = (
+            db.session.query(*VISIT_COLUMNS)
+            .filter(MarketechProductVisited.user_id.in_(user_ids[start:start + USERS_CHUNK_SIZE]))
+            .filter(MarketechProductVisited.visited_at >= since)
+            .filter(MarketechProductVisited.visited_at < until)
+            .all()
+        )
+        chunks.append(_visits_to_arrays(rows))
+    return _concat_arrays(chunks)
+
+
+def build_covisitation_index():
+    visit_ids, users, products, times = load_visits_after(0)
+    watermark, recent_ids = split_watermark(visit_ids)
+    return CovisitationIndex(build_from_arrays(visit_ids, users, products, times), watermark, recent_ids)
+
+
+def update_covisitation_index(index):
+    # Nuevo índice con las visitas aún no incluidas (el índice recibido no se
+    # modifica). Devuelve el mismo si no hay visitas nuevas.
+    visit_ids, users, _, times = load_visits_after(index.watermark)
+    new = ~np.isin(visit_ids, index.recent_ids)
+    if not new.any():
+        return index
+
+    since, until = window_bounds(times[new])
+    context = load_user_visits_between(
+        np.unique(users[new]).tolist(),
+        pd.Timestamp(since, unit="s").to_pydatetime(),
+        pd.Timestamp(until, unit="s").to_pydatetime(),
+    )
+    return apply_new_visits(index, visit_ids[new], context)
+
+
+def save_covisitation_index(index, path=COVISITATION_PATH):
+    # Escritura atómica, igual que la tabla de vecinos.
+    tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+    np.savez(
+        tmp_path,
+        data=index.matrix.data,
+        indices=index.matrix.indices,
+        indptr=index.matrix.indptr,
+        shape=np.array(index.matrix.shape),
+        watermark=np.array(index.watermark),
+        recent_ids=index.recent_ids,
+        params=np.array(repr((COVISIT_WINDOW_HOURS, COVISIT_MAX_LAG))),
+    )
+    os.replace(tmp_path, path)
+
+
+def load_covisitation_index(path=COVISITATION_PATH):
+    # None si no existe, se construyó con otra ventana o distancia máxima o
+    # es de un formato anterior (sin los ids recientes).
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        if str(data["params"]) != repr((COVISIT_WINDOW_HOURS, COVISIT_MAX_LAG)) or "recent_ids" not in data:
+            return None
+        matrix = sparse.csr_matrix((data["data"], data["indices"], data["indptr"]), shape=tuple(data["shape"]))
+        return CovisitationIndex(matrix, int(data["watermark"]), data["recent_ids"])
+
+
+_index = None
+_index_lock = threading.Lock()
+_update_thread = None
+_last_update = 0.0
+
+
+def _update_in_background(app):
+    global _index, _update_thread, _last_update
+
+    try:
+        with app.app_context():
+            new_index = update_covisitation_index(_index)
+        with _index_lock:
+            _index = new_index
+            _last_update = time.monotonic()
+    finally:
+        _update_thread = None
+
+
+def get_covisitation_index():
+    # Índice compartido: la primera vez se carga del archivo (o se construye) y
+    # se pone al día; después se actualiza en segundo plano cada
+    # COVISITATION_REFRESH_INTERVAL segundos sin bloquear la petición.
+    global _index, _update_thread, _last_update
+
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                saved = load_covisitation_index()
+                _index = update_covisitation_index(saved) if saved is not None else build_covisitation_index()
+                _last_update = time.monotonic()
+        return _index
+
+    if time.monotonic() - _last_update >= COVISITATION_REFRESH_INTERVAL:
+        with _index_lock:
+            if _update_thread is None and time.monotonic() - _last_update >= COVISITATION_REFRESH_INTERVAL:
+                app = current_app._get_current_object()
+                _update_thread = threading.Thread(target=_update_in_background, args=(app,), daemon=True)
+                _update_thread.start()
+    return _index
+
+
+if __name__ == "__main__":
+    from database.database import init_app
+    from flask import Flask
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Construye o actualiza la matriz de co-visitas.")
+    parser.add_argument("--full", action="store_true", help="Reconstruir desde cero")
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    init_app(app)
+    with app.app_context():
+        start = time.perf_counter()
+        saved = None if args.full else load_covisitation_index()
+        index = build_covisitation_index() if saved is None else update_covisitation_index(saved)
+        save_covisitation_index(index)
+        print(
+            f"Matriz de co-visitas: {index.matrix.nnz} pares, marca de agua {index.watermark}, "
+            f"{time.perf_counter() - start:.1f} s ({COVISITATION_PATH})"
+        )
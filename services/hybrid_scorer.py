@@ -0,0 +1,214 @@
+from services.recommendation_by_popularity import get_popularity_matrix
+from services import visit_ingestion
+from flask import current_app
+import numpy as np
+import threading
+import hashlib
+import time
+import os
+
+# Puntuación híbrida de candidatos para las recomendaciones por usuario.
+#
+# Los candidatos son los vecinos (tabla precalculada del índice TF-IDF) de los
+# productos visitados. Cada uno recibe una suma ponderada de señales en [0, 1]:
+# - content: similitud con los productos visitados, ponderada por el peso
+#   temporal de cada visita (apply_temporal_weighting);
+# - category: fracción del peso de las visitas en la categoría del candidato;
+# - popularity: visitas del producto (get_popularity_matrix) en escala log,
+#   relativas al más visitado;
+# - freshness: decae a la mitad cada RECOMMENDATION_FRESHNESS_HALF_LIFE_DAYS;
+# - covisitation (opcional, peso 0 por defecto): co-visitas con los productos
+#   visitados (services/covisitation.py), relativas al mejor candidato. Con
+#   peso > 0 los productos más co-visitados se suman también como candidatos.
+# - search: similitud de las búsquedas recientes del usuario con el producto
+#   (services/search_intent.py); los productos encontrados también son
+#   candidatos, así que un usuario sin visitas recibe recomendaciones.
+# Las visitas registradas por POST /product_visited se suman a la popularidad
+# al momento; el recálculo periódico desde la base de datos corrige el resto.
+# Todo se calcula con arrays de NumPy sobre los candidatos y los mejores se
+# eligen con argpartition. Los pesos se configuran con RECOMMENDATION_WEIGHT_*.
+
+SCORE_WEIGHTS = {
+    "content": float(os.getenv("RECOMMENDATION_WEIGHT_CONTENT", "1.0")),
+    "category": float(os.getenv("RECOMMENDATION_WEIGHT_CATEGORY", "0.3")),
+    "popularity": float(os.getenv("RECOMMENDATION_WEIGHT_POPULARITY", "0.2")),
+    "freshness": float(os.getenv("RECOMMENDATION_WEIGHT_FRESHNESS", "0.1")),
+    "covisitation": float(os.getenv("RECOMMENDATION_WEIGHT_COVISITATION", "0")),
+    "search": float(os.getenv("RECOMMENDATION_WEIGHT_SEARCH", "0.5")),
+}
+CANDIDATES_PER_VISIT = int(os.getenv("RECOMMENDATION_CANDIDATES_PER_VISIT", "10"))
+COVISITATION_CANDIDATES = int(os.getenv("RECOMMENDATION_COVISITATION_CANDIDATES", "20"))
+FRESHNESS_HALF_LIFE_DAYS = float(os.getenv("RECOMMENDATION_FRESHNESS_HALF_LIFE_DAYS", "90"))
+POPULARITY_WINDOW = os.getenv("RECOMMENDATION_POPULARITY_WINDOW") or None
+POPULARITY_REFRESH_INTERVAL = float(os.getenv("RECOMMENDATION_POPULARITY_REFRESH_INTERVAL", "300"))
+# La visita más antigua de cada usuario tiene peso temporal 0; con este mínimo
+# sigue aportando candidatos (y un usuario con una sola visita también).
+MIN_VISIT_WEIGHT = 0.1
+
+# Popularidad por fila del índice: (índice, visitas, puntuación, momento del cálculo)
+_popularity = None
+_popularity_lock = threading.Lock()
+_refresh_thread = None
+
+
+def config_version():
+    # Cambia al cambiar los pesos o parámetros; forma parte de la versión de
+    # las recomendaciones guardadas (services/recommendation_store.py).
+    config = repr((sorted(SCORE_WEIGHTS.items()), CANDIDATES_PER_VISIT, COVISITATION_CANDIDATES,
+                   FRESHNESS_HALF_LIFE_DAYS, POPULARITY_WINDOW))
+    return hashlib.sha1(config.encode("utf-8")).hexdigest()[:8]
+
+
+def compute_popularity_counts(index):
+    # Visitas por producto alineadas con las filas del índice.
+    popularity_df = get_popularity_matrix(window=POPULARITY_WINDOW)
+    product_ids = popularity_df['product_id'].to_numpy(dtype=np.int64)
+    popularity = popularity_df['popularity'].to_numpy(dtype=np.float64)
+    known = (product_ids >= 0) & (product_ids < len(index.row_by_id))
+    rows = index.row_by_id[product_ids[known]]
+    in_index = rows >= 0
+    counts = np.bincount(rows[in_index], weights=popularity[known][in_index], minlength=len(index.ids))
+    return counts.astype(np.float32)
+
+
+def popularity_scores_from_counts(counts):
+    # Escala log relativa al producto más visitado, en [0, 1].
+    scores = np.log1p(counts)
+    top = scores.max() if scores.size else 0.0
+    return scores / top if top > 0 else scores
+
+
+def _popularity_entry(index, counts):
+    return (index, counts, popularity_scores_from_counts(counts), time.monotonic())
+
+
+def _refresh_in_background(app, index):
+    global _popularity, _refresh_thread
+
+    try:
+        with app.app_context():
+            counts = compute_popularity_counts(index)
+        with _popularity_lock:
+            _popularity = _popularity_entry(index, counts)
+    finally:
+        _refresh_thread = None
+
+
+def get_popularity_scores(index):
+    # La primera vez (o con un índice nuevo) se calcula en la petición; después
+    # se recalcula en segundo plano cada POPULARITY_REFRESH_INTERVAL segundos.
+    global _popularity, _refresh_thread
+
+    current = _popularity
+    if current is None or current[0] is not index:
+        with _popularity_lock:
+            if _popularity is None or _popularity[0] is not index:
+                _popularity = _popularity_entry(index, compute_popularity_counts(index))
+            return _popularity[2]
+
+    if time.monotonic() - current[3] >= POPULARITY_REFRESH_INTERVAL:
+        with _popularity_lock:
+            if _refresh_thread is None:
+                app = current_app._get_current_object()
+                _refresh_thread = threading.Thread(target=_refresh_in_background, args=(app, index), daemon=True)
+                _refresh_thread.start()
+    return current[2]
+
+
+def add_visits_to_popularity(rows):
+    # Listener de visit_ingestion: suma las visitas nuevas sin consultar la base de datos.
+    global _popularity
+
+    with _popularity_lock:
+        if _popularity is None:
+            return
+        index, counts = _popularity[0], _popularity[1].copy()
+        product_ids = np.array([row["product_id"] for row in rows], dtype=np.int64)
+        # Un id negativo leería row_by_id desde el final
+        product_ids = product_ids[(product_ids >= 0) & (product_ids < len(index.row_by_id))]
+        visited_rows = index.row_by_id[product_ids]
+        np.add.at(counts, visited_rows[visited_rows >= 0], 1)
+        _popularity = (index, counts, popularity_scores_from_counts(counts), _popularity[3])
+
+
+visit_ingestion.visit_listeners.append(add_visits_to_popularity)
+
+
+def covisited_rows(index, covisitation_scores, limit=COVISITATION_CANDIDATES):
+    # Filas del índice de los `limit` productos con más co-visitas.
+    ids = np.flatnonzero(covisitation_scores)
+    if ids.size > limit:
+        ids = ids[np.argpartition(-covisitation_scores[ids], limit - 1)[:limit]]
+    ids = ids[ids < len(index.row_by_id)]
+    rows = index.row_by_id[ids]
+    return rows[rows >= 0]
+
+
+def score_candidates(index, visited_rows, visit_weights, popularity_scores, now=None, covisitation=None, search=None):
+    # Candidatos (filas del índice, sin repetir ni visitados) y su puntuación.
+    # `covisitation` es el CovisitationIndex; solo se usa si su peso es > 0.
+    # `search` son (filas, puntuaciones) de las búsquedas del usuario.
+    visited_rows = np.asarray(visited_rows, dtype=np.int64)
+    visit_weights = np.maximum(np.asarray(visit_weights, dtype=np.float32), MIN_VISIT_WEIGHT)
+
+    width = min(CANDIDATES_PER_VISIT, index.neighbor_rows.shape[1])
+    neighbor_rows = index.neighbor_rows[visited_rows, :width].ravel()
+    neighbor_scores = (index.neighbor_scores[visited_rows, :width] * visit_weights[:, None]).ravel()
+
+    covisitation_scores = None
+    if covisitation is not None and SCORE_WEIGHTS["covisitation"] > 0:
+        covisitation_scores = covisitation.scores_for(index.ids[visited_rows], visit_weights)
+        extra_rows = covisited_rows(index, covisitation_scores)
+        neighbor_rows = np.concatenate((neighbor_rows, extra_rows))
+        neighbor_scores = np.concatenate((neighbor_scores, np.zeros(extra_rows.size, dtype=neighbor_scores.dtype)))
+    if search is not None and SCORE_WEIGHTS["search"] > 0:
+        neighbor_rows = np.concatenate((neighbor_rows, search[0]))
+        neighbor_scores = np.concatenate((neighbor_scores, np.zeros(search[0].size, dtype=neighbor_scores.dtype)))
+
+    valid = (neighbor_rows >= 0) & ~np.isin(neighbor_rows, visited_rows)
+    if not valid.any():
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+    # Similitud acumulada por candidato (un producto puede ser vecino de varias visitas)
+    candidates, inverse = np.unique(neighbor_rows[valid], return_inverse=True)
+    # Sin visitas (solo candidatos de búsquedas) la suma es 0 y contenido y categoría quedan en 0
+    total_weight = max(visit_weights.sum(), MIN_VISIT_WEIGHT)
+    content = np.bincount(inverse, weights=neighbor_scores[valid], minlength=candidates.size) / total_weight
+
+    category_weights = np.bincount(index.category_codes[visited_rows], weights=visit_weights,
+                                   minlength=index.category_count)
+    category = category_weights[index.category_codes[candidates]] / total_weight
+
+    now = time.time() if now is None else now
+    age_days = np.maximum(now - index.created_at[candidates], 0) / 86400
+    freshness = np.exp2(-age_days / FRESHNESS_HALF_LIFE_DAYS)
+
+    scores = (
+        SCORE_WEIGHTS["content"] * content
+        + SCORE_WEIGHTS["category"] * category
+        + SCORE_WEIGHTS["popularity"] * popularity_scores[candidates]
+        + SCORE_WEIGHTS["freshness"] * freshness
+    )
+    if covisitation_scores is not None:
+        candidate_ids = index.ids[candidates].astype(np.int64)
+        known = candidate_ids < covisitation_scores.size
+        covisits = np.zeros(candidates.size)
+        covisits[known] = covisitation_scores[candidate_ids[known]]
+        if covisits.max() > 0:
+            scores = scores + SCORE_WEIGHTS["covisitation"] * covisits / covisits.max()
+    if search is not None and SCORE_WEIGHTS["search"] > 0:
+        # Ambos arrays están ordenados y sin repetir (np.unique)
+        _, in_candidates, in_search = np.intersect1d(candidates, search[0], assume_unique=True, return_indices=True)
+        searched = np.zeros(candidates.size)
+        searched[in_candidates] = search[1][in_search]
+        scores = scores + SCORE_WEIGHTS["search"] * searched
+    return candidates, scores
+
+
+def top_rows(candidates, scores, limit):
+    # Las `limit` mejores filas en orden descendente (argpartition + orden de esas pocas).
+    if candidates.size > limit:
+        best = np.argpartition(-scores, limit - 1)[:limit]
+        candidates, scores = candidates[best], scores[best]
+    order = np.argsort(-scores, kind="stable")
+    return candidates[order]
@@ -0,0 +1,119 @@
+from services.vector_index import normalize_rows
+from services import chat_resources
+import pandas as pd
+import numpy as np
+import threading
+import os
+
+# Clasificador local de intención por prototipo más cercano: cada intención se
+# representa con el centroide de los embeddings de sus preguntas de ejemplo
+# (utils/intent_examples.csv), usando el mismo modelo ya cargado por el chatbot.
+# La confianza es el margen de similitud entre la mejor y la segunda intención.
+#
+# Los prototipos se construyen en chat_resources.warm_up(), no en la primera
+# consulta. El umbral de confianza por debajo del cual se consulta a GPT se
+# calibra con los mismos ejemplos (validación cruzada, como en
+# benchmarks/intent_classifier_eval.py): es el menor margen con el que las
+# respuestas locales alcanzan INTENT_TARGET_ACCURACY. Depende del modelo de
+# embeddings, así que no hay un valor fijo; INTENT_CONFIDENCE_THRESHOLD lo fija a mano.
+
+EXAMPLES_PATH = "utils/intent_examples.csv"
+INTENT_CONFIDENCE_THRESHOLD = os.getenv("INTENT_CONFIDENCE_THRESHOLD")
+INTENT_TARGET_ACCURACY = float(os.getenv("INTENT_TARGET_ACCURACY", "0.95"))
+INTENT_CALIBRATION_FOLDS = int(os.getenv("INTENT_CALIBRATION_FOLDS", "5"))
+
+_labels = None
+_prototypes = None
+_threshold = None
+_lock = threading.Lock()
+
+
+def load_examples(path=EXAMPLES_PATH):
+    examples = pd.read_csv(path)
+    return examples["question"].tolist(), examples["intent"].tolist()
+
+
+def build_prototypes(vectors, labels):
+    # Centroide normalizado de los ejemplos de cada intención.
+    vectors = normalize_rows(vectors)
+    labels = np.asarray(labels)
+    unique_labels = sorted({str(label) for label in labels})
+    prototypes = np.stack([vectors[labels == label].mean(axis=0) for label in unique_labels])
+    return unique_labels, normalize_rows(prototypes)
+
+
+def classify_vectors(vectors, labels, prototypes):
+    # Devuelve (intenciones, confianzas) para una matriz de embeddings.
+    scores = normalize_rows(vectors) @ prototypes.T
+    order = np.argsort(-scores, axis=1)
+    best = scores[np.arange(len(scores)), order[:, 0]]
+    second = scores[np.arange(len(scores)), order[:, 1]] if scores.shape[1] > 1 else np.zeros(len(scores))
+    return [labels[position] for position in order[:, 0]], best - second
+
+
+def stratified_folds(labels, folds, seed=0):
+    # Asigna cada ejemplo a un pliegue, repartiendo cada intención por igual.
+    rng = np.random.default_rng(seed)
+    assignment = np.empty(len(labels), dtype=int)
+    for label in set(labels):
+        positions = np.flatnonzero(np.asarray(labels) == label)
+        rng.shuffle(positions)
+        assignment[positions] = np.arange(len(positions)) % folds
+    return assignment
+
+
+def cross_validate(vectors, labels, folds=INTENT_CALIBRATION_FOLDS, seed=0):
+    # (aciertos, confianzas) de cada ejemplo clasificado con prototipos que no lo incluyen.
+    labels = [str(label) for label in labels]
+    correct = np.zeros(len(labels), dtype=bool)
+    confidences = np.zeros(len(labels))
+    assignment = stratified_folds(labels, folds, seed)
+    for fold in range(folds):
+        train = np.flatnonzero(assignment != fold)
+        test = np.flatnonzero(assignment == fold)
+        fold_labels, prototypes = build_prototypes(vectors[train], [labels[i] for i in train])
+        predicted, fold_confidences = classify_vectors(vectors[test], fold_labels, prototypes)
+        correct[test] = [label == labels[i] for i, label in zip(test, predicted)]
+        confidences[test] = fold_confidences
+    return correct, confidences
+
+
+def calibrate_threshold(correct, confidences, target_accuracy=INTENT_TARGET_ACCURACY):
+    # Menor umbral con el que la exactitud de lo que se resuelve localmente
+    # alcanza `target_accuracy`; infinito (todo a GPT) si ninguno la alcanza.
+    for threshold in np.unique(confidences):
+        if correct[confidences >= threshold].mean() >= target_accuracy:
+            return float(threshold)
+    return float("inf")
+
+
+def ensure_prototypes():
+    # Codifica los ejemplos una vez por proceso (desde chat_resources.warm_up()).
+    global _labels, _prototypes, _threshold
+
+    if _prototypes is None:
+        with _lock:
+            if _prototypes is None:
+                questions, labels = load_examples()
+                # Mismo camino que classify(): los ejemplos se codifican como
+                # las consultas, así el umbral calibrado vale para sus puntuaciones
+                vectors = chat_resources.encode_queries(questions)
+                if INTENT_CONFIDENCE_THRESHOLD is not None:
+                    _threshold = float(INTENT_CONFIDENCE_THRESHOLD)
+                else:
+                    folds = min(INTENT_CALIBRATION_FOLDS, min(labels.count(label) for label in set(labels)))
+                    _threshold = calibrate_threshold(*cross_validate(vectors, labels, folds)) if folds > 1 else float("inf")
+                _labels, _prototypes = build_prototypes(vectors, labels)
+
+
+def confidence_threshold():
+    ensure_prototypes()
+    return _threshold
+
+
+def classify(user_input):
+    # Clasifica la consulta en milisegundos; devuelve (intención, confianza).
+    ensure_prototypes()
+    vector = chat_resources.encode_queries([user_input])
+    labels, confidences = classify_vectors(vector, _labels, _prototypes)
+    return labels[0], float(confidences[0])
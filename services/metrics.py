@@ -0,0 +1,212 @@
+from flask import g, has_request_context, request
+from sqlalchemy.engine import Engine
+from sqlalchemy import event
+import functools
+import threading
+import bisect
+import time
+import os
+
+# Métricas de latencia por ruta y por etapa (consultas SQL, índice TF-IDF,
+# embeddings, búsqueda vectorial, llamadas a GPT...).
+#
+# - `with span("etapa"):` o `@timed("etapa")` mide un bloque. La duración se
+#   acumula en un histograma por etapa y, dentro de una petición, en la
+#   cabecera Server-Timing de la respuesta (`etapa;dur=ms`, una entrada por
+#   etapa con el total y el número de veces).
+# - Todas las consultas SQL se miden como la etapa "db" con eventos del engine.
+# - GET /metrics (main.py) expone los histogramas en formato de texto de
+#   Prometheus, junto con los valores de las funciones registradas con
+#   register_collector (cachés, pool de conexiones).
+#
+# Cada medición son dos perf_counter y un incremento bajo un lock, así que
+# puede quedar activo en producción; METRICS_ENABLED=0 lo desactiva.
+# En respuestas en streaming (/chat/stream) la cabecera y la duración de la
+# ruta se toman al enviar las cabeceras; las etapas que ocurren mientras se
+# genera el cuerpo solo quedan en los histogramas.
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+
+# Límites superiores de los buckets, en segundos
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        # Un contador por bucket más el de +Inf (no acumulados)
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[position] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        with self._lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        cumulative, running = [], 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            running += bucket_count
+            cumulative.append((bound, running))
+        return cumulative, total, count
+
+
+_route_histograms = {}
+_stage_histograms = {}
+_histograms_lock = threading.Lock()
+_collectors = []
+
+
+def _histogram(registry, key):
+    histogram = registry.get(key)
+    if histogram is None:
+        with _histograms_lock:
+            histogram = registry.setdefault(key, Histogram())
+    return histogram
+
+
+def record_stage(name, seconds):
+    # Registra una duración ya medida (histograma y, si hay petición, Server-Timing).
+    _histogram(_stage_histograms, name).observe(seconds)
+    if has_request_context():
+        stages = g.setdefault("metric_stages", {})
+        entry = stages.get(name)
+        if entry is None:
+            stages[name] = [seconds, 1]
+        else:
+            entry[0] += seconds
+            entry[1] += 1
+
+
+class span:
+    # Mide el bloque `with span("etapa"):`.
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if METRICS_ENABLED:
+            record_stage(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def timed(name):
+    # Decorador equivalente a envolver toda la función en span(name).
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def register_collector(collect):
+    # `collect()` devuelve tuplas (métrica, {etiquetas}, valor); las métricas
+    # terminadas en `_total` se publican como counter y el resto como gauge.
+    _collectors.append(collect)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metric_query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("metric_query_start")
+    if starts and METRICS_ENABLED:
+        record_stage("db", time.perf_counter() - starts.pop())
+
+
+@event.listens_for(Engine, "handle_error")
+def _on_query_error(context):
+    starts = context.connection.info.get("metric_query_start") if context.connection is not None else None
+    if starts:
+        starts.pop()
+
+
+def server_timing_header(stages, total):
+    entries = [
+        f'{name};dur={seconds * 1000:.2f};desc="{count}x"' if count > 1 else f"{name};dur={seconds * 1000:.2f}"
+        for name, (seconds, count) in stages.items()
+    ]
+    entries.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(entries)
+
+
+def init_app(app):
+    if not METRICS_ENABLED:
+        return
+
+    @app.before_request
+    def _start_request_timer():
+        g.metric_request_start = time.perf_counter()
+
+    @app.after_request
+    def _finish_request_timer(response):
+        start = g.get("metric_request_start")
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        route = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+        _histogram(_route_histograms, (request.method, route, str(response.status_code))).observe(elapsed)
+        response.headers["Server-Timing"] = server_timing_header(g.get("metric_stages", {}), elapsed)
+        return response
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _render_histograms(lines, name, help_text, registry, label_names):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} histogram")
+    for key, histogram in sorted(registry.items()):
+        labels = dict(zip(label_names, key if isinstance(key, tuple) else (key,)))
+        cumulative, total, count = histogram.snapshot()
+        for bound, bucket_count in cumulative:
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f"{name}_bucket{_labels({**labels, 'le': le})} {bucket_count}")
+        lines.append(f"{name}_sum{_labels(labels)} {total}")
+        lines.append(f"{name}_count{_labels(labels)} {count}")
+
+
+def render_metrics():
+    # Texto en formato de exposición de Prometheus (text/plain; version=0.0.4).
+    lines = []
+    _render_histograms(lines, "marketech_request_duration_seconds", "Duración de las peticiones por ruta.",
+                       _route_histograms, ("method", "route", "status"))
+    _render_histograms(lines, "marketech_stage_duration_seconds", "Duración de las etapas internas.",
+                       _stage_histograms, ("stage",))
+
+    samples = {}
+    for collect in _collectors:
+        try:
+            for name, labels, value in collect():
+                samples.setdefault(name, []).append((labels, value))
+        except Exception:
+            # Una fuente que falla (p. ej. sin base de datos) no debe tumbar /metrics
+            continue
+    for name, values in samples.items():
+        lines.append(f"# TYPE {name} {'counter' if name.endswith('_total') else 'gauge'}")
+        for labels, value in values:
+            lines.append(f"{name}{_labels(labels)} {float(value)}")
+    return "\n".join(lines) + "\n"
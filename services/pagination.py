@@ -0,0 +1,69 @@
+from flask import Response, current_app, request, stream_with_context
+
+# Paginación por cursor (keyset) sobre `id` y modo streaming NDJSON para las rutas de listas
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+STREAM_BATCH_SIZE = 500
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+
+def get_page_args():
+    # Lee `limit` y `after` de la petición. En modo streaming no hay límite por
+    # defecto. Lanza ValueError si los parámetros no son válidos.
+    limit = None if wants_stream() else DEFAULT_PAGE_SIZE
+    after = None
+
+    if 'limit' in request.args:
+        limit = _parse_int(request.args['limit'])
+        if limit is None or not 1 <= limit <= MAX_PAGE_SIZE:
+            raise ValueError(f'"limit" debe estar entre 1 y {MAX_PAGE_SIZE}.')
+    if 'after' in request.args:
+        after = _parse_int(request.args['after'])
+        if after is None or after < 0:
+            raise ValueError('"after" debe ser un id entero no negativo.')
+    return limit, after
+
+
+def _parse_int(value):
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+def wants_stream():
+    return request.args.get('stream') in ('1', 'true') or request.accept_mimetypes.best == NDJSON_MIMETYPE
+
+
+def keyset(query, id_column, limit=None, after=None):
+    # Aplica el cursor: filas con id mayor que `after`, ordenadas por id. Se pide
+    # una fila de más para saber si existe una página siguiente.
+    if after is not None:
+        query = query.filter(id_column > after)
+    query = query.order_by(id_column)
+    if limit is not None:
+        query = query.limit(limit + 1)
+    return query
+
+
+def split_page(rows, limit):
+    # Devuelve (filas de la página, cursor siguiente o None).
+    if limit is None or len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, rows[-1].id
+
+
+def stream_rows(query):
+    # Itera las filas tal como llegan del cursor de la base de datos.
+    return query.execution_options(stream_results=True).yield_per(STREAM_BATCH_SIZE)
+
+
+def ndjson_response(objects):
+    # Respuesta en streaming: un objeto JSON por línea, serializado con el
+    # mismo proveedor JSON de Flask que usa jsonify.
+    def generate():
+        for obj in objects:
+            yield current_app.json.dumps(obj) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
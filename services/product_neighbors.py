@@ -0,0 +1,145 @@
+import numpy as np
+import os
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin bloqueo entre procesos
+    fcntl = None
+
+# Tabla precalculada de vecinos más cercanos (top-K) por producto
+NEIGHBORS_PATH = os.getenv("PRODUCT_NEIGHBORS_PATH", "utils/product_neighbors.npz")
+NEIGHBORS_K = int(os.getenv("PRODUCT_NEIGHBORS_K", "10"))
+NEIGHBORS_BLOCK_SIZE = 512
+
+
+def compute_neighbor_rows(index, k=NEIGHBORS_K, block_size=NEIGHBORS_BLOCK_SIZE):
+    # Calcula, por bloques de filas, los k productos más similares de cada
+    # producto del índice, sin el propio producto (se excluye por posición, así
+    # que un duplicado exacto sí queda como vecino). Devuelve filas del índice
+    # (-1 si no hay vecino).
+    total = index.matrix.shape[0]
+    neighbor_rows = np.full((total, k), -1, dtype=np.int64)
+    neighbor_scores = np.zeros((total, k), dtype=np.float32)
+    width = min(k, total - 1)
+    if width <= 0:
+        return neighbor_rows, neighbor_scores
+
+    for start in range(0, total, block_size):
+        rows = np.arange(start, min(start + block_size, total))
+        sims = index.similarities(rows)
+        sims[np.arange(len(rows)), rows] = -np.inf
+        # argpartition deja los `width` mejores sin ordenar todo el catálogo;
+        # después se ordenan por similitud descendente y, a igualdad, por fila.
+        best = np.argpartition(-sims, width - 1, axis=1)[:, :width]
+        best_scores = np.take_along_axis(sims, best, axis=1)
+        order = np.lexsort((best, -best_scores), axis=1)
+        neighbor_rows[rows, :width] = np.take_along_axis(best, order, axis=1)
+        neighbor_scores[rows, :width] = np.take_along_axis(best_scores, order, axis=1)
+
+    return neighbor_rows, neighbor_scores
+
+
+def save_neighbor_table(index, neighbor_rows, neighbor_scores, path=NEIGHBORS_PATH):
+    # Guarda la tabla con ids de producto (no filas) y la firma del catálogo.
+    # Se escribe en un archivo temporal y se reemplaza de forma atómica.
+    neighbor_ids = np.where(neighbor_rows >= 0, index.ids[neighbor_rows], -1)
+    tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+    np.savez(
+        tmp_path,
+        ids=index.ids.astype(np.int64),
+        neighbor_ids=neighbor_ids.astype(np.int64),
+        neighbor_scores=neighbor_scores,
+        signature=np.array(repr(index.signature)),
+    )
+    os.replace(tmp_path, path)
+
+
+def load_neighbor_table(index, path=NEIGHBORS_PATH):
+    # Carga la tabla guardada si corresponde a la misma firma del catálogo.
+    # Devuelve (filas, puntuaciones) alineadas con el índice o None.
+    if not os.path.exists(path):
+        return None
+
+    with np.load(path) as data:
+        if str(data['signature']) != repr(index.signature):
+            return None
+        ids = data['ids']
+        neighbor_ids = data['neighbor_ids']
+        neighbor_scores = data['neighbor_scores']
+
+    if len(ids) != len(index.ids) or not np.array_equal(ids, index.ids):
+        return None
+
+    # Los ids coinciden con el índice, así que la fila es la posición del id
+    sorter = np.argsort(ids, kind='stable')
+    positions = np.searchsorted(ids, neighbor_ids, sorter=sorter).clip(0, len(ids) - 1)
+    neighbor_rows = np.where(neighbor_ids >= 0, sorter[positions], -1)
+    return neighbor_rows, neighbor_scores
+
+
+class _BuildLock:
+    # Bloqueo entre procesos (flock) para que, tras un cambio del catálogo, un
+    # solo worker calcule la tabla y los demás carguen la que guarda.
+    def __init__(self, path):
+        self.path = f"{path}.lock"
+        self.file = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            try:
+                self.file = open(self.path, "a")
+                fcntl.flock(self.file, fcntl.LOCK_EX)
+            except OSError:
+                self.file = None
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.file is not None:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+            self.file.close()
+
+
+def load_or_build_neighbor_table(index, reuse_saved=True, path=NEIGHBORS_PATH):
+    # Usa la tabla guardada si sigue siendo válida; si no, la recalcula y la persiste.
+    if reuse_saved:
+        table = load_neighbor_table(index, path)
+        if table is not None:
+            return table
+
+    with _BuildLock(path):
+        # Otro proceso pudo guardarla mientras se esperaba el bloqueo
+        if reuse_saved:
+            table = load_neighbor_table(index, path)
+            if table is not None:
+                return table
+
+        neighbor_rows, neighbor_scores = compute_neighbor_rows(index)
+        try:
+            save_neighbor_table(index, neighbor_rows, neighbor_scores, path)
+        except OSError:
+            pass
+    return neighbor_rows, neighbor_scores
+
+
+def rebuild_neighbor_table():
+    # Reconstruye el índice del catálogo y su tabla de vecinos desde cero.
+    from services.catalog_index import build_catalog_index
+
+    index = build_catalog_index(reuse_saved_neighbors=False)
+    if index is None:
+        print("No hay productos disponibles en la base de datos.")
+        return
+    print(f"Tabla de vecinos generada para {len(index.ids)} productos en {NEIGHBORS_PATH}")
+
+
+if __name__ == "__main__":
+    from database.database import init_app
+    from flask import Flask
+
+    # Inicializar la aplicación Flask
+    app = Flask(__name__)
+    init_app(app)
+
+    # Ejecutar dentro del contexto de la aplicación
+    with app.app_context():
+        rebuild_neighbor_table()
@@ -1,52 +1,151 @@
+from services.recommendation_by_popularity import get_popularity_matrix
 from models.models import MarketechProduct, MarketechProductVisited
-from flask import render_template
-from database.database import db
-import matplotlib.pyplot as plt
-import pandas as pd
+from matplotlib.figure import Figure
+from flask import render_template, current_app
+from database.database import db, read_replica
+from services.metrics import timed
+import threading
+import time
 import os
 
-def get_popularity_matrix():
-    visits_data = db.session.query(MarketechProductVisited.product_id).all()
-    visits_df = pd.DataFrame(visits_data, columns=["product_id"])
-    popularity_df = visits_df.groupby('product_id').size().reset_index(name='popularity')
-    popularity_df = popularity_df.sort_values(by='popularity', ascending=False)
-    return popularity_df
+# Segundos entre comprobaciones de la versión de los datos de popularidad
+POPULARITY_CHECK_INTERVAL = float(os.getenv("POPULARITY_CHECK_INTERVAL", "60"))
+# Gráficos de versiones anteriores que se conservan (otros workers pueden
+# seguir sirviendo una página de una versión algo más antigua)
+POPULARITY_CHARTS_KEEP = int(os.getenv("POPULARITY_CHARTS_KEEP", "10"))
+STATIC_FOLDER = 'static'
 
-def generate_popularity_graph():
-    popularity_df = get_popularity_matrix()
+_page_cache = None
+_cache_lock = threading.Lock()
+_refresh_thread = None
+_last_check = 0.0
+
+@read_replica
+def get_popularity_version():
+    # Versión barata de los datos de popularidad: cambia al registrar o borrar visitas.
+    count, max_id = db.session.query(
+        db.func.count(MarketechProductVisited.id),
+        db.func.max(MarketechProductVisited.id),
+    ).one()
+    return f"{count}-{max_id}"
+
+def chart_filename(version):
+    # Un archivo por versión: cada worker enlaza el gráfico de los datos de su página
+    return f"popularity_chart_{version}.png"
+
+def prune_popularity_charts(keep=POPULARITY_CHARTS_KEEP):
+    # Borra los gráficos más antiguos, conservando los `keep` más recientes.
+    charts = [
+        os.path.join(STATIC_FOLDER, name) for name in os.listdir(STATIC_FOLDER)
+        if name.startswith('popularity_chart_') and name.endswith('.png')
+    ]
+    charts.sort(key=lambda path: os.path.getmtime(path), reverse=True)
+    for path in charts[keep:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
 
-    plt.figure(figsize=(10, 6))
-    plt.bar(popularity_df['product_id'].astype(str), popularity_df['popularity'], color='skyblue')
-    plt.xlabel('Product ID')
-    plt.ylabel('Popularity (Number of Visits)')
-    plt.title('Top Product Popularity')
-    plt.xticks(rotation=45, ha='right')
-    plt.tight_layout()
+@timed("popularity_chart")
+def generate_popularity_graph(popularity_df=None, version=None):
+    if popularity_df is None:
+        popularity_df = get_popularity_matrix()
+    version = version or get_popularity_version()
 
-    static_folder = 'static'
-    if not os.path.exists(static_folder):
-        os.makedirs(static_folder)
+    if not os.path.exists(STATIC_FOLDER):
+        os.makedirs(STATIC_FOLDER)
+    # Otro worker ya generó el gráfico de esta versión
+    img_path = os.path.join(STATIC_FOLDER, chart_filename(version))
+    if os.path.exists(img_path):
+        return img_path, popularity_df
 
-    img_path = os.path.join(static_folder, 'popularity_chart.png')
-    plt.savefig(img_path)
-    plt.close()
+    # Se usa Figure directamente (sin el estado global de pyplot) para poder
+    # generar el gráfico desde un hilo en segundo plano.
+    fig = Figure(figsize=(10, 6))
+    ax = fig.subplots()
+    ax.bar(popularity_df['product_id'].astype(str), popularity_df['popularity'], color='skyblue')
+    ax.set_xlabel('Product ID')
+    ax.set_ylabel('Popularity (Number of Visits)')
+    ax.set_title('Top Product Popularity')
+    ax.tick_params(axis='x', labelrotation=45)
+    for label in ax.get_xticklabels():
+        label.set_horizontalalignment('right')
+    fig.tight_layout()
+
+    # Escritura atómica: otros workers nunca leen un PNG a medio escribir
+    tmp_path = os.path.join(STATIC_FOLDER, f'.popularity_chart.{os.getpid()}.{threading.get_ident()}.png')
+    fig.savefig(tmp_path)
+    os.replace(tmp_path, img_path)
+    prune_popularity_charts()
 
     return img_path, popularity_df
 
-def render_popularity_page():
-    img_path, popularity_df = generate_popularity_graph()
+@read_replica
+def build_popularity_page_data():
+    # Calcula la tabla de productos y el gráfico para la versión actual de los datos.
+    version = get_popularity_version()
+    popularity_df = get_popularity_matrix()
+    img_path, popularity_df = generate_popularity_graph(popularity_df, version)
+
+    # Detalles de todos los productos en una sola consulta
+    product_ids = [int(product_id) for product_id in popularity_df['product_id']]
+    products = MarketechProduct.query.filter(MarketechProduct.id.in_(product_ids)).all() if product_ids else []
+    products_by_id = {product.id: product for product in products}
 
     product_details = []
-    for product_id in popularity_df['product_id']:
-        product = MarketechProduct.query.filter_by(id=product_id).first()
+    for product_id, popularity in zip(product_ids, popularity_df['popularity']):
+        product = products_by_id.get(product_id)
         if product:
-            product_data = {
+            product_details.append({
                 "id": product.id,
                 "name": product.product_name,
                 "description": product.product_description,
                 "price": product.product_price,
-                "popularity": popularity_df[popularity_df['product_id'] == product_id]['popularity'].values[0]
-            }
-            product_details.append(product_data)
+                "popularity": int(popularity)
+            })
 
-    return render_template("popularity.html", products=product_details, img_path=img_path)
\ No newline at end of file
+    return {"version": version, "products": product_details, "img_path": img_path, "img_filename": chart_filename(version)}
+
+def _refresh_in_background(app):
+    global _page_cache, _refresh_thread
+
+    try:
+        with app.app_context():
+            page_data = build_popularity_page_data()
+        with _cache_lock:
+            _page_cache = page_data
+    finally:
+        _refresh_thread = None
+
+def get_popularity_page_data():
+    # Devuelve los datos cacheados de la página. Solo la primera vez se calculan
+    # en la petición; luego, si cambia la versión, se regeneran en segundo plano.
+    global _page_cache, _refresh_thread, _last_check
+
+    if _page_cache is None:
+        with _cache_lock:
+            if _page_cache is None:
+                _page_cache = build_popularity_page_data()
+                _last_check = time.monotonic()
+        return _page_cache
+
+    now = time.monotonic()
+    if now - _last_check >= POPULARITY_CHECK_INTERVAL:
+        _last_check = now
+        if get_popularity_version() != _page_cache["version"]:
+            with _cache_lock:
+                if _refresh_thread is None:
+                    app = current_app._get_current_object()
+                    _refresh_thread = threading.Thread(target=_refresh_in_background, args=(app,), daemon=True)
+                    _refresh_thread.start()
+
+    return _page_cache
+
+def render_popularity_page():
+    page_data = get_popularity_page_data()
+    return render_template(
+        "popularity.html",
+        products=page_data["products"],
+        img_path=page_data["img_path"],
+        img_filename=page_data["img_filename"],
+    )
@@ -1,25 +1,54 @@
 from models.models import MarketechProductVisited, MarketechProduct
-from database.database import db
+from models.serializers import get_products_by_ids
+from database.database import db, read_replica
+from services.metrics import timed
+from datetime import datetime, timedelta
 import pandas as pd
 
-def get_popularity_matrix():
-    visits_data = db.session.query(MarketechProductVisited.product_id, MarketechProductVisited.user_id).all()
+# Ventanas de tiempo admitidas para calcular la popularidad
+POPULARITY_WINDOWS = {
+    '24h': timedelta(hours=24),
+    '7d': timedelta(days=7),
+    '30d': timedelta(days=30),
+}
 
-    visits_df = pd.DataFrame(visits_data, columns=["product_id", "user_id"])
+@timed("popularity")
+@read_replica
+def get_popularity_matrix(limit=None, window=None, category=None, subcategory=None):
+    # Cuenta las visitas por producto en la base de datos (GROUP BY ... ORDER BY ... LIMIT)
+    # en lugar de traer todas las visitas a memoria. Opcionalmente se limita a una
+    # ventana de tiempo ('24h', '7d', '30d') y a una categoría o subcategoría.
+    if window is not None and window not in POPULARITY_WINDOWS:
+        raise ValueError(f"Ventana de popularidad no válida: {window}")
 
-    popularity_df = visits_df.groupby('product_id').size().reset_index(name='popularity')
+    popularity = db.func.count(MarketechProductVisited.id).label('popularity')
+    query = db.session.query(MarketechProductVisited.product_id, popularity)
 
-    popularity_df = popularity_df.sort_values(by='popularity', ascending=False)
+    if window is not None:
+        since = datetime.utcnow() - POPULARITY_WINDOWS[window]
+        query = query.filter(MarketechProductVisited.visited_at >= since)
 
-    return popularity_df
+    if category or subcategory:
+        query = query.join(MarketechProduct, MarketechProduct.id == MarketechProductVisited.product_id)
+        if category:
+            query = query.filter(MarketechProduct.category == category)
+        if subcategory:
+            query = query.filter(MarketechProduct.subcategory == subcategory)
 
+    query = query.group_by(MarketechProductVisited.product_id).order_by(
+        popularity.desc(), MarketechProductVisited.product_id
+    )
+    if limit is not None:
+        query = query.limit(limit)
+
+    return pd.DataFrame(query.all(), columns=['product_id', 'popularity'])
+
+@read_replica
 def get_recommendations_html_popularity():
-    popularity_df = get_popularity_matrix()
+    popularity_df = get_popularity_matrix(limit=8)
 
-    recommended_products = []
-    for product_id in popularity_df['product_id'].head(8):
-        product = MarketechProduct.query.filter_by(id=product_id).first()
-        recommended_products.append(product.to_dict())
+    # Una sola consulta para los 8 productos, en orden de popularidad
+    recommended_products = get_products_by_ids([int(product_id) for product_id in popularity_df['product_id']])
 
     recommendations_html = "<h3>Top 8 Most Popular Products</h3>"
     for product in recommended_products:
@@ -34,9 +63,7 @@ def get_recommendations_html_popularity():
 
     return recommendations_html
 
-def get_recommended_product_ids_popularity():
-    popularity_df = get_popularity_matrix()
-
-    top_products = popularity_df.head(8)
+def get_recommended_product_ids_popularity(limit=8, window=None, category=None, subcategory=None):
+    popularity_df = get_popularity_matrix(limit=limit, window=window, category=category, subcategory=subcategory)
 
-    return top_products['product_id'].tolist()
\ No newline at end of file
+    return [int(product_id) for product_id in popularity_df['product_id']]
@@ -1,126 +1,172 @@
-from models.models import MarketechProduct, MarketechProductVisited
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import linear_kernel
+from concurrent.futures import ThreadPoolExecutor
+from services.catalog_index import get_catalog_index
+from services.hybrid_scorer import get_popularity_scores, score_candidates, top_rows, SCORE_WEIGHTS
+from services.covisitation import get_covisitation_index
+from services.search_intent import get_search_matches
+from services.metrics import span
+from models.models import MarketechProductVisited
+from database.database import db, read_replica
 from datetime import datetime
 import pandas as pd
+import numpy as np
+import os
+
+# Lotes a partir de este tamaño se reparten entre varios hilos
+BATCH_POOL_THRESHOLD = int(os.getenv("RECOMMENDATION_BATCH_POOL_THRESHOLD", "200"))
+BATCH_WORKERS = int(os.getenv("RECOMMENDATION_BATCH_WORKERS", "4"))
 
 def apply_temporal_weighting(user_visited_df):
-    # Aplica un factor de ponderación temporal para los productos visitados.
+    # Aplica un factor de ponderación temporal para los productos visitados,
+    # relativo a la visita más antigua de cada usuario.
     current_time = datetime.utcnow()
     user_visited_df['visited_at'] = pd.to_datetime(user_visited_df['visited_at'], errors='coerce')
     user_visited_df = user_visited_df.dropna(subset=['visited_at'])
 
     user_visited_df['time_diff'] = (current_time - user_visited_df['visited_at']).dt.total_seconds()
-    max_time_diff = user_visited_df['time_diff'].max()
-    if max_time_diff > 0:
-        user_visited_df['weight'] = 1 - (user_visited_df['time_diff'] / max_time_diff)
-    else:
-        user_visited_df['weight'] = 1.0
+    max_time_diff = user_visited_df.groupby('user_id')['time_diff'].transform('max')
+    user_visited_df['weight'] = np.where(max_time_diff > 0, 1 - (user_visited_df['time_diff'] / max_time_diff), 1.0)
 
     return user_visited_df
 
-def get_user_recent_visited_products(user_id, max_records=16):
-    # Obtiene los productos visitados por un usuario ordenados por fecha de visita,
-    # limitando el número de registros a un máximo.
+@read_replica
+def get_users_recent_visited_products(user_ids, max_records=16):
+    # Obtiene en una sola consulta los últimos `max_records` productos visitados
+    # por cada usuario, ordenados por fecha de visita.
+    position = db.func.row_number().over(
+        partition_by=MarketechProductVisited.user_id,
+        order_by=MarketechProductVisited.visited_at.desc(),
+    ).label('position')
+    ranked = (
+        db.session.query(
+            MarketechProductVisited.user_id,
+            MarketechProductVisited.product_id,
+            MarketechProductVisited.visited_at,
+            position,
+        )
+        .filter(MarketechProductVisited.user_id.in_(user_ids))
+        .subquery()
+    )
     visited_records = (
-        MarketechProductVisited.query.filter_by(user_id=user_id)
-        .order_by(MarketechProductVisited.visited_at.desc())
-        .limit(max_records)
+        db.session.query(ranked.c.user_id, ranked.c.product_id, ranked.c.visited_at)
+        .filter(ranked.c.position <= max_records)
+        .order_by(ranked.c.user_id, ranked.c.position)
         .all()
     )
-    
-    visited_products = [
-        {
-            "id": record.product_id,
-            "visited_at": record.visited_at,
-            "product_name": record.product.product_name,
-            "product_description": record.product.product_description,
-            "category": record.product.category,
-            "subcategory": record.product.subcategory,
-            "product_mark": record.product.product_mark,
-            "product_model": record.product.product_model,
-        }
-        for record in visited_records
-    ]
-    return pd.DataFrame(visited_products)
-
-def get_all_products():
-    # Obtiene todos los productos en la base de datos.
-    all_products = MarketechProduct.query.all()
-    if not all_products:
-        return pd.DataFrame()
-    
-    product_list = [product.to_dict() for product in all_products if product]
-    return pd.DataFrame(product_list)
+    return pd.DataFrame(visited_records, columns=['user_id', 'id', 'visited_at'])
+
+def get_user_recent_visited_products(user_id, max_records=16):
+    # Obtiene los productos visitados por un usuario ordenados por fecha de visita,
+    # limitando el número de registros a un máximo.
+    return get_users_recent_visited_products([user_id], max_records=max_records)
+
+def get_focus_visits(user_ids, max_records=16, focus_records=6):
+    # Visitas recientes ponderadas de varios usuarios, limitadas a los
+    # `focus_records` productos con mayor peso de cada uno.
+    visited_df = get_users_recent_visited_products(user_ids, max_records=max_records)
+    if visited_df.empty:
+        return visited_df
+
+    visited_df = apply_temporal_weighting(visited_df)
+    visited_df = visited_df.sort_values(['user_id', 'weight'], ascending=[True, False], kind='stable')
+    return visited_df.groupby('user_id', sort=False).head(focus_records)
+
+def rank_recommended_rows(index, visited_rows, visit_weights, popularity_scores, max_records=16, covisitation=None, search=None):
+    # Puntúa los vecinos de los productos visitados y los productos de sus
+    # búsquedas (contenido, categoría, popularidad, novedad, co-visitas y
+    # búsquedas; ver services/hybrid_scorer.py) y devuelve las `max_records`
+    # mejores filas del índice.
+    candidates, scores = score_candidates(index, visited_rows, visit_weights, popularity_scores,
+                                          covisitation=covisitation, search=search)
+    return top_rows(candidates, scores, max_records)
+
+def get_scoring_covisitation():
+    # Índice de co-visitas solo si la señal está activada (peso > 0)
+    return get_covisitation_index() if SCORE_WEIGHTS["covisitation"] > 0 else None
 
 def generate_recommendations(user_id, max_records=16, focus_records=6):
     # Genera una lista ordenada de productos recomendados para el usuario.
     # Se enfoca en los últimos `focus_records` productos visitados para mayor precisión.
-    # Obtener productos visitados recientemente
-    user_visited_df = get_user_recent_visited_products(user_id, max_records=max_records)
-    if user_visited_df.empty:
-        return []
-
-    # Aplicar ponderación temporal
-    user_visited_df = apply_temporal_weighting(user_visited_df)
+    with span("visits"):
+        user_visited_df = get_focus_visits([user_id], max_records=max_records, focus_records=focus_records)
 
-    # Filtrar los `focus_records` productos con mayor peso
-    user_visited_df = user_visited_df.nlargest(focus_records, 'weight')
-
-    # Obtener todos los productos
-    all_products_df = get_all_products()
-    if all_products_df.empty:
+    # Índice TF-IDF del catálogo compartido entre peticiones
+    with span("catalog_index"):
+        index = get_catalog_index()
+    if index is None:
         return []
 
-    # Combinar características relevantes
-    all_products_df['combined_features'] = (
-        all_products_df['product_mark'].fillna('') + " " +
-        all_products_df['category'].fillna('') + " " +
-        all_products_df['subcategory'].fillna('') + " " +
-        all_products_df['product_model'].fillna('') + " " +
-        all_products_df['product_description'].fillna('')
-    )
-
-    # Vectorización usando TF-IDF
-    tfidf = TfidfVectorizer(stop_words='english')
-    tfidf_matrix = tfidf.fit_transform(all_products_df['combined_features'])
-
-    # Calculamos similitud coseno
-    cosine_similarities = linear_kernel(tfidf_matrix, tfidf_matrix)
-    indices = pd.Series(all_products_df.index, index=all_products_df['id']).drop_duplicates()
-
-    recommendations = pd.DataFrame()
-    for _, row in user_visited_df.iterrows():
-        product_id = row['id']
-        weight = row['weight']
-
-        if product_id in indices:
-            idx = indices[product_id]
-            sim_scores = list(enumerate(cosine_similarities[idx] * weight))
-            sim_scores = sorted(sim_scores, key=lambda x: x[1], reverse=True)
-
-            # Obtener hasta 5 productos similares por cada producto visitado
-            product_indices = [i[0] for i in sim_scores[1:6]]
-            recommendations = pd.concat([recommendations, all_products_df.iloc[product_indices]])
-
-    # Filtro: Eliminar productos ya visitados
-    recommendations = recommendations.drop_duplicates(subset='id')
-    recommendations = recommendations[~recommendations['id'].isin(user_visited_df['id'])]
-
-    # Priorizar productos de categorías similares
-    if not recommendations.empty:
-        visited_categories = user_visited_df['category'].dropna().unique()
-        recommendations['category_match'] = recommendations['category'].apply(
-            lambda x: x in visited_categories
-        )
-        recommendations = recommendations.sort_values(by=['category_match', 'created_at'], ascending=[False, False])
-
-    # Limitar recomendaciones
-    return recommendations.head(max_records).to_dict(orient='records')
+    # Las búsquedas recientes aportan candidatos aunque el usuario no tenga visitas
+    search = get_search_matches(index, [user_id]).get(user_id)
+    visited_rows = np.array([index.row_of.get(int(product_id), -1) for product_id in user_visited_df['id']], dtype=np.int64)
+    visit_weights = user_visited_df['weight'].to_numpy() if not user_visited_df.empty else np.empty(0)
+    known = visited_rows >= 0
+    if not known.any() and search is None:
+        return []
 
-def get_recommendations_html(user_id):
-    # Genera una página HTML con recomendaciones para el usuario.
-    recommendations = generate_recommendations(user_id)
+    popularity_scores = get_popularity_scores(index)
+    covisitation = get_scoring_covisitation()
+    with span("similarity"):
+        rows = rank_recommended_rows(index, visited_rows[known], visit_weights[known],
+                                     popularity_scores, max_records, covisitation, search)
+        return index.products.iloc[rows].to_dict(orient='records')
+
+def _rank_users(index, visited_rows, visit_weights, popularity_scores, covisitation, searches, user_slices, max_records):
+    recommendations = {}
+    for user_id, start, end in user_slices:
+        rows = rank_recommended_rows(index, visited_rows[start:end], visit_weights[start:end], popularity_scores,
+                                     max_records, covisitation, searches.get(user_id))
+        recommendations[int(user_id)] = [int(product_id) for product_id in index.ids[rows]]
+    return recommendations
+
+def generate_batch_recommendation_ids(user_ids, max_records=16, focus_records=6):
+    # Genera las IDs recomendadas para muchos usuarios a la vez: una sola
+    # consulta de visitas y una sola búsqueda de vecinos para todo el lote.
+    recommendations = {user_id: [] for user_id in user_ids}
+    with span("visits"):
+        visited_df = get_focus_visits(user_ids, max_records=max_records, focus_records=focus_records)
+    with span("catalog_index"):
+        index = get_catalog_index()
+    if index is None:
+        return recommendations
+
+    searches = get_search_matches(index, user_ids)
+    if not visited_df.empty:
+        visited_df = visited_df[visited_df['id'].isin(list(index.row_of))]
+    if visited_df.empty and not searches:
+        return recommendations
+    visited_rows = visited_df['id'].map(index.row_of).to_numpy(dtype=np.int64)
+    visit_weights = visited_df['weight'].to_numpy(dtype=np.float32) if not visited_df.empty else np.empty(0, dtype=np.float32)
+    popularity_scores = get_popularity_scores(index)
+    covisitation = get_scoring_covisitation()
+
+    # Rango de filas de cada usuario dentro del lote (las visitas vienen agrupadas
+    # por usuario); los que solo tienen búsquedas reciben un rango vacío.
+    visit_users = visited_df['user_id'].to_numpy(dtype=np.int64)
+    bounds = np.concatenate(([0], np.flatnonzero(visit_users[1:] != visit_users[:-1]) + 1, [len(visit_users)]))
+    user_slices = [(int(visit_users[start]), start, end) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+    with_visits = {user_id for user_id, _, _ in user_slices}
+    user_slices += [(user_id, 0, 0) for user_id in searches if user_id not in with_visits]
+
+    with span("similarity"):
+        if len(user_slices) < BATCH_POOL_THRESHOLD:
+            recommendations.update(_rank_users(index, visited_rows, visit_weights, popularity_scores, covisitation, searches, user_slices, max_records))
+            return recommendations
+
+        chunk_size = -(-len(user_slices) // BATCH_WORKERS)
+        chunks = [user_slices[i:i + chunk_size] for i in range(0, len(user_slices), chunk_size)]
+        with ThreadPoolExecutor(max_workers=BATCH_WORKERS) as pool:
+            ranked = pool.map(
+                lambda chunk: _rank_users(index, visited_rows, visit_weights, popularity_scores, covisitation, searches, chunk, max_records), chunks
+            )
+            for partial in ranked:
+                recommendations.update(partial)
+        return recommendations
+
+def get_recommendations_html(user_id, recommendations=None):
+    # Genera una página HTML con recomendaciones para el usuario (calculadas
+    # aquí si no se pasan ya como diccionarios de productos).
+    if recommendations is None:
+        recommendations = generate_recommendations(user_id)
 
     if not recommendations:
         return "<h3>No se encontraron recomendaciones.</h3>"
@@ -143,4 +189,4 @@ def get_recommendations_html(user_id):
 def get_recommended_product_ids(user_id, max_records=16):
     #Retorna las IDs de los productos recomendados para el usuario en el mismo orden que las recomendaciones HTML.
     recommendations = generate_recommendations(user_id, max_records)
-    return [product['id'] for product in recommendations]
\ No newline at end of file
+    return [product['id'] for product in recommendations]
@@ -0,0 +1,361 @@
+from models.models import MarketechUserRecommendation, MarketechProductVisited, MarketechSearchHistory
+from services.recommendation_model import generate_batch_recommendation_ids
+from concurrent.futures import ProcessPoolExecutor
+from services.catalog_index import get_catalog_index
+from services.hybrid_scorer import config_version
+from services.search_intent import search_version, load_chat_resources
+from database.database import db, read_replica
+from datetime import datetime, timedelta
+from sqlalchemy import exc, inspect, literal
+from services.metrics import span
+import multiprocessing
+import threading
+import argparse
+import logging
+import json
+import time
+import sys
+import os
+
+# Recomendaciones materializadas por usuario (tabla marketech_user_recommendations).
+#
+# Cada fila guarda los ids recomendados, la versión del índice con que se
+# calcularon (content_version del catálogo, la configuración del puntaje y la
+# de las búsquedas), la actividad del usuario que se leyó (número y mayor id
+# de sus visitas y búsquedas) y cuándo empezó el cálculo. La fila sirve
+# mientras la versión y la actividad coincidan con las actuales y no supere
+# RECOMMENDATION_STORE_MAX_AGE. Como la actividad se compara en cada lectura,
+# las visitas que registren otros servicios también invalidan la fila. Si no
+# sirve, la ruta calcula en vivo y guarda el resultado (write-through).
+#
+# La actividad actual se lee del primario; la del cálculo, de la réplica y
+# antes de leer las visitas, así que una réplica retrasada guarda una
+# actividad antigua y la fila no se da por vigente hasta que se pone al día.
+#
+# La tabla se crea al arrancar la aplicación (ensure_table) o con
+# `--create-table`; si no existe, las recomendaciones se calculan en vivo.
+#
+# El trabajo por lotes recalcula las filas pendientes de los usuarios activos
+# con un pool de procesos:
+#
+#   python -m services.recommendation_store --active-days 30 --workers 4
+#   python -m services.recommendation_store --watch 60   # cada 60 s
+
+RECOMMENDATION_STORE_ENABLED = os.getenv("RECOMMENDATION_STORE_ENABLED", "1") == "1"
+RECOMMENDATION_STORE_MAX_AGE = timedelta(hours=float(os.getenv("RECOMMENDATION_STORE_MAX_AGE_HOURS", "24")))
+RECOMMENDATION_STORE_WRITE_THROUGH = os.getenv("RECOMMENDATION_STORE_WRITE_THROUGH", "1") == "1"
+RECOMMENDATION_STORE_CREATE_TABLE = os.getenv("RECOMMENDATION_STORE_CREATE_TABLE", "1") == "1"
+REFRESH_CHUNK_SIZE = int(os.getenv("RECOMMENDATION_REFRESH_CHUNK_SIZE", "500"))
+# Segundos entre comprobaciones de la tabla mientras no exista
+TABLE_CHECK_INTERVAL = 60
+
+table = MarketechUserRecommendation.__table__
+
+# Peticiones servidas desde la tabla y calculadas en vivo (faltantes u obsoletas)
+stats = {"stored": 0, "live": 0, "write_errors": 0, "read_errors": 0}
+_stats_lock = threading.Lock()
+
+_table_exists = None
+_table_checked_at = 0.0
+
+logger = logging.getLogger(__name__)
+
+
+def _count(key, amount=1):
+    with _stats_lock:
+        stats[key] += amount
+
+
+def store_version(index):
+    return f"{index.content_version}-{config_version()}-{search_version()}"
+
+
+def ensure_table():
+    # Crea la tabla si no existe (paso DDL del despliegue); devuelve si está disponible.
+    global _table_exists, _table_checked_at
+
+    try:
+        table.create(db.engine, checkfirst=True)
+        _table_exists = True
+    except exc.SQLAlchemyError:
+        # Otro worker la creó a la vez, el usuario no tiene permisos de DDL o
+        # la base de datos no responde: se comprobará en la primera petición.
+        logger.warning("No se pudo crear %s", table.name, exc_info=True)
+        _table_exists = None
+    _table_checked_at = time.monotonic()
+    return bool(_table_exists)
+
+
+def table_available():
+    # Si la tabla no existe se vuelve a comprobar cada TABLE_CHECK_INTERVAL segundos.
+    global _table_exists, _table_checked_at
+
+    if _table_exists is None or (not _table_exists and time.monotonic() - _table_checked_at >= TABLE_CHECK_INTERVAL):
+        _table_exists = inspect(db.engine).has_table(table.name)
+        _table_checked_at = time.monotonic()
+    return _table_exists
+
+
+def _mark_table_missing():
+    global _table_exists, _table_checked_at
+
+    _table_exists = False
+    _table_checked_at = time.monotonic()
+
+
+def activity_version(visit_count=0, last_visit_id=0, search_count=0, last_search_id=0):
+    # Cambia con cualquier visita o búsqueda nueva (o borrada) del usuario,
+    # aunque lleguen con ids fuera de orden.
+    return f"v{visit_count}.{last_visit_id}-s{search_count}.{last_search_id}"
+
+
+def load_activity(user_ids):
+    # {user_id: activity_version} con una sola consulta; los usuarios sin
+    # actividad no aparecen (equivalen a activity_version()).
+    visits = (
+        db.session.query(MarketechProductVisited.user_id, literal("v").label("kind"),
+                         db.func.count(MarketechProductVisited.id), db.func.max(MarketechProductVisited.id))
+        .filter(MarketechProductVisited.user_id.in_(user_ids))
+        .group_by(MarketechProductVisited.user_id)
+    )
+    searches = (
+        db.session.query(MarketechSearchHistory.user_id, literal("s").label("kind"),
+                         db.func.count(MarketechSearchHistory.id), db.func.max(MarketechSearchHistory.id))
+        .filter(MarketechSearchHistory.user_id.in_(user_ids))
+        .group_by(MarketechSearchHistory.user_id)
+    )
+    counts = {}
+    for user_id, kind, count, last_id in visits.union_all(searches).all():
+        prefix = "visit" if kind == "v" else "search"
+        counts.setdefault(user_id, {})[f"{prefix}_count"] = count
+        counts[user_id][f"last_{prefix}_id"] = last_id
+    return {user_id: activity_version(**values) for user_id, values in counts.items()}
+
+
+@read_replica
+def load_replica_activity(user_ids):
+    # Actividad vista por el cálculo: se lee antes que las visitas y de la misma réplica.
+    return load_activity(user_ids)
+
+
+def is_fresh(row, version, activity, now=None):
+    now = now or datetime.utcnow()
+    return (
+        row.version == version
+        and row.activity == activity
+        and row.computed_at >= now - RECOMMENDATION_STORE_MAX_AGE
+    )
+
+
+def load_stored(user_ids):
+    # Filas guardadas de varios usuarios con una consulta IN (en el primario).
+    rows = db.session.query(table).filter(table.c.user_id.in_(user_ids)).all()
+    return {row.user_id: row for row in rows}
+
+
+def _upsert(rows):
+    # INSERT ... ON DUPLICATE KEY UPDATE (MySQL) u ON CONFLICT (SQLite).
+    columns = ("product_ids", "version", "activity", "computed_at")
+    dialect = db.session.get_bind(clause=table).dialect.name
+    if dialect == "mysql":
+        from sqlalchemy.dialects.mysql import insert
+        statement = insert(table).values(rows)
+        updates = {column: statement.inserted[column] for column in columns}
+        return statement.on_duplicate_key_update(**updates)
+
+    from sqlalchemy.dialects.sqlite import insert
+    statement = insert(table).values(rows)
+    updates = {column: statement.excluded[column] for column in columns}
+    return statement.on_conflict_do_update(index_elements=[table.c.user_id], set_=updates)
+
+
+def save(recommendations, version, computed_at, activity):
+    # Guarda {user_id: [product_id, ...]} calculadas a partir de `computed_at`
+    # con la actividad {user_id: activity_version} leída antes del cálculo.
+    rows = [
+        {"user_id": int(user_id), "product_ids": json.dumps(product_ids), "version": version,
+         "activity": activity.get(user_id, activity_version()), "computed_at": computed_at}
+        for user_id, product_ids in recommendations.items()
+    ]
+    for start in range(0, len(rows), REFRESH_CHUNK_SIZE):
+        db.session.execute(_upsert(rows[start:start + REFRESH_CHUNK_SIZE]))
+    db.session.commit()
+
+
+def compute(user_ids):
+    # (actividad, recomendaciones) de `user_ids`, leyendo la actividad primero.
+    activity = load_replica_activity(user_ids)
+    return activity, generate_batch_recommendation_ids(user_ids)
+
+
+def get_batch_recommended_product_ids(user_ids):
+    # {user_id: [product_id, ...]} desde la tabla; los usuarios sin fila válida
+    # se calculan juntos en vivo y se guardan.
+    index = get_catalog_index()
+    if index is None:
+        return {user_id: [] for user_id in user_ids}
+    if not RECOMMENDATION_STORE_ENABLED or not table_available():
+        return generate_batch_recommendation_ids(user_ids)
+
+    started_at = datetime.utcnow()
+    try:
+        with span("recommendation_store"):
+            stored = load_stored(user_ids)
+            activity = load_activity(user_ids) if stored else {}
+    except (exc.ProgrammingError, exc.OperationalError):
+        # La tabla se borró o no es accesible: se calcula en vivo y se vuelve a comprobar más tarde
+        db.session.rollback()
+        _mark_table_missing()
+        _count("read_errors")
+        return generate_batch_recommendation_ids(user_ids)
+
+    version = store_version(index)
+    recommendations, pending = {}, []
+    for user_id in user_ids:
+        row = stored.get(user_id)
+        if row is not None and is_fresh(row, version, activity.get(user_id, activity_version()), started_at):
+            recommendations[user_id] = json.loads(row.product_ids)
+        else:
+            pending.append(user_id)
+    _count("stored", len(recommendations))
+
+    if pending:
+        _count("live", len(pending))
+        computed_activity, computed = compute(pending)
+        recommendations.update(computed)
+        if RECOMMENDATION_STORE_WRITE_THROUGH:
+            try:
+                save(computed, version, started_at, computed_activity)
+            except Exception:
+                # La respuesta no depende de poder guardar (p. ej. réplica de solo lectura)
+                db.session.rollback()
+                _count("write_errors")
+    return {user_id: recommendations[user_id] for user_id in user_ids}
+
+
+def get_recommended_product_ids(user_id):
+    return get_batch_recommended_product_ids([user_id])[user_id]
+
+
+def get_store_stats():
+    with _stats_lock:
+        return dict(stats)
+
+
+@read_replica
+def get_active_user_ids(active_days):
+    since = datetime.utcnow() - timedelta(days=active_days)
+    rows = (
+        db.session.query(MarketechProductVisited.user_id)
+        .filter(MarketechProductVisited.visited_at >= since)
+        .distinct()
+        .all()
+    )
+    return sorted(row.user_id for row in rows)
+
+
+def select_users_to_refresh(user_ids, version):
+    # Usuarios sin fila válida para la versión del índice y su actividad actual.
+    now = datetime.utcnow()
+    pending = []
+    for start in range(0, len(user_ids), REFRESH_CHUNK_SIZE):
+        chunk = user_ids[start:start + REFRESH_CHUNK_SIZE]
+        stored = load_stored(chunk)
+        activity = load_activity(chunk)
+        pending.extend(
+            user_id for user_id in chunk
+            if user_id not in stored or not is_fresh(stored[user_id], version, activity.get(user_id, activity_version()), now)
+        )
+    return pending
+
+
+_worker_app = None
+
+
+def _init_worker(search=False):
+    # Cada proceso tiene su propia aplicación, conexiones e índice del catálogo
+    # (la tabla de vecinos se lee del archivo guardado si está al día). Los
+    # recursos del chatbot solo se cargan si el proceso padre usa la señal de búsquedas.
+    global _worker_app
+    from flask import Flask
+    from database.database import init_app
+
+    _worker_app = Flask(__name__)
+    init_app(_worker_app)
+    _worker_app.app_context().push()
+    get_catalog_index()
+    if search:
+        load_chat_resources()
+
+
+def _compute_chunk(user_ids):
+    started_at = datetime.utcnow()
+    version = store_version(get_catalog_index())
+    return (version, started_at) + compute(user_ids)
+
+
+def refresh(user_ids, workers=4, search=False):
+    # Recalcula y guarda las recomendaciones de `user_ids`; devuelve cuántas se guardaron.
+    if not user_ids:
+        return 0
+    chunks = [user_ids[i:i + REFRESH_CHUNK_SIZE] for i in range(0, len(user_ids), REFRESH_CHUNK_SIZE)]
+    saved = 0
+    if workers <= 1:
+        for chunk in chunks:
+            version, started_at, activity, recommendations = _compute_chunk(chunk)
+            save(recommendations, version, started_at, activity)
+            saved += len(recommendations)
+        return saved
+
+    # spawn: los procesos no heredan las conexiones abiertas del proceso padre
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker, initargs=(search,)) as pool:
+        for version, started_at, activity, recommendations in pool.map(_compute_chunk, chunks):
+            save(recommendations, version, started_at, activity)
+            saved += len(recommendations)
+    return saved
+
+
+def run_refresh(active_days, workers, refresh_all=False, search=False):
+    index = get_catalog_index()
+    if index is None:
+        print("El catálogo está vacío; no hay nada que recalcular.")
+        return
+    user_ids = get_active_user_ids(active_days)
+    pending = user_ids if refresh_all else select_users_to_refresh(user_ids, store_version(index))
+    start = time.perf_counter()
+    saved = refresh(pending, workers=workers, search=search)
+    print(f"{saved} de {len(user_ids)} usuarios activos recalculados en {time.perf_counter() - start:.1f} s")
+
+
+def main():
+    from flask import Flask
+    from database.database import init_app
+
+    parser = argparse.ArgumentParser(description="Recalcula las recomendaciones materializadas por usuario.")
+    parser.add_argument("--active-days", type=int, default=30, help="Usuarios con visitas en los últimos N días")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--all", action="store_true", help="Recalcular también las filas vigentes")
+    parser.add_argument("--watch", type=float, help="Repetir cada N segundos")
+    parser.add_argument("--create-table", action="store_true", help="Solo crear la tabla y salir")
+    parser.add_argument("--no-search", action="store_true",
+                        help="No cargar el modelo del chatbot; sin la señal de búsquedas las filas "
+                             "no coinciden con la versión de un servidor que sí la usa")
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    init_app(app)
+    with app.app_context():
+        table.create(db.engine, checkfirst=True)
+        if args.create_table:
+            return
+        search = not args.no_search and load_chat_resources()
+        while True:
+            run_refresh(args.active_days, args.workers, refresh_all=args.all, search=search)
+            if not args.watch:
+                break
+            time.sleep(args.watch)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,174 @@
+from models.models import MarketechUser, MarketechProduct
+from flask import Response, current_app, request
+from services.cache import TTLCache
+from sqlalchemy.orm import Session, object_session
+from sqlalchemy import event
+import threading
+import hashlib
+import json
+import time
+import os
+
+# Caché de respuestas JSON de lecturas por id (/product/<id>, /user/<id>).
+#
+# Se guarda el cuerpo ya serializado junto con su ETag (hash del contenido:
+# las tablas no tienen columna de versión y created_at no cambia al editar).
+# Con If-None-Match se responde 304 sin cuerpo. Por defecto la caché es un LRU
+# en memoria por proceso; con RESPONSE_CACHE_URL=redis://... se comparte entre
+# workers (requiere el paquete `redis`).
+#
+# Las escrituras por el ORM invalidan la entrada después del commit (no en el
+# flush: una lectura entre el flush y el commit volvería a guardar la fila
+# anterior). Con el LRU en memoria solo se invalida la caché del worker que
+# hizo la escritura; los demás sirven la respuesta anterior hasta que expire
+# el TTL, igual que con lo que cambie por fuera de esta aplicación. Para
+# invalidar en todos los workers hay que usar RESPONSE_CACHE_URL.
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "10000"))
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "300"))
+RESPONSE_CACHE_URL = os.getenv("RESPONSE_CACHE_URL")
+
+
+class RedisCache:
+    # Misma interfaz que TTLCache sobre Redis; los valores se guardan como JSON.
+    def __init__(self, url, ttl=3600, prefix="marketech:response:"):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        raw = self.client.get(self.prefix + key)
+        if raw is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return json.loads(raw)
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        self.client.set(self.prefix + key, json.dumps(value), ex=ttl or None)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def clear(self):
+        for key in self.client.scan_iter(f"{self.prefix}*"):
+            self.client.delete(key)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def create_backend():
+    if RESPONSE_CACHE_URL:
+        return RedisCache(RESPONSE_CACHE_URL, ttl=RESPONSE_CACHE_TTL)
+    return TTLCache(maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL)
+
+
+response_cache = create_backend()
+
+# Latencia por tipo de recurso y resultado: [peticiones, ms totales, ms máximo]
+_latency = {}
+_latency_lock = threading.Lock()
+
+
+def _record_latency(kind, outcome, elapsed_ms):
+    with _latency_lock:
+        entry = _latency.setdefault((kind, outcome), [0, 0.0, 0.0])
+        entry[0] += 1
+        entry[1] += elapsed_ms
+        entry[2] = max(entry[2], elapsed_ms)
+
+
+def make_etag(body):
+    return hashlib.sha1(body.encode("utf-8")).hexdigest()
+
+
+def cached_json_response(kind, object_id, load):
+    # Respuesta JSON de `load()` (dict o None) usando la caché; devuelve None
+    # si el objeto no existe para que la ruta responda su propio 404.
+    start = time.perf_counter()
+    key = f"{kind}:{object_id}"
+    entry = response_cache.get(key)
+    outcome = "hit"
+
+    if entry is None:
+        outcome = "miss"
+        payload = load()
+        if payload is None:
+            _record_latency(kind, "not_found", (time.perf_counter() - start) * 1000)
+            return None
+        body = current_app.json.dumps(payload)
+        entry = {"body": body, "etag": make_etag(body)}
+        response_cache.set(key, entry)
+
+    response = Response(entry["body"], mimetype="application/json")
+    response.set_etag(entry["etag"])
+    # El cliente puede guardar la respuesta pero debe revalidarla con el ETag
+    response.cache_control.no_cache = True
+    response.make_conditional(request)
+    _record_latency(kind, "not_modified" if response.status_code == 304 else outcome, (time.perf_counter() - start) * 1000)
+    return response
+
+
+def invalidate(kind, object_id):
+    # Descarta la respuesta guardada; llamar tras escribir el objeto por fuera del ORM.
+    response_cache.delete(f"{kind}:{object_id}")
+
+
+def clear_response_cache():
+    response_cache.clear()
+
+
+def response_cache_stats():
+    with _latency_lock:
+        latency = {
+            f"{kind}.{outcome}": {"count": count, "avg": total / count, "max": maximum}
+            for (kind, outcome), (count, total, maximum) in _latency.items()
+        }
+    return {"backend": type(response_cache).__name__, **response_cache.stats(), "latency_ms": latency}
+
+
+# Clave de Session.info con las entradas a invalidar al confirmar la transacción
+PENDING_INVALIDATIONS = "response_cache_invalidations"
+
+
+def _invalidate_after_commit(kind, target):
+    session = object_session(target)
+    if session is None:
+        invalidate(kind, target.id)
+        return
+    session.info.setdefault(PENDING_INVALIDATIONS, set()).add((kind, target.id))
+
+
+@event.listens_for(MarketechProduct, "after_update")
+@event.listens_for(MarketechProduct, "after_delete")
+def _on_product_change(mapper, connection, target):
+    _invalidate_after_commit("product", target)
+
+
+@event.listens_for(MarketechUser, "after_update")
+@event.listens_for(MarketechUser, "after_delete")
+def _on_user_change(mapper, connection, target):
+    _invalidate_after_commit("user", target)
+
+
+@event.listens_for(Session, "after_commit")
+def _on_commit(session):
+    for kind, object_id in session.info.pop(PENDING_INVALIDATIONS, ()):
+        invalidate(kind, object_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _on_rollback(session):
+    session.info.pop(PENDING_INVALIDATIONS, None)
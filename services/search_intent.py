@@ -0,0 +1,156 @@
+from models.models import MarketechSearchHistory
+from services.hybrid_scorer import SCORE_WEIGHTS
+from database.database import db, read_replica
+from datetime import datetime, timedelta
+from services.cache import TTLCache
+from services.metrics import span
+from services import chat_resources
+import pandas as pd
+import numpy as np
+import hashlib
+import logging
+import os
+
+# Señal de búsquedas recientes para las recomendaciones por usuario.
+#
+# Las últimas RECOMMENDATION_SEARCH_TERMS búsquedas de cada usuario (de los
+# últimos RECOMMENDATION_SEARCH_DAYS días) se codifican con el modelo del
+# chatbot, en una sola llamada a `encode` para todos los términos del lote
+# (chat_resources.encode_queries, con su caché de embeddings), y se buscan en
+# el índice vectorial de productos. Los productos encontrados se suman como
+# candidatos del puntaje híbrido con su similitud ponderada por la recencia de
+# la búsqueda. Sirve sobre todo para usuarios con pocas o ninguna visita.
+#
+# Los productos encontrados por término se guardan en `search_cache` hasta que
+# cambia la versión de los vectores. Si los recursos del chatbot no están
+# cargados la señal se omite.
+# Los procesos que no sirven el chatbot (p. ej. los workers del CLI de
+# recommendation_store) los cargan con load_chat_resources().
+
+SEARCH_TERMS = int(os.getenv("RECOMMENDATION_SEARCH_TERMS", "5"))
+SEARCH_DAYS = float(os.getenv("RECOMMENDATION_SEARCH_DAYS", "30"))
+SEARCH_CANDIDATES_PER_TERM = int(os.getenv("RECOMMENDATION_SEARCH_CANDIDATES", "20"))
+
+# Término normalizado -> (ids de producto, similitudes)
+search_cache = TTLCache(
+    maxsize=int(os.getenv("RECOMMENDATION_SEARCH_CACHE_SIZE", "8192")),
+    ttl=int(os.getenv("RECOMMENDATION_SEARCH_CACHE_TTL", "86400")),
+)
+chat_resources.reload_listeners.append(search_cache.clear)
+
+logger = logging.getLogger(__name__)
+
+
+def load_chat_resources():
+    # Carga el modelo y los vectores (sin calentamiento) en procesos que no
+    # sirven el chatbot. Si falla, la señal queda desactivada.
+    if SCORE_WEIGHTS["search"] <= 0:
+        return False
+    try:
+        chat_resources.load_resources(warm=False)
+    except Exception:
+        logger.warning("Señal de búsquedas desactivada: no se pudieron cargar los recursos del chatbot", exc_info=True)
+        return False
+    return is_enabled()
+
+
+def is_enabled():
+    return SCORE_WEIGHTS["search"] > 0 and chat_resources.product_index is not None
+
+
+def search_version():
+    # Forma parte de la versión de las recomendaciones guardadas: cambia con
+    # los parámetros, con la versión de los vectores y si la señal no estaba disponible.
+    config = repr((SEARCH_TERMS, SEARCH_DAYS, SEARCH_CANDIDATES_PER_TERM,
+                   chat_resources.data_version if is_enabled() else None))
+    return hashlib.sha1(config.encode("utf-8")).hexdigest()[:8]
+
+
+@read_replica
+def get_users_recent_search_terms(user_ids, max_terms=SEARCH_TERMS):
+    # Últimas `max_terms` búsquedas de cada usuario en una sola consulta, de la más reciente a la más antigua.
+    since = datetime.utcnow() - timedelta(days=SEARCH_DAYS)
+    position = db.func.row_number().over(
+        partition_by=MarketechSearchHistory.user_id,
+        order_by=MarketechSearchHistory.created_at.desc(),
+    ).label('position')
+    ranked = (
+        db.session.query(MarketechSearchHistory.user_id, MarketechSearchHistory.search_term, position)
+        .filter(MarketechSearchHistory.user_id.in_(user_ids))
+        .filter(MarketechSearchHistory.created_at >= since)
+        .subquery()
+    )
+    rows = (
+        db.session.query(ranked.c.user_id, ranked.c.search_term, ranked.c.position)
+        .filter(ranked.c.position <= max_terms)
+        .order_by(ranked.c.user_id, ranked.c.position)
+        .all()
+    )
+    return pd.DataFrame(rows, columns=['user_id', 'search_term', 'position'])
+
+
+def match_terms(terms):
+    # {término normalizado: (ids de producto, similitudes)}; los que no están en
+    # caché se codifican juntos y se buscan con un solo producto de matrices.
+    # Se codifica el texto original de la primera búsqueda con cada clave.
+    terms_by_key = {}
+    for term in terms:
+        terms_by_key.setdefault(chat_resources.normalize_text(term), term)
+    matches = {}
+    for key in terms_by_key:
+        cached = search_cache.get(key)
+        if cached is not None:
+            matches[key] = cached
+
+    missing = [key for key in terms_by_key if key not in matches and key]
+    if missing:
+        product_index = chat_resources.product_index
+        vectors = chat_resources.encode_queries([terms_by_key[key] for key in missing])
+        with span("search_match"):
+            results = product_index.search_batch(vectors, k=SEARCH_CANDIDATES_PER_TERM)
+        product_ids = np.asarray(product_index.metadata["id"], dtype=np.int64)
+        for key, (rows, similarities) in zip(missing, results):
+            matches[key] = (product_ids[rows], np.clip(similarities, 0, 1))
+            search_cache.set(key, matches[key])
+    return matches
+
+
+def get_search_matches(index, user_ids):
+    # {user_id: (filas del índice del catálogo, puntuación en [0, 1])} de los
+    # usuarios con búsquedas recientes; vacío si la señal está desactivada.
+    if not is_enabled():
+        return {}
+    # Igual que /chat: detecta versiones nuevas de los vectores (la recarga
+    # vacía search_cache a través de reload_listeners)
+    chat_resources.check_for_update()
+    with span("search_history"):
+        terms_df = get_users_recent_search_terms(user_ids)
+    if terms_df.empty:
+        return {}
+
+    matches = match_terms(terms_df['search_term'].tolist())
+    # La búsqueda más reciente pesa 1 y la más antigua 1 / SEARCH_TERMS
+    terms_df['weight'] = (SEARCH_TERMS - terms_df['position'] + 1) / SEARCH_TERMS
+    terms_df['key'] = terms_df['search_term'].map(chat_resources.normalize_text)
+
+    searches = {}
+    for user_id, user_terms in terms_df.groupby('user_id', sort=False):
+        user_terms = user_terms.drop_duplicates('key')
+        product_ids, scores = [], []
+        for key, weight in zip(user_terms['key'], user_terms['weight']):
+            if key in matches:
+                product_ids.append(matches[key][0])
+                scores.append(matches[key][1] * weight)
+        if not product_ids:
+            continue
+        product_ids, scores = np.concatenate(product_ids), np.concatenate(scores)
+        known = product_ids < len(index.row_by_id)
+        rows = index.row_by_id[product_ids[known]]
+        scores = scores[known][rows >= 0]
+        rows = rows[rows >= 0]
+        # Un producto encontrado por varias búsquedas suma sus puntuaciones
+        rows, inverse = np.unique(rows, return_inverse=True)
+        totals = np.bincount(inverse, weights=scores, minlength=rows.size) / user_terms['weight'].sum()
+        if rows.size:
+            searches[int(user_id)] = (rows, totals)
+    return searches
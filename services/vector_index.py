@@ -0,0 +1,159 @@
+from services.vector_store import ColumnarMetadata, dequantize
+import pandas as pd
+import numpy as np
+
+# Índice vectorial para la búsqueda de productos del chatbot: matriz float32
+# normalizada (similitud coseno = producto escalar), selección top-k con
+# argpartition, filtros previos por metadatos y modo aproximado opcional (IVF).
+# También acepta vectores cuantizados (float16, o int8 con escala por fila),
+# que se convierten a float32 por bloques al puntuar.
+
+# Filas por bloque al puntuar vectores cuantizados (acota la memoria temporal)
+SCORE_BLOCK_ROWS = 8192
+
+
+def normalize_rows(vectors):
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def top_k(scores, k):
+    # Índices de las k puntuaciones más altas, ordenados de mayor a menor.
+    k = min(k, scores.shape[0])
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    best = np.argpartition(-scores, k - 1)[:k]
+    return best[np.argsort(-scores[best], kind='stable')]
+
+
+class VectorIndex:
+    def __init__(self, vectors, metadata=None, normalized=False, scales=None):
+        # Con vectores ya normalizados (o cuantizados) no se copian, así que un
+        # arreglo con memoria mapeada sigue en disco hasta que se lee.
+        if normalized or scales is not None or vectors.dtype in (np.float16, np.int8):
+            self.vectors = vectors
+        else:
+            self.vectors = normalize_rows(vectors)
+        self.scales = scales
+        if isinstance(metadata, pd.DataFrame):
+            metadata = ColumnarMetadata.from_dataframe(metadata)
+        self.metadata = metadata
+        self.centroids = None
+        self.lists = None
+        self._filters = None
+
+    @property
+    def filters(self):
+        # Columnas de filtrado como arreglos; se leen en la primera búsqueda filtrada.
+        if self._filters is None:
+            filters = {}
+            if self.metadata is not None:
+                for column in ("category", "subcategory"):
+                    if column in self.metadata:
+                        filters[column] = self.metadata[column]
+                for column in ("product_price", "product_quantity"):
+                    if column in self.metadata:
+                        filters[column] = np.asarray(self.metadata[column], dtype=np.float64)
+            self._filters = filters
+        return self._filters
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    def scores(self, query, rows=None):
+        # Similitud de la consulta (normalizada) con todas las filas o con `rows`.
+        vectors = self.vectors if rows is None else self.vectors[rows]
+        if vectors.dtype == np.float32:
+            scores = vectors @ query
+        else:
+            scores = np.empty(len(vectors), dtype=np.float32)
+            for start in range(0, len(vectors), SCORE_BLOCK_ROWS):
+                block = vectors[start:start + SCORE_BLOCK_ROWS]
+                scores[start:start + SCORE_BLOCK_ROWS] = block.astype(np.float32) @ query
+        if self.scales is not None:
+            scores *= self.scales if rows is None else self.scales[rows]
+        return scores
+
+    def filter_mask(self, category=None, subcategory=None, min_price=None, max_price=None, in_stock=False):
+        # Máscara booleana de filas que cumplen los filtros (None si no hay filtros).
+        if category is None and subcategory is None and min_price is None and max_price is None and not in_stock:
+            return None
+        conditions = []
+        if category is not None and "category" in self.filters:
+            conditions.append(self.filters["category"] == category)
+        if subcategory is not None and "subcategory" in self.filters:
+            conditions.append(self.filters["subcategory"] == subcategory)
+        if min_price is not None and "product_price" in self.filters:
+            conditions.append(self.filters["product_price"] >= min_price)
+        if max_price is not None and "product_price" in self.filters:
+            conditions.append(self.filters["product_price"] <= max_price)
+        if in_stock and "product_quantity" in self.filters:
+            conditions.append(self.filters["product_quantity"] > 0)
+
+        if not conditions:
+            return None
+        return np.logical_and.reduce(conditions)
+
+    def build_ivf(self, n_lists=None, iterations=10, seed=0):
+        # Agrupa los vectores con k-means esférico para la búsqueda aproximada.
+        total = len(self)
+        if total == 0:
+            return
+        n_lists = n_lists or max(1, int(np.sqrt(total)))
+        n_lists = min(n_lists, total)
+
+        vectors = dequantize(self.vectors, self.scales)
+        rng = np.random.default_rng(seed)
+        centroids = vectors[rng.choice(total, n_lists, replace=False)].copy()
+        for _ in range(iterations):
+            assignments = np.argmax(vectors @ centroids.T, axis=1)
+            for cluster in range(n_lists):
+                members = vectors[assignments == cluster]
+                if len(members):
+                    centroids[cluster] = members.sum(axis=0)
+            centroids = normalize_rows(centroids)
+
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        self.centroids = centroids
+        self.lists = [np.flatnonzero(assignments == cluster) for cluster in range(n_lists)]
+
+    def candidate_rows(self, query, n_probe):
+        # Filas de las `n_probe` listas IVF más cercanas a la consulta.
+        closest_lists = top_k(self.centroids @ query, n_probe)
+        return np.sort(np.concatenate([self.lists[cluster] for cluster in closest_lists]))
+
+    def search(self, query_vector, k=5, approximate=False, n_probe=8, **filters):
+        # Devuelve (filas, similitudes) de los k productos más parecidos a la consulta.
+        query = normalize_rows(np.asarray(query_vector).reshape(1, -1))[0]
+
+        rows = None
+        if approximate and self.lists is not None:
+            rows = self.candidate_rows(query, n_probe)
+
+        mask = self.filter_mask(**filters)
+        if mask is not None:
+            rows = np.flatnonzero(mask) if rows is None else rows[mask[rows]]
+
+        scores = self.scores(query, rows)
+        best = top_k(scores, k)
+        if rows is None:
+            return best, scores[best]
+        return rows[best], scores[best]
+
+    def search_batch(self, query_vectors, k=5):
+        # Búsqueda exacta de varias consultas con un solo producto de matrices
+        # por bloque; devuelve una lista de (filas, similitudes) por consulta.
+        queries = normalize_rows(np.asarray(query_vectors).reshape(len(query_vectors), -1))
+        scores = np.empty((len(self), len(queries)), dtype=np.float32)
+        for start in range(0, len(self), SCORE_BLOCK_ROWS):
+            block = self.vectors[start:start + SCORE_BLOCK_ROWS]
+            scores[start:start + SCORE_BLOCK_ROWS] = block.astype(np.float32, copy=False) @ queries.T
+        if self.scales is not None:
+            scores *= self.scales[:, None]
+        results = []
+        for column in range(len(queries)):
+            best = top_k(scores[:, column], k)
+            results.append((best, scores[best, column]))
+        return results
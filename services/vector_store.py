@@ -0,0 +1,308 @@
+import pandas as pd
+import numpy as np
+import numbers
+import shutil
+import json
+import time
+import uuid
+import os
+
+# Artefactos versionados de los vectores de productos del chatbot:
+#
+#   utils/product_vectors/
+#       CURRENT                  nombre de la versión publicada
+#       <versión>/manifest.json  modelo, tipo de los vectores y columnas
+#       <versión>/vectors.npy    vectores normalizados (float32, float16 o int8)
+#       <versión>/scales.npy     escala por fila (solo int8)
+#       <versión>/id_order.npy   filas ordenadas por id (índice id -> fila)
+#       <versión>/columns/       metadatos por columna (incluye content_hash)
+#
+# Todo se abre con memoria mapeada: cargar una versión es casi instantáneo y
+# solo ocupan RAM las páginas que se leen. Las columnas numéricas son .npy y
+# las de texto un bloque UTF-8 con desplazamientos por fila.
+#
+# Cada versión se escribe completa en un directorio temporal y se publica
+# renombrándolo y reemplazando CURRENT con os.replace, así que un proceso que
+# lee nunca ve archivos a medio escribir. Si no hay CURRENT se usan los
+# archivos sueltos antiguos (utils/product_vectors.npy y product_metadata.csv).
+
+# Modelo con el que se generan los vectores (el chatbot usa el mismo para las consultas)
+MODEL_NAME = os.getenv("CHAT_EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+VECTORS_DIR = os.getenv("PRODUCT_VECTORS_DIR", "utils/product_vectors")
+CURRENT_PATH = os.path.join(VECTORS_DIR, "CURRENT")
+LEGACY_VECTORS_PATH = "utils/product_vectors.npy"
+LEGACY_METADATA_PATH = "utils/product_metadata.csv"
+# Versiones que se conservan en disco además de la publicada
+KEEP_VERSIONS = int(os.getenv("PRODUCT_VECTORS_KEEP", "3"))
+# Tipo con el que se guardan los vectores: float32, float16 o int8
+VECTOR_DTYPE = os.getenv("PRODUCT_VECTORS_DTYPE", "float32")
+VECTOR_DTYPES = ("float32", "float16", "int8")
+
+
+def quantize(vectors, dtype=VECTOR_DTYPE):
+    # Normaliza y convierte los vectores; devuelve (vectores, escalas o None).
+    # En int8 cada fila se guarda como round(v / escala) con escala = max|v| / 127.
+    if dtype not in VECTOR_DTYPES:
+        raise ValueError(f"Tipo de vectores no soportado: {dtype}")
+
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    vectors = vectors / norms
+
+    if dtype == "float32":
+        return vectors, None
+    if dtype == "float16":
+        return vectors.astype(np.float16), None
+
+    scales = np.abs(vectors).max(axis=1) / 127
+    scales[scales == 0] = 1.0
+    quantized = np.rint(vectors / scales[:, None]).astype(np.int8)
+    return quantized, scales.astype(np.float32)
+
+
+def dequantize(vectors, scales=None):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors * scales[:, None] if scales is not None else vectors
+
+
+class StringColumn:
+    # Columna de texto: bloque UTF-8 y desplazamientos; decodifica solo las filas pedidas.
+    def __init__(self, data, offsets, nulls=None):
+        self.data = data
+        self.offsets = offsets
+        self.nulls = nulls
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row):
+        if self.nulls is not None and self.nulls[row]:
+            return None
+        return bytes(self.data[self.offsets[row]:self.offsets[row + 1]]).decode("utf-8")
+
+    def to_numpy(self):
+        return np.array([self[row] for row in range(len(self))], dtype=object)
+
+    @classmethod
+    def from_values(cls, values):
+        nulls = np.array([value is None or (isinstance(value, float) and np.isnan(value)) for value in values], dtype=bool)
+        encoded = [b"" if null else str(value).encode("utf-8") for value, null in zip(values, nulls)]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(value) for value in encoded])
+        data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        return cls(data, offsets, nulls if nulls.any() else None)
+
+
+def _is_numeric(series):
+    if pd.api.types.is_numeric_dtype(series):
+        return True
+    # Las columnas DECIMAL llegan de la base de datos como objetos
+    values = series.dropna()
+    return len(values) > 0 and all(
+        isinstance(value, numbers.Number) and not isinstance(value, bool) for value in values
+    )
+
+
+class ColumnarMetadata:
+    # Metadatos de productos por columnas: arreglos numéricos y columnas de texto.
+    def __init__(self, columns):
+        self._columns = columns
+        self._decoded = {}
+
+    @property
+    def columns(self):
+        return list(self._columns)
+
+    def __len__(self):
+        return len(next(iter(self._columns.values()))) if self._columns else 0
+
+    def __contains__(self, column):
+        return column in self._columns
+
+    def __getitem__(self, column):
+        # Columna completa como arreglo (las de texto se decodifican una vez).
+        values = self._columns[column]
+        if not isinstance(values, StringColumn):
+            return values
+        if column not in self._decoded:
+            self._decoded[column] = values.to_numpy()
+        return self._decoded[column]
+
+    def records(self, rows, columns=None):
+        # Filas indicadas como diccionarios, leyendo solo esas posiciones.
+        columns = columns or self.columns
+        records = []
+        for row in rows:
+            record = {}
+            for column in columns:
+                value = self._columns[column][row]
+                record[column] = value.item() if isinstance(value, np.generic) else value
+            records.append(record)
+        return records
+
+    @classmethod
+    def from_dataframe(cls, df):
+        columns = {}
+        for column in df.columns:
+            series = df[column]
+            if _is_numeric(series):
+                values = pd.to_numeric(series)
+                if pd.api.types.is_integer_dtype(values):
+                    columns[column] = values.to_numpy(dtype=np.int64)
+                else:
+                    columns[column] = values.to_numpy(dtype=np.float64, na_value=np.nan)
+            else:
+                columns[column] = StringColumn.from_values(series.tolist())
+        return cls(columns)
+
+    def save(self, directory):
+        # Escribe cada columna; devuelve {columna: "numeric" | "string"} para el manifiesto.
+        os.makedirs(directory, exist_ok=True)
+        kinds = {}
+        for column, values in self._columns.items():
+            path = os.path.join(directory, column)
+            if isinstance(values, StringColumn):
+                np.save(f"{path}.offsets.npy", values.offsets)
+                np.asarray(values.data, dtype=np.uint8).tofile(f"{path}.utf8")
+                if values.nulls is not None:
+                    np.save(f"{path}.nulls.npy", values.nulls)
+                kinds[column] = "string"
+            else:
+                np.save(f"{path}.npy", values)
+                kinds[column] = "numeric"
+        return kinds
+
+    @classmethod
+    def open(cls, directory, kinds):
+        columns = {}
+        for column, kind in kinds.items():
+            path = os.path.join(directory, column)
+            if kind == "numeric":
+                columns[column] = np.load(f"{path}.npy", mmap_mode="r")
+                continue
+            offsets = np.load(f"{path}.offsets.npy", mmap_mode="r")
+            # np.memmap no admite archivos vacíos
+            data = np.memmap(f"{path}.utf8", dtype=np.uint8, mode="r") if offsets[-1] else np.empty(0, np.uint8)
+            nulls = np.load(f"{path}.nulls.npy") if os.path.exists(f"{path}.nulls.npy") else None
+            columns[column] = StringColumn(data, offsets, nulls)
+        return cls(columns)
+
+
+class ProductStore:
+    # Una versión abierta: vectores (posiblemente cuantizados), escalas,
+    # metadatos por columnas e índice id -> fila.
+    def __init__(self, vectors, metadata, scales=None, id_order=None, version=None, manifest=None):
+        self.vectors = vectors
+        self.scales = scales
+        self.metadata = metadata
+        self.version = version
+        self.manifest = manifest or {}
+        self.ids = np.asarray(metadata["id"], dtype=np.int64) if "id" in metadata else None
+        if id_order is None and self.ids is not None:
+            id_order = np.argsort(self.ids, kind="stable")
+        self.id_order = id_order
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def rows_for_ids(self, product_ids):
+        # Filas de los ids indicados (-1 si el producto no está en la versión).
+        product_ids = np.asarray(product_ids, dtype=np.int64)
+        if not len(self.id_order):
+            return np.full(len(product_ids), -1, dtype=np.int64)
+        sorted_ids = self.ids[self.id_order]
+        positions = np.minimum(np.searchsorted(sorted_ids, product_ids), len(sorted_ids) - 1)
+        return np.where(sorted_ids[positions] == product_ids, self.id_order[positions], -1)
+
+    def dense_vectors(self):
+        return dequantize(self.vectors, self.scales)
+
+
+def get_current_version():
+    try:
+        with open(CURRENT_PATH) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def get_data_version():
+    # Versión publicada o, con los archivos antiguos, su fecha y tamaño.
+    version = get_current_version()
+    if version is not None:
+        return version
+    stat = os.stat(LEGACY_VECTORS_PATH)
+    return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+
+def open_store(version=None):
+    # Abre una versión (por defecto la publicada) con memoria mapeada; sin
+    # versiones publicadas lee los archivos antiguos en memoria.
+    version = version or get_current_version()
+    if version is None:
+        metadata = ColumnarMetadata.from_dataframe(pd.read_csv(LEGACY_METADATA_PATH))
+        return ProductStore(np.load(LEGACY_VECTORS_PATH), metadata)
+
+    return read_store(os.path.join(VECTORS_DIR, version))
+
+
+def read_store(directory):
+    with open(os.path.join(directory, "manifest.json")) as f:
+        manifest = json.load(f)
+    scales_path = os.path.join(directory, "scales.npy")
+    return ProductStore(
+        np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r"),
+        ColumnarMetadata.open(os.path.join(directory, "columns"), manifest["columns"]),
+        scales=np.load(scales_path, mmap_mode="r") if os.path.exists(scales_path) else None,
+        id_order=np.load(os.path.join(directory, "id_order.npy"), mmap_mode="r"),
+        version=manifest.get("version", os.path.basename(directory)),
+        manifest=manifest,
+    )
+
+
+def write_store(directory, vectors, metadata, manifest, dtype=VECTOR_DTYPE):
+    # Escribe vectores, metadatos (DataFrame) e índice de ids en `directory`.
+    os.makedirs(directory)
+    stored, scales = quantize(vectors, dtype)
+    np.save(os.path.join(directory, "vectors.npy"), stored)
+    if scales is not None:
+        np.save(os.path.join(directory, "scales.npy"), scales)
+    np.save(os.path.join(directory, "id_order.npy"), np.argsort(metadata["id"].to_numpy(dtype=np.int64), kind="stable"))
+
+    columns = ColumnarMetadata.from_dataframe(metadata).save(os.path.join(directory, "columns"))
+    manifest = dict(manifest, dtype=dtype, dim=int(stored.shape[1]), columns=columns)
+    with open(os.path.join(directory, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def publish_version(vectors, metadata, manifest, dtype=VECTOR_DTYPE):
+    # Escribe una versión nueva y la publica de forma atómica; devuelve su nombre.
+    os.makedirs(VECTORS_DIR, exist_ok=True)
+    version = f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    tmp_dir = os.path.join(VECTORS_DIR, f".tmp-{version}")
+    write_store(tmp_dir, vectors, metadata, dict(manifest, version=version), dtype=dtype)
+    os.rename(tmp_dir, os.path.join(VECTORS_DIR, version))
+
+    tmp_current = f"{CURRENT_PATH}.tmp"
+    with open(tmp_current, "w") as f:
+        f.write(version)
+    os.replace(tmp_current, CURRENT_PATH)
+
+    prune_versions(keep=KEEP_VERSIONS)
+    return version
+
+
+def prune_versions(keep=KEEP_VERSIONS):
+    # Borra las versiones más antiguas que no están publicadas.
+    current = get_current_version()
+    versions = sorted(
+        (
+            os.path.join(VECTORS_DIR, name) for name in os.listdir(VECTORS_DIR)
+            if name != current and not name.startswith(".") and os.path.isdir(os.path.join(VECTORS_DIR, name))
+        ),
+        key=os.path.getmtime,
+    )
+    for path in versions[:max(0, len(versions) - keep)]:
+        shutil.rmtree(path, ignore_errors=True)
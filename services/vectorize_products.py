@@ -1,9 +1,17 @@
 from sentence_transformers import SentenceTransformer
+from services import vector_store
 from models.models import MarketechProduct
 from database.database import init_app
 from flask import Flask
 import pandas as pd
 import numpy as np
+import argparse
+import hashlib
+import time
+import os
+
+# Productos por llamada a model.encode al regenerar vectores
+VECTORIZE_BATCH_SIZE = int(os.getenv("VECTORIZE_BATCH_SIZE", "256"))
 
 def get_product_data():
     # Consulta los productos de la base de datos
@@ -24,44 +32,102 @@ def get_product_data():
         for product in products
     ]
 
-def vectorize_products():
-    # Cargar el modelo de embeddings
-    model = SentenceTransformer("all-MiniLM-L6-v2")
+def describe_product(p):
+    # Combinar datos relevantes en una descripción única para cada producto
+    return (
+        f"Producto: {p['product_name']} - "
+        f"Descripción: {p['product_description']} - "
+        f"Marca: {p['product_mark']} - "
+        f"Modelo: {p['product_model']} - "
+        f"(Categoría: {p['category']}, Subcategoría: {p['subcategory']}) - "
+        f"Precio: {p['product_price']} - "
+        f"Descuento: {p['product_discount']} - "
+        f"Cantidad: {p['product_quantity']} - "
+    )
+
+def content_hash(description):
+    return hashlib.sha1(description.encode("utf-8")).hexdigest()
+
+def load_previous_vectors(dtype=vector_store.VECTOR_DTYPE):
+    # Vectores de la versión publicada por content_hash, si se generaron con el
+    # mismo modelo; las versiones antiguas sin hashes no se pueden reutilizar.
+    # Tampoco se reutilizan si se guardaron con menos precisión que `dtype`
+    # (p. ej. int8 -> float32): se volverían a guardar con el error de cuantización.
+    if vector_store.get_current_version() is None:
+        return {}
+    store = vector_store.open_store()
+    if store.manifest.get("model") != vector_store.MODEL_NAME or "content_hash" not in store.metadata:
+        return {}
+    previous_dtype = store.manifest.get("dtype", "float32")
+    if vector_store.VECTOR_DTYPES.index(previous_dtype) > vector_store.VECTOR_DTYPES.index(dtype):
+        return {}
+    return dict(zip(store.metadata["content_hash"], store.dense_vectors()))
+
+def encode_in_batches(model, descriptions, batch_size):
+    batches = [
+        model.encode(descriptions[start:start + batch_size], batch_size=batch_size)
+        for start in range(0, len(descriptions), batch_size)
+    ]
+    return np.concatenate(batches) if batches else np.empty((0, 0), dtype=np.float32)
 
+def vectorize_products(incremental=True, batch_size=VECTORIZE_BATCH_SIZE, dtype=vector_store.VECTOR_DTYPE, model=None):
     # Obtener datos de los productos
     product_data = get_product_data()
     if not product_data:
         print("No hay productos disponibles en la base de datos.")
-        return
+        return None
 
-    # Combinar datos relevantes en una descripción única para cada producto
-    product_descriptions = [
-        (
-            f"Producto: {p['product_name']} - "
-            f"Descripción: {p['product_description']} - "
-            f"Marca: {p['product_mark']} - "
-            f"Modelo: {p['product_model']} - "
-            f"(Categoría: {p['category']}, Subcategoría: {p['subcategory']}) - "
-            f"Precio: {p['product_price']} - "
-            f"Descuento: {p['product_discount']} - "
-            f"Cantidad: {p['product_quantity']} - "
-        )
-        for p in product_data
-    ]
+    descriptions = [describe_product(p) for p in product_data]
+    hashes = [content_hash(description) for description in descriptions]
 
-    # Generar embeddings para las descripciones
-    product_vectors = model.encode(product_descriptions)
+    # Solo se codifican los productos nuevos o cuya descripción cambió; los
+    # eliminados desaparecen porque la versión se arma desde la base de datos.
+    previous = load_previous_vectors(dtype) if incremental else {}
+    pending = [position for position, h in enumerate(hashes) if h not in previous]
+    unchanged = not pending and set(previous) == set(hashes)
+    if incremental and unchanged and vector_store.open_store().manifest.get("dtype") == dtype:
+        print("Sin cambios en el catálogo; se mantiene la versión publicada.")
+        return vector_store.get_current_version()
 
-    # Guardar los vectores y los metadatos
-    np.save("utils/product_vectors.npy", product_vectors)
-    pd.DataFrame(product_data).to_csv("utils/product_metadata.csv", index=False)
-    print("¡Vectorización completada!")
+    start = time.perf_counter()
+    encoded = []
+    if pending:
+        # Cargar el modelo de embeddings
+        model = model or SentenceTransformer(vector_store.MODEL_NAME)
+        encoded = encode_in_batches(model, [descriptions[position] for position in pending], batch_size)
+    encoded_by_position = dict(zip(pending, encoded))
+    product_vectors = np.stack([
+        encoded_by_position[position] if position in encoded_by_position else previous[h]
+        for position, h in enumerate(hashes)
+    ]).astype(np.float32)
+
+    # Guardar los vectores y los metadatos como una versión nueva
+    metadata = pd.DataFrame(product_data)
+    metadata["content_hash"] = hashes
+    version = vector_store.publish_version(product_vectors, metadata, {
+        "model": vector_store.MODEL_NAME,
+        "products": len(product_data),
+        "encoded": len(pending),
+        "reused": len(product_data) - len(pending),
+        "encode_seconds": round(time.perf_counter() - start, 3),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }, dtype=dtype)
+    print(f"¡Vectorización completada! Versión {version}: {len(pending)} productos codificados, "
+          f"{len(product_data) - len(pending)} reutilizados.")
+    return version
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--full", action="store_true", help="Vuelve a codificar todo el catálogo")
+    parser.add_argument("--batch-size", type=int, default=VECTORIZE_BATCH_SIZE)
+    parser.add_argument("--dtype", choices=vector_store.VECTOR_DTYPES, default=vector_store.VECTOR_DTYPE,
+                        help="Tipo con el que se guardan los vectores")
+    args = parser.parse_args()
+
     # Inicializar la aplicación Flask
     app = Flask(__name__)
     init_app(app)
 
     # Ejecutar dentro del contexto de la aplicación
     with app.app_context():
-        vectorize_products()
\ No newline at end of file
+        vectorize_products(incremental=not args.full, batch_size=args.batch_size, dtype=args.dtype)
@@ -0,0 +1,232 @@
+from models.models import MarketechProductVisited
+from services.metrics import span
+from database.database import db
+from flask import current_app
+from sqlalchemy import exc
+from datetime import datetime, timezone
+import threading
+import atexit
+import time
+import os
+
+# Registro de visitas con escritura diferida (write-behind).
+#
+# POST /product_visited deja los eventos en un buffer en memoria y responde
+# sin esperar a la base de datos. Un hilo por proceso los inserta con INSERT
+# de varias filas cuando hay VISIT_FLUSH_SIZE eventos o pasan
+# VISIT_FLUSH_INTERVAL segundos, y al terminar el proceso (atexit y el hook
+# worker_exit de gunicorn).
+#
+# Si el buffer llega a VISIT_BUFFER_MAX, las nuevas peticiones esperan hasta
+# VISIT_BACKPRESSURE_TIMEOUT segundos a que se vacíe; si no, se rechazan
+# (BufferFull -> 503 con Retry-After) en lugar de crecer sin límite.
+#
+# Tras cada inserción se llama a las funciones de `visit_listeners` con las
+# filas insertadas (p. ej. la popularidad del puntaje híbrido). Las visitas
+# guardadas en el buffer se pierden si el proceso muere sin pasar por atexit.
+# Las que llegan después de stop() (peticiones aún en curso al apagar el
+# worker) se insertan en la misma petición.
+
+VISIT_FLUSH_SIZE = int(os.getenv("VISIT_FLUSH_SIZE", "500"))
+VISIT_FLUSH_INTERVAL = float(os.getenv("VISIT_FLUSH_INTERVAL", "1.0"))
+VISIT_BUFFER_MAX = int(os.getenv("VISIT_BUFFER_MAX", "20000"))
+VISIT_BACKPRESSURE_TIMEOUT = float(os.getenv("VISIT_BACKPRESSURE_TIMEOUT", "0.5"))
+
+table = MarketechProductVisited.__table__
+
+# Funciones llamadas con la lista de filas tras cada inserción
+visit_listeners = []
+
+
+class BufferFull(Exception):
+    pass
+
+
+class VisitBuffer:
+    def __init__(self, flush_size=VISIT_FLUSH_SIZE, flush_interval=VISIT_FLUSH_INTERVAL, max_size=VISIT_BUFFER_MAX):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_size = max_size
+        self.stats = {"accepted": 0, "inserted": 0, "flushes": 0, "rejected": 0, "invalid": 0, "errors": 0}
+        self._events = []
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._app = None
+        self._stopping = False
+
+    def __len__(self):
+        return len(self._events)
+
+    def add(self, events, timeout=VISIT_BACKPRESSURE_TIMEOUT):
+        # Encola filas {user_id, product_id, visited_at}; espera si el buffer está lleno.
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while len(self._events) + len(events) > self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or len(events) > self.max_size:
+                    self.stats["rejected"] += len(events)
+                    raise BufferFull("El buffer de visitas está lleno, inténtalo de nuevo en unos segundos.")
+                self._condition.notify_all()
+                self._condition.wait(remaining)
+            self._events.extend(events)
+            self.stats["accepted"] += len(events)
+            if len(self._events) >= self.flush_size:
+                self._condition.notify_all()
+            stopping = self._stopping
+        if stopping:
+            # Tras stop() ningún hilo volverá a vaciar el buffer: se insertan ya
+            self.flush()
+            return
+        self._ensure_thread()
+
+    def _ensure_thread(self):
+        if self._thread is not None:
+            return
+        with self._condition:
+            if self._thread is None:
+                self._app = current_app._get_current_object()
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        last_flush = time.monotonic()
+        while True:
+            with self._condition:
+                while not self._stopping and len(self._events) < self.flush_size:
+                    remaining = self.flush_interval - (time.monotonic() - last_flush)
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                stopping = self._stopping
+            if stopping:
+                return
+            with self._app.app_context():
+                self.flush()
+            last_flush = time.monotonic()
+
+    def flush(self):
+        # Inserta todo lo pendiente (requiere contexto de aplicación); devuelve las filas insertadas.
+        with self._flush_lock:
+            with self._condition:
+                batch, self._events = self._events, []
+                self._condition.notify_all()
+            if not batch:
+                return 0
+
+            with span("visit_flush"):
+                try:
+                    inserted = self._insert(batch)
+                except Exception:
+                    db.session.rollback()
+                    self._requeue(batch)
+                    return 0
+
+            with self._condition:
+                self.stats["flushes"] += 1
+                self.stats["inserted"] += len(inserted)
+            for listener in visit_listeners:
+                try:
+                    listener(inserted)
+                except Exception:
+                    db.session.rollback()
+            return len(inserted)
+
+    def _insert(self, batch):
+        try:
+            for start in range(0, len(batch), self.flush_size):
+                db.session.execute(table.insert(), batch[start:start + self.flush_size])
+            db.session.commit()
+            return batch
+        except exc.IntegrityError:
+            # Un usuario o producto inexistente invalida todo el INSERT: se
+            # reintenta fila por fila y se descartan las inválidas.
+            db.session.rollback()
+            inserted = []
+            for row in batch:
+                try:
+                    db.session.execute(table.insert(), [row])
+                    db.session.commit()
+                    inserted.append(row)
+                except exc.IntegrityError:
+                    db.session.rollback()
+                    with self._condition:
+                        self.stats["invalid"] += 1
+            return inserted
+
+    def _requeue(self, batch):
+        # La base de datos falló: las filas vuelven al inicio del buffer si caben.
+        with self._condition:
+            self.stats["errors"] += 1
+            room = max(self.max_size - len(self._events), 0)
+            self.stats["rejected"] += max(len(batch) - room, 0)
+            self._events[:0] = batch[:room]
+
+    def snapshot(self):
+        # Estadísticas y eventos pendientes leídos a la vez (bajo el mismo lock que los actualiza)
+        with self._condition:
+            return {"buffered": len(self._events), **self.stats}
+
+    def stop(self):
+        # Detiene el hilo e inserta lo que quede (llamado al terminar el proceso).
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout=max(self.flush_interval, 1.0) + 5)
+        if self._app is not None and self._events:
+            with self._app.app_context():
+                self.flush()
+
+
+visit_buffer = VisitBuffer()
+atexit.register(visit_buffer.stop)
+
+
+def parse_id(value):
+    # Identificador entero positivo; rechaza booleanos y números con decimales.
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        raise ValueError(value)
+    value = int(value)
+    if value <= 0:
+        raise ValueError(value)
+    return value
+
+
+def parse_visits(data):
+    # Acepta una visita ({user_id, product_id, visited_at?}), una lista o
+    # {"visits": [...]}; lanza ValueError si algún campo no es válido.
+    if isinstance(data, dict) and "visits" in data:
+        data = data["visits"]
+    visits = data if isinstance(data, list) else [data]
+    if not visits:
+        raise ValueError('Se requiere al menos una visita.')
+
+    received_at = datetime.utcnow()
+    rows = []
+    for visit in visits:
+        if not isinstance(visit, dict):
+            raise ValueError('Cada visita debe ser un objeto con "user_id" y "product_id".')
+        try:
+            row = {"user_id": parse_id(visit["user_id"]), "product_id": parse_id(visit["product_id"])}
+        except (KeyError, TypeError, ValueError):
+            raise ValueError('Cada visita requiere "user_id" y "product_id" enteros positivos.')
+        visited_at = visit.get("visited_at")
+        try:
+            row["visited_at"] = datetime.fromisoformat(visited_at) if visited_at else received_at
+        except (TypeError, ValueError):
+            raise ValueError('"visited_at" debe tener formato ISO 8601.')
+        # Las fechas se guardan en UTC sin zona horaria, como visited_at por defecto
+        if row["visited_at"].tzinfo is not None:
+            row["visited_at"] = row["visited_at"].astimezone(timezone.utc).replace(tzinfo=None)
+        rows.append(row)
+    return rows
+
+
+def record_visits(rows):
+    visit_buffer.add(rows)
+
+
+def get_ingestion_stats():
+    return visit_buffer.snapshot()
@@ -0,0 +1,56 @@
+from datetime import datetime, timedelta
+import tempfile
+import pytest
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# La aplicación se importa con una base SQLite temporal y sin cargar el modelo
+# de embeddings del chatbot.
+_workdir = tempfile.mkdtemp(prefix="marketech-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_workdir, 'tests.db')}"
+os.environ["CHAT_PRELOAD"] = "manual"
+os.environ.pop("DATABASE_REPLICA_URL", None)
+os.environ.pop("DB_REPLICA_HOST", None)
+
+
+@pytest.fixture(scope="session")
+def app():
+    from database.database import db
+    from models.models import (
+        MarketechUser, MarketechProduct, MarketechProductVisited, MarketechSearchHistory,
+        MarketechWishList, MarketechShoppingCart,
+    )
+    import main
+
+    with main.app.app_context():
+        # marketech_sellers no tiene modelo en este servicio (ver benchmarks/synthetic_data.py)
+        if "marketech_sellers" not in db.metadata.tables:
+            db.Table("marketech_sellers", db.metadata, db.Column("id", db.Integer, primary_key=True))
+        db.create_all()
+        db.session.execute(db.metadata.tables["marketech_sellers"].insert(), [{"id": 1}])
+
+        now = datetime.utcnow()
+        db.session.add(MarketechUser(id=1, name="Ana", last_name="Prueba", email="ana@example.com", password="x", dni="10000001"))
+        for product_id in range(1, 4):
+            db.session.add(MarketechProduct(
+                id=product_id, seller_id=1, product_name=f"Teclado {product_id}", product_mark="Logitech",
+                product_model=f"K{product_id}", product_description="Teclado mecánico", product_price=50.0,
+                product_discount=0, product_quantity=5, category="Periféricos", subcategory="Teclados",
+                created_at=now - timedelta(days=product_id),
+            ))
+        db.session.flush()
+        for product_id in range(1, 4):
+            db.session.add(MarketechProductVisited(user_id=1, product_id=product_id, visited_at=now - timedelta(hours=product_id)))
+            db.session.add(MarketechSearchHistory(user_id=1, search_term=f"teclado {product_id}", created_at=now))
+            db.session.add(MarketechWishList(user_id=1, product_id=product_id, created_at=now))
+            db.session.add(MarketechShoppingCart(user_id=1, product_id=product_id, cantidad=1, created_at=now))
+        db.session.commit()
+
+    yield main.app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
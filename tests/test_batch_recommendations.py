@@ -0,0 +1,7 @@
+import pytest
+
+
+@pytest.mark.parametrize("user_id", [True, 1.9, 0, -3, "uno", None])
+def test_batch_rejects_invalid_user_ids(client, user_id):
+    response = client.post("/recommendations_ids/batch", json={"user_ids": [user_id]})
+    assert response.status_code == 400
@@ -0,0 +1,34 @@
+from services import catalog_index
+import logging
+import pytest
+
+
+@pytest.fixture
+def fresh_index(monkeypatch):
+    for name, value in (("_index", None), ("_signature", None), ("_built", False),
+                        ("_changes", 0), ("_built_changes", 0), ("_retry_at", 0.0)):
+        monkeypatch.setattr(catalog_index, name, value)
+
+
+def test_empty_catalog_is_built_once(app, monkeypatch, fresh_index):
+    builds = []
+    monkeypatch.setattr(catalog_index, "build_catalog_index", lambda: builds.append(1))
+    monkeypatch.setattr(catalog_index, "get_catalog_signature", lambda: (0, None, "0"))
+
+    with app.app_context():
+        assert catalog_index.get_catalog_index() is None
+        assert catalog_index.get_catalog_index() is None
+    assert len(builds) == 1
+
+
+def test_failed_rebuild_is_logged_and_stays_pending(app, monkeypatch, caplog, fresh_index):
+    def failing_build():
+        raise RuntimeError("sin conexión")
+
+    monkeypatch.setattr(catalog_index, "build_catalog_index", failing_build)
+    monkeypatch.setattr(catalog_index, "_changes", 1)
+    with caplog.at_level(logging.ERROR, logger=catalog_index.__name__):
+        catalog_index._rebuild_in_background(app, 1, check_signature=False)
+
+    assert caplog.records[0].exc_info is not None
+    assert catalog_index._built_changes == 0
@@ -0,0 +1,23 @@
+from services import chat_resources
+import numpy as np
+
+
+class RecordingModel:
+    def __init__(self):
+        self.calls = []
+
+    def encode(self, texts, **kwargs):
+        self.calls.append(list(texts))
+        return np.ones((len(texts), 4), dtype=np.float32)
+
+
+def test_encode_queries_sends_original_text(monkeypatch):
+    model = RecordingModel()
+    monkeypatch.setattr(chat_resources, "model", model)
+    chat_resources.embedding_cache.clear()
+
+    chat_resources.encode_queries(["¿Tienen Teclados RGB?", "tienen teclados rgb", "Mouse"])
+    chat_resources.encode_queries(["TIENEN teclados RGB"])
+
+    # Una sola llamada con el texto de la primera aparición de cada clave; la segunda sale de caché
+    assert model.calls == [["¿Tienen Teclados RGB?", "Mouse"]]
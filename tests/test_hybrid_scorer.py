@@ -0,0 +1,18 @@
+from services import hybrid_scorer
+from types import SimpleNamespace
+import pandas as pd
+import numpy as np
+
+
+def test_popularity_counts_align_with_index_rows(monkeypatch):
+    # Ids 10, 30, 20 en las filas 0, 1, 2; el 15 no está en el índice y el 40 y el 99 quedan fuera del mapa
+    row_by_id = np.full(31, -1, dtype=np.int64)
+    row_by_id[[10, 30, 20]] = [0, 1, 2]
+    index = SimpleNamespace(ids=np.array([10, 30, 20]), row_by_id=row_by_id)
+    popularity_df = pd.DataFrame({"product_id": [20, 99, 10, 40, 15], "popularity": [5, 7, 3, 2, 1]})
+    monkeypatch.setattr(hybrid_scorer, "get_popularity_matrix", lambda window=None: popularity_df)
+
+    counts = hybrid_scorer.compute_popularity_counts(index)
+
+    assert counts.dtype == np.float32
+    assert counts.tolist() == [3, 0, 5]
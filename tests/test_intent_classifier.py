@@ -0,0 +1,39 @@
+from services import chat_resources, intent_classifier
+import numpy as np
+import hashlib
+
+
+class HashModel:
+    # Vector determinista por texto exacto: textos distintos dan puntuaciones distintas
+    def encode(self, texts, **kwargs):
+        return np.array([
+            np.random.default_rng(int(hashlib.md5(text.encode("utf-8")).hexdigest()[:8], 16)).standard_normal(16)
+            for text in texts
+        ], dtype=np.float32)
+
+
+def test_classify_scores_examples_like_calibration(monkeypatch):
+    monkeypatch.setattr(chat_resources, "model", HashModel())
+    monkeypatch.setattr(intent_classifier, "_prototypes", None)
+    monkeypatch.setattr(intent_classifier, "INTENT_CONFIDENCE_THRESHOLD", None)
+    chat_resources.embedding_cache.clear()
+
+    calibrated = {}
+    cross_validate = intent_classifier.cross_validate
+
+    def recording_cross_validate(vectors, labels, folds):
+        calibrated["vectors"] = vectors
+        return cross_validate(vectors, labels, folds)
+
+    monkeypatch.setattr(intent_classifier, "cross_validate", recording_cross_validate)
+    intent_classifier.ensure_prototypes()
+    # Sin caché, classify vuelve a codificar la consulta por su propio camino
+    chat_resources.embedding_cache.clear()
+
+    questions, _ = intent_classifier.load_examples()
+    for position in (0, len(questions) // 2, len(questions) - 1):
+        label, confidence = intent_classifier.classify(questions[position])
+        labels, confidences = intent_classifier.classify_vectors(
+            calibrated["vectors"][position:position + 1], intent_classifier._labels, intent_classifier._prototypes)
+        assert label == labels[0]
+        assert confidence == float(confidences[0])
@@ -0,0 +1,17 @@
+import pytest
+
+
+@pytest.mark.parametrize("limit", ["abc", "1.5", "0", "101", ""])
+def test_popularity_ids_rejects_invalid_limit(client, limit):
+    response = client.get(f"/recommendations_popularity_ids?limit={limit}")
+    assert response.status_code == 400
+
+
+def test_popularity_ids_accepts_valid_limit(client):
+    assert client.get("/recommendations_popularity_ids?limit=2").status_code in (200, 404)
+
+
+@pytest.mark.parametrize("limit", ["abc", "0", "51"])
+def test_also_viewed_rejects_invalid_limit(client, limit):
+    response = client.get(f"/also_viewed/1?limit={limit}")
+    assert response.status_code == 400
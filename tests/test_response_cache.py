@@ -0,0 +1,31 @@
+from database.database import db
+from models.models import MarketechProduct
+from services.response_cache import response_cache
+
+
+def test_product_edit_invalidates_after_commit(app, client):
+    assert client.get("/product/2").status_code == 200
+
+    with app.app_context():
+        product = db.session.get(MarketechProduct, 2)
+        product.product_name = "Teclado editado"
+        db.session.flush()
+        # Hasta el commit otras conexiones leen la fila anterior: la entrada se conserva
+        assert response_cache.get("product:2") is not None
+        db.session.commit()
+        assert response_cache.get("product:2") is None
+
+    assert client.get("/product/2").get_json()["product_name"] == "Teclado editado"
+
+
+def test_rolled_back_edit_keeps_entry(app, client):
+    client.get("/product/3")
+
+    with app.app_context():
+        product = db.session.get(MarketechProduct, 3)
+        product.product_name = "Sin guardar"
+        db.session.flush()
+        db.session.rollback()
+
+    assert response_cache.get("product:3") is not None
+    assert client.get("/product/3").get_json()["product_name"] == "Teclado 3"
@@ -0,0 +1,42 @@
+from database.database import db
+from sqlalchemy import event
+import pytest
+
+
+@pytest.fixture
+def query_counter(app):
+    # Cuenta las sentencias SQL ejecutadas mientras está activo.
+    with app.app_context():
+        engine = db.engine
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", count)
+    yield statements
+    event.remove(engine, "before_cursor_execute", count)
+
+
+@pytest.mark.parametrize("url", [
+    "/product_visited/1",
+    "/search_history/1",
+    "/wishlist/1",
+    "/shoppingcart/1",
+])
+def test_user_list_uses_one_query(client, query_counter, url):
+    response = client.get(url)
+
+    assert response.status_code == 200
+    assert len(response.get_json()["items"]) == 3
+    assert len(query_counter) == 1, query_counter
+
+
+@pytest.mark.parametrize("url", ["/wishlist/1", "/shoppingcart/1"])
+def test_user_list_streaming_uses_one_query(client, query_counter, url):
+    response = client.get(url, headers={"Accept": "application/x-ndjson"})
+    lines = response.get_data(as_text=True).splitlines()
+
+    assert response.status_code == 200
+    assert len(lines) >= 3
+    assert len(query_counter) == 1, query_counter
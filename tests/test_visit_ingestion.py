@@ -0,0 +1,46 @@
+from database.database import db
+from models.models import MarketechProductVisited
+from services.visit_ingestion import VisitBuffer, parse_visits
+import pytest
+
+
+@pytest.mark.parametrize("visit", [
+    {"user_id": 0, "product_id": 1},
+    {"user_id": 1, "product_id": -1},
+    {"user_id": True, "product_id": 1},
+    {"user_id": 1, "product_id": 1.5},
+    {"user_id": "uno", "product_id": 1},
+])
+def test_parse_visits_rejects_invalid_ids(visit):
+    with pytest.raises(ValueError):
+        parse_visits(visit)
+
+
+def test_parse_visits_accepts_numeric_strings():
+    assert parse_visits({"user_id": "1", "product_id": 2.0})[0]["product_id"] == 2
+
+
+def test_post_rejects_negative_product_id(client):
+    response = client.post("/product_visited", json={"user_id": 1, "product_id": -1})
+    assert response.status_code == 400
+
+
+def test_add_after_stop_inserts_synchronously(app):
+    with app.app_context():
+        before = db.session.query(MarketechProductVisited).count()
+        buffer = VisitBuffer(flush_size=100)
+        buffer.stop()
+        buffer.add(parse_visits({"user_id": 1, "product_id": 2}))
+        assert len(buffer) == 0
+        assert db.session.query(MarketechProductVisited).count() == before + 1
+
+
+def test_snapshot_counts_flushed_rows(app):
+    with app.app_context():
+        buffer = VisitBuffer(flush_size=100)
+        buffer.add(parse_visits([{"user_id": 1, "product_id": 1}, {"user_id": 1, "product_id": 3}]))
+        buffer.flush()
+        buffer.stop()
+        stats = buffer.snapshot()
+    assert stats["buffered"] == 0
+    assert (stats["accepted"], stats["inserted"], stats["flushes"]) == (2, 2, 1)